@@ -1,60 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Writes foreground masks of the video found by the background subtraction
+(see helpers.background) - for checking the background model parameters
+before using it in the tracking. Runs without display, masks have the
+resolution of the input video.
+Example of use (from the project directory):
+    python background_subtractor.py --input CIMG4027.MOV --algo MOG2 \
+        --scale 0.5 --output fgMask.avi
+"""
 
-from __future__ import print_function
-import cv2 as cv
 import argparse
-
-parser = argparse.ArgumentParser(description='This program shows how to use background subtraction methods provided by \
-                                              OpenCV. You can process both videos and images.')
-parser.add_argument('--input', type=str, help='Path to a video or a sequence of image.', default='vtest.avi')
-parser.add_argument('--algo', type=str, help='Background subtraction method (KNN, MOG2).', default='MOG2')
-args = parser.parse_args()
-
-## [create]
-#create Background Subtractor objects
-if args.algo == 'MOG2':
-    backSub = cv.createBackgroundSubtractorMOG2()
-else:
-    backSub = cv.createBackgroundSubtractorKNN()
-## [create]
-
-## [capture]
-capture = cv.VideoCapture(cv.samples.findFileOrKeep(args.input))
-if not capture.isOpened:
-    print('Unable to open: ' + args.input)
-    exit(0)
-## [capture]
-
-fourcc = cv.VideoWriter_fourcc(*'MJPG')
-output = cv.VideoWriter('fgMask.avi', fourcc, 20, (1280, 720), isColor=False)
-
-while True:
-    ret, frame = capture.read()
-    if frame is None:
-        break
-
-    ## [apply]
-    #update the background model
-    fgMask = backSub.apply(frame)
-    ## [apply]
-
-    ## [display_frame_number]
-    #get the frame number and write it on the current frame
-    cv.rectangle(frame, (10, 2), (100,20), (255,255,255), -1)
-    cv.putText(frame, str(capture.get(cv.CAP_PROP_POS_FRAMES)), (15, 15),
-               cv.FONT_HERSHEY_SIMPLEX, 0.5 , (0,0,0))
-    ## [display_frame_number]
-
-    ## [show]
-    #show the current frame and the fg masks
-    cv.imshow('Frame', frame)
-    cv.imshow('FG Mask', fgMask)
-    ## [show]
-   
-    #import pdb; pdb.set_trace()
-    output.write(fgMask)
-
-    keyboard = cv.waitKey(30)
-    if keyboard == 'q' or keyboard == 27:
-        break
-
-output.release()
+import sys
+
+import cv2
+
+from helpers.background import BackgroundSubtractor
+from helpers.functions import iter_frames
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Foreground masks of the video found by the background '
+                    'subtraction methods provided by OpenCV.')
+    parser.add_argument('--input', default='vtest.avi',
+                        help='Path to a video or a sequence of images.')
+    parser.add_argument('--algo', default='MOG2', choices=('MOG2', 'KNN'),
+                        help='Background subtraction method.')
+    parser.add_argument('--scale', type=float, default=1.,
+                        help='Scale of the frames the background model is '
+                             'learned on.')
+    parser.add_argument('--history', type=int, default=500,
+                        help='Number of frames the model is learned from.')
+    parser.add_argument('--output', default='fgMask.avi',
+                        help='Output video of the foreground masks.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    capture = cv2.VideoCapture(cv2.samples.findFileOrKeep(args.input))
+    if not capture.isOpened():
+        sys.exit('Unable to open: ' + args.input)
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    background = BackgroundSubtractor(args.algo, args.scale, args.history)
+    fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+    output = cv2.VideoWriter(args.output, fourcc, 20, (width, height),
+                             isColor=False)
+    try:
+        for frame in iter_frames(capture, 0, frame_count - 1):
+            output.write(background.apply(frame))
+    finally:
+        output.release()
+
+
+if __name__ == '__main__':
+    main()
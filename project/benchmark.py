@@ -0,0 +1,306 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark on synthetic videos. For every blob count a video with
+known trajectories is generated (helpers.synthetic) and every stage of the
+tracking pipeline is run separately: decoding, preprocessing, detection,
+Kalman filter and results writing, then the whole streamed run. Frames per
+second and peak memory (Python and NumPy allocations, tracemalloc) of every
+stage, and detection precision and recall are written as JSON report.
+Example of use (from the project directory):
+    python -m benchmark --width 1280 --height 720 --frames 100 \
+        --blobs 10 100 1000 10000 --output benchmark.json
+Processing parameters are given the same way as for headless runs.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import cv2
+import numpy as np
+from scipy.spatial import cKDTree
+
+import headless
+from helpers import functions
+from helpers.background import background_from_parameters
+from helpers.functions import iter_frames, blob_detect
+from helpers.output import ResultsWriter, track_and_render
+from helpers.pipeline import binary_frame, detect_blobs, find_points, \
+    morphological, preprocess_frame, refine_full_resolution
+from helpers.pyramid import pyramid_level, scale_parameters
+from helpers.roi import region_from_parameters
+from helpers.synthetic import generate_video, save_ground_truth
+from helpers.thresholding import thresholder_from_parameters
+from helpers.tiling import tiler_from_parameters
+from helpers.tracking import kalman_tracking
+
+
+def measure(function, frames, memory=True):
+    """
+    Runs the function once.
+    :param function: function without arguments.
+    :param frames: number of frames processed by the function.
+    :param memory: trace peak memory of the function (slows allocations).
+    :return: result of the function, dictionary of statistics - seconds,
+             fps, peak_memory [B] (None if not traced).
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        # prints of the stages are not benchmarked
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            result = function()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return result, {
+        'seconds': seconds,
+        'fps': frames / seconds if seconds else None,
+        'peak_memory': peak,
+    }
+
+
+def detection_quality(measurements, truth, distance):
+    """
+    Compares measurements with visible ground truth blobs.
+    :param measurements: (x, y) points per frame.
+    :param truth: ground truth returned by generate_video().
+    :param distance: maximal distance [px] of matching point.
+    :return: dictionary - precision (part of measurements near a blob),
+             recall (part of visible blobs with a measurement near) and
+             mean_error - mean distance [px] of the matched measurements.
+    """
+    matched_points = points_count = matched_blobs = blobs_count = 0
+    error_sum = 0.
+    for frame_number, points in enumerate(measurements):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        visible = (truth['frame'] == frame_number) & truth['visible']
+        blobs = np.column_stack((truth['x'][visible], truth['y'][visible]))
+        points_count += len(points)
+        blobs_count += len(blobs)
+        if not len(points) or not len(blobs):
+            continue
+        distances = cKDTree(blobs).query(points)[0]
+        matched = distances <= distance
+        matched_points += np.sum(matched)
+        error_sum += np.sum(distances[matched])
+        matched_blobs += np.sum(cKDTree(points).query(blobs)[0] <= distance)
+    return {
+        'precision': matched_points / points_count if points_count else None,
+        'recall': matched_blobs / blobs_count if blobs_count else None,
+        'mean_error': error_sum / matched_points if matched_points else None,
+    }
+
+
+def benchmark_video(video_file, truth, frames, parameters, work_dir,
+                    memory=True, legacy=False, radius=5):
+    """
+    Runs stages of the tracking pipeline on the video one after another.
+    :param video_file: path of the synthetic video.
+    :param truth: ground truth returned by generate_video().
+    :param frames: number of frames of the video.
+    :param parameters: dictionary of processing and tracking parameters.
+    :param work_dir: directory for the output files.
+    :param memory: trace peak memory of the stages.
+    :param legacy: benchmark also functions.video_analise() and
+                   functions.kalman().
+    :param radius: radius of the blobs, distance of matching detections.
+    :return: dictionary of statistics of the stages, see measure().
+    """
+    stages = {}
+    stop_frame = frames - 1
+    region = region_from_parameters(parameters)
+    thresholder = thresholder_from_parameters(parameters)
+    background = background_from_parameters(parameters)
+    blob_detector = blob_detect()
+
+    video = cv2.VideoCapture(video_file)
+    decoded, stages['decode'] = measure(
+        lambda: list(iter_frames(video, 0, stop_frame)), frames, memory)
+    video.release()
+
+    level = pyramid_level(parameters)
+    tiler = tiler_from_parameters(parameters, blob_detect)
+    # with tiles the morphological operations run in the detection stage
+    preprocess = binary_frame if tiler is not None else preprocess_frame
+    preprocessed, stages['preprocess'] = measure(
+        lambda: [preprocess(frame, parameters, region, thresholder,
+                            background, level)
+                 for frame in decoded], frames, memory)
+
+    def detect():
+        small_parameters = scale_parameters(parameters, level)
+        measurements = []
+        for frame, frame_preprocessed in zip(decoded, preprocessed):
+            if tiler is not None:
+                points = tiler.detect(frame_preprocessed, small_parameters,
+                                      morphological, find_points)
+            else:
+                points = find_points(frame_preprocessed, small_parameters,
+                                     blob_detector)
+            if level:
+                points = refine_full_resolution(
+                    frame, points, frame_preprocessed.shape, parameters,
+                    region, level)
+            measurements.append(region.to_frame(points, frame.shape))
+        return measurements
+    measurements, stages['detect'] = measure(detect, frames, memory)
+    if tiler is not None:
+        tiler.close()
+    stages['detect'].update(detection_quality(measurements, truth, radius))
+    stages['detect']['measurements'] = int(sum(len(points)
+                                               for points in measurements))
+    preprocessed = None
+
+    (store, est_number), stages['track'] = measure(
+        lambda: kalman_tracking(measurements, stop_frame, parameters),
+        frames, memory)
+    stages['track']['estimates'] = len(store)
+    stages['track']['tracks'] = est_number
+
+    def write():
+        writer = ResultsWriter(os.path.join(work_dir, 'results.csv'),
+                               os.path.join(work_dir, 'results.avi'))
+        for frame_number, frame in enumerate(decoded):
+            writer.write(frame_number, frame, measurements[frame_number],
+                         store)
+        writer.close()
+    _, stages['write'] = measure(write, frames, memory)
+    decoded = None
+
+    def end_to_end():
+        video = cv2.VideoCapture(video_file)
+        items = detect_blobs(iter_frames(video, 0, stop_frame), parameters,
+                             blob_detector, with_frames=True,
+                             detector_factory=blob_detect)
+        writer = ResultsWriter(os.path.join(work_dir, 'results.csv'),
+                               os.path.join(work_dir, 'results.avi'))
+        return track_and_render(items, stop_frame, parameters, writer)
+    _, stages['end_to_end'] = measure(end_to_end, frames, memory)
+
+    if legacy:
+        def video_analise():
+            video = cv2.VideoCapture(video_file)
+            return functions.video_analise(video, 0, stop_frame)
+        (legacy_points, fragment), stages['legacy_video_analise'] = measure(
+            video_analise, frames, memory)
+        _, stages['legacy_kalman'] = measure(
+            lambda: functions.kalman(legacy_points, frames, fragment),
+            frames, memory)
+    return stages
+
+
+def environment():
+    """
+    :return: dictionary describing the machine and the libraries.
+    """
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the tracking pipeline on synthetic videos.')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--blobs', type=int, nargs='+',
+                        default=[10, 100, 1000],
+                        help='Numbers of blobs, one video for every number.')
+    parser.add_argument('--radius', type=int, default=5,
+                        help='Radius of the blobs [px].')
+    parser.add_argument('--speed', type=float, default=2.,
+                        help='Speed of the blobs [px / frame].')
+    parser.add_argument('--noise', type=float, default=5.,
+                        help='Standard deviation of the frames noise.')
+    parser.add_argument('--occlusion', type=float, default=0.,
+                        help='Part of the frame width covered by occluders.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--legacy', action='store_true',
+                        help='Benchmark also functions.video_analise() and '
+                             'functions.kalman() (slow, needs display).')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='Do not trace memory, tracing slows down the '
+                             'stages.')
+    parser.add_argument('--keep', default=None,
+                        help='Keep generated videos, ground truth and '
+                             'results in this directory.')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='JSON report file.')
+    headless.add_parameter_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    parameters = headless.parameters_from_arguments(args)
+    if not args.parameters:
+        # detection of the synthetic blobs - one peak per thresholded blob
+        synthetic = {'detector': 'peaks', 'peaks_merge': True,
+                     'peaks_size': 2 * args.radius + 1}
+        for key, value in synthetic.items():
+            if getattr(args, key) is None:
+                parameters[key] = value
+
+    work_dir = args.keep or tempfile.mkdtemp(prefix='blob_benchmark_')
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    report = {
+        'environment': environment(),
+        'video': {'width': args.width, 'height': args.height,
+                  'frames': args.frames, 'radius': args.radius,
+                  'speed': args.speed, 'noise': args.noise,
+                  'occlusion': args.occlusion, 'seed': args.seed},
+        'parameters': parameters,
+        'runs': [],
+    }
+    try:
+        for blobs in args.blobs:
+            print('{} blobs: generating video...'.format(blobs))
+            run_dir = os.path.join(work_dir, 'blobs_{}'.format(blobs))
+            if not os.path.isdir(run_dir):
+                os.makedirs(run_dir)
+            video_file = os.path.join(run_dir, 'synthetic.avi')
+            truth = generate_video(video_file, args.width, args.height,
+                                   args.frames, blobs, args.radius,
+                                   args.speed, args.noise, args.occlusion,
+                                   seed=args.seed)
+            save_ground_truth(os.path.join(run_dir, 'truth.csv'), truth)
+            print('{} blobs: running stages...'.format(blobs))
+            stages = benchmark_video(video_file, truth, args.frames,
+                                     parameters, run_dir,
+                                     not args.no_memory, args.legacy,
+                                     args.radius)
+            report['runs'].append({'blobs': blobs, 'stages': stages})
+            for name, stage in stages.items():
+                print('    {:22} {:10.1f} fps'.format(name,
+                                                      stage['fps'] or 0))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as report_file:
+        json.dump(report, report_file, indent=4, sort_keys=True,
+                  default=float)
+    print('Report written: ' + args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Lists and removes entries of the measurements cache (see
+helpers.detection_cache) - runs without display.
+Example of use (from the project directory):
+    python -m detection_cache list
+    python -m detection_cache purge --video CIMG4027.MOV
+    python -m detection_cache purge --max-size 100
+"""
+
+import argparse
+import datetime
+
+from helpers.detection_cache import DEFAULT_CACHE_DIR, DetectionCache
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Lists and removes cached measurements.')
+    parser.add_argument('command', choices=('list', 'purge'),
+                        help='list - print entries, the least recently used '
+                             'first, purge - remove entries.')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='Directory of the cache.')
+    parser.add_argument('--video', default=None,
+                        help='Remove only entries of the video.')
+    parser.add_argument('--max-size', type=float, default=None,
+                        metavar='MB',
+                        help='Remove the least recently used entries above '
+                             'the size, instead of all entries.')
+    return parser.parse_args(argv)
+
+
+def list_entries(cache):
+    entries = cache.entries()
+    for path, size, used, header in entries:
+        if header is None:
+            print('{}  unreadable entry'.format(path))
+            continue
+        key = header['key']
+        print('{}  {:8.1f} kB  used {}  {} frames {}-{}  {} points  '
+              'parameters {}'.format(
+                  path, size / 1024.,
+                  datetime.datetime.fromtimestamp(used).strftime(
+                      '%Y-%m-%d %H:%M'),
+                  key['source']['path'], key['start'], key['stop'],
+                  header['points'], key['parameters'][:12]))
+    print('{} entries, {:.1f} MB'.format(
+        len(entries), sum(entry[1] for entry in entries) / 1024. ** 2))
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    cache = DetectionCache(args.cache_dir)
+    if args.command == 'list':
+        list_entries(cache)
+        return
+    if args.max_size is not None:
+        removed = cache.evict(int(args.max_size * 1024 ** 2))
+    else:
+        removed = cache.purge(args.video)
+    print('Removed {} entries'.format(len(removed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Runs the full tracking algorithm without GUI - no PyForms, Qt or
+matplotlib is imported, so it can be used on servers without display.
+Example of use (from the project directory):
+    python -m headless CIMG4027.MOV --start 0 --stop 200 \
+        --parameters results.json --output results.csv
+Parameters file is the one saved with the 'Save parameters' button of the
+GUI. Every parameter can be also overridden from command line, values are
+given in JSON, e.g. --clahe true --roi "[0, 720, 0, 1280]".
+"""
+
+import argparse
+import json
+import logging
+import sys
+import threading
+
+import cv2
+
+from helpers.background import background_from_parameters
+from helpers.detection_cache import DEFAULT_CACHE_DIR as DETECTIONS_DIR, \
+    DEFAULT_MAX_SIZE, DetectionCache, cached_items, detection_key
+from helpers.frame_cache import DEFAULT_CACHE_DIR, CachedCapture, FrameCache
+from helpers.functions import iter_frames, blob_detect
+from helpers.instrumentation import LOG_LEVELS, METRICS, configure_logging
+from helpers.output import ResultsWriter, track_and_render
+from helpers.parallel import parallel_detect
+from helpers.pipeline import DEFAULT_PARAMETERS as PROCESSING_PARAMETERS, \
+    detect_blobs, detect_frame, order_dependent
+from helpers.roi import region_from_parameters
+from helpers.stages import Pipeline
+from helpers.thresholding import thresholder_from_parameters
+from helpers.tiling import tiler_from_parameters
+from helpers.tracking import DEFAULT_PARAMETERS as TRACKING_PARAMETERS
+
+log = logging.getLogger(__name__)
+
+
+def default_parameters():
+    """
+    :return: dictionary of default processing and tracking parameters.
+    """
+    parameters = dict(PROCESSING_PARAMETERS)
+    parameters.update(TRACKING_PARAMETERS)
+    return parameters
+
+
+def load_parameters(path):
+    """
+    Reads parameters saved by the GUI. Parameters missing in the file have
+    default values.
+    :param path: path to the JSON parameters file.
+    :return: dictionary of parameters.
+    """
+    parameters = default_parameters()
+    with open(path) as parameters_file:
+        parameters.update(json.load(parameters_file))
+    return parameters
+
+
+def run(video_file, start_frame, stop_frame, parameters, results_file,
+        video_output=None, workers=1, threads=0, binary_output=None,
+        velocities=False, covariances=False, frame_cache=None,
+        cache_channel=False, detection_cache=None,
+        detection_cache_size=DEFAULT_MAX_SIZE):
+    """
+    Runs the same stages as the GUI Run button: frames decoding, preprocessing,
+    blobs detection, Kalman filter and results writing. Every frame is
+    decoded once.
+    :param video_file: path to the video to be analysed.
+    :param start_frame: integer, first analysed frame.
+    :param stop_frame: integer, last analysed frame.
+    :param parameters: dictionary of processing and tracking parameters.
+    :param results_file: path of the CSV output file, None to skip it.
+    :param video_output: path of the annotated output video, None to skip it.
+    :param workers: number of processes for preprocessing and detection, 1
+                    - everything in the main process.
+    :param threads: number of preprocessing and detection threads of the
+                    staged pipeline (see run_threaded()), 0 - no pipeline.
+    :param binary_output: path of the binary trajectories directory (see
+                          helpers.trajectory_io), None to skip it.
+    :param velocities: write velocities to the binary output.
+    :param covariances: write covariance matrices to the binary output.
+    :param frame_cache: directory of the decoded frames cache (see
+                        helpers.frame_cache), None - frames are decoded
+                        from the video.
+    :param cache_channel: cache only the selected color channel, the
+                          annotated video is grayscale then.
+    :param detection_cache: directory of the measurements cache (see
+                            helpers.detection_cache), None - measurements
+                            are always computed.
+    :param detection_cache_size: maximal size of the measurements cache [B].
+    :return: number of estimated objects.
+    """
+    def results_writer():
+        return ResultsWriter(results_file, video_output,
+                             binary_output=binary_output,
+                             velocities=velocities, covariances=covariances)
+
+    detections = None
+    measurements = None
+    if detection_cache:
+        detections = DetectionCache(detection_cache, detection_cache_size)
+        key = detection_key(video_file, start_frame, stop_frame, parameters)
+        cached = detections.load(key)
+        if cached is not None:
+            # only tracking parameters changed - straight to the filter,
+            # frames are decoded for the annotated video only
+            frames = None
+            if video_output:
+                frames = iter_frames(open_video(video_file, frame_cache,
+                                                start_frame, stop_frame,
+                                                parameters, cache_channel),
+                                     start_frame, stop_frame)
+            store, est_number = track_and_render(
+                cached_items(cached, frames), stop_frame, parameters,
+                results_writer())
+            print('\nFinal estimates number:', est_number)
+            return est_number
+        measurements = []
+
+    video = open_video(video_file, frame_cache, start_frame, stop_frame,
+                       parameters, cache_channel)
+    writer = results_writer()
+    if threads:
+        est_number, report = run_threaded(video, start_frame, stop_frame,
+                                          parameters, writer, threads,
+                                          measurements=measurements)
+        print('Pipeline statistics:')
+        print(json.dumps(report, indent=4))
+    else:
+        est_number = run_frames(video, start_frame, stop_frame, parameters,
+                                writer, workers, measurements)
+    if detections is not None:
+        detections.store(key, measurements)
+    return est_number
+
+
+def open_video(video_file, frame_cache, start_frame, stop_frame, parameters,
+               cache_channel=False):
+    """
+    :return: cv2.VideoCapture of the video, or frame_cache.CachedCapture if
+             the frame cache directory is given.
+    """
+    if frame_cache:
+        channel = parameters['color_channel'] if cache_channel else None
+        video = FrameCache(frame_cache).capture(video_file, start_frame,
+                                                stop_frame, channel)
+    else:
+        video = cv2.VideoCapture(video_file)
+    if not video.isOpened():
+        raise IOError('Unable to open: ' + video_file)
+    return video
+
+
+def run_frames(video, start_frame, stop_frame, parameters, writer,
+               workers=1, measurements=None):
+    """
+    Runs detection in the main process or in the pool of processes and the
+    Kalman filter on the frames of the video.
+    :param video: cv2.VideoCapture or frame_cache.CachedCapture object.
+    :param measurements: optional list, measurements of every frame are
+                         appended to it.
+    :return: number of estimated objects.
+    """
+    # every frame is decoded once, results are written as soon as the
+    # filter is done with the frame
+    frames = iter_frames(video, start_frame, stop_frame)
+    if workers == 1:
+        items = detect_blobs(frames, parameters, blob_detect(),
+                             with_frames=True, detector_factory=blob_detect)
+    else:
+        if isinstance(video, CachedCapture):
+            # workers read the cache file, frames are not copied
+            frames = video.frames
+        items = parallel_detect(frames, parameters, workers, blob_detect,
+                                with_frames=True)
+    store, est_number = track_and_render(items, stop_frame, parameters,
+                                         writer, measurements=measurements)
+    print('\nFinal estimates number:', est_number)
+    return est_number
+
+
+def run_threaded(video, start_frame, stop_frame, parameters, writer,
+                 threads=4, queue_size=None, measurements=None):
+    """
+    Runs all stages at the same time: decoding thread, worker threads for
+    preprocessing and detection, Kalman filter in the calling thread and
+    writing thread, which draws annotations on the decoded frames as soon
+    as the filter is done with them. Stages are connected by bounded
+    queues, so frames in flight are limited.
+    :param video: cv2.VideoCapture object of the analysed video.
+    :param start_frame: integer, first analysed frame.
+    :param stop_frame: integer, last analysed frame.
+    :param parameters: dictionary of processing and tracking parameters.
+    :param writer: helpers.output.ResultsWriter object, closed at the end.
+    :param threads: number of preprocessing and detection threads, one if
+                    measurements depend on the previous frames (see
+                    pipeline.order_dependent()).
+    :param queue_size: maximal number of frames waiting between stages,
+                       2 * threads if None.
+    :param measurements: optional list, measurements of every frame are
+                         appended to it.
+    :return: est_number - number of estimated objects, report - statistics
+             of the stages (see stages.StageStats.as_dict()).
+    """
+    if order_dependent(parameters) and threads > 1:
+        # one detection thread takes frames in their order, the other
+        # stages still run at the same time
+        log.warning('One detection thread - measurements depend on the '
+                    'previous frames')
+        threads = 1
+    queue_size = queue_size or 2 * threads
+
+    region = region_from_parameters(parameters)
+    # shared by the threads
+    thresholder = thresholder_from_parameters(parameters)
+    background = background_from_parameters(parameters)
+    tiler = tiler_from_parameters(parameters, blob_detect)
+    detectors = threading.local()
+
+    def detect(frame):
+        # blob detector is not shared between threads
+        if not hasattr(detectors, 'blob_detector'):
+            detectors.blob_detector = blob_detect()
+        return frame, detect_frame(frame, parameters,
+                                   detectors.blob_detector, region,
+                                   thresholder, background, tiler)
+
+    pipeline = Pipeline(queue_size)
+    pipeline.source(iter_frames(video, start_frame, stop_frame), 'decode')
+    pipeline.map(detect, threads, 'detect')
+
+    stages = {}
+    try:
+        store, est_number = track_and_render(pipeline, stop_frame,
+                                             parameters, writer,
+                                             measurements=measurements,
+                                             report=stages,
+                                             queue_size=queue_size)
+    finally:
+        pipeline.stop()
+        if tiler is not None:
+            tiler.close()
+    report = pipeline.report()
+    report['track'] = stages['track']
+    report['write'] = stages['write']
+    print('\nFinal estimates number:', est_number)
+    return est_number, report
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Multiple blob tracker without GUI.')
+    parser.add_argument('video', help='Path to the video to be analysed.')
+    parser.add_argument('--start', type=int, default=0,
+                        help='First analysed frame.')
+    parser.add_argument('--stop', type=int, default=None,
+                        help='Last analysed frame, last frame of the video '
+                             'by default.')
+    parser.add_argument('--output', default='results.csv',
+                        help='Results output file (frame,ID,x,y), empty '
+                             'string - no CSV.')
+    parser.add_argument('--output-binary', default=None,
+                        help='Binary columnar results directory, can be '
+                             'memory mapped with '
+                             'helpers.trajectory_io.read_trajectories().')
+    parser.add_argument('--velocities', action='store_true',
+                        help='Write velocities to the binary results.')
+    parser.add_argument('--covariances', action='store_true',
+                        help='Write covariance matrices to the binary '
+                             'results.')
+    parser.add_argument('--output-video', default='blob.avi',
+                        help='Annotated output video.')
+    parser.add_argument('--no-video', action='store_true',
+                        help='Do not write annotated video.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes for preprocessing and '
+                             'detection, 0 - number of CPU cores.')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Run decoding, detection (in given number of '
+                             'threads), tracking and writing at the same '
+                             'time and report statistics of the stages.')
+    parser.add_argument('--frame-cache', nargs='?', const=DEFAULT_CACHE_DIR,
+                        default=None, metavar='DIR',
+                        help='Cache decoded frames in the directory (default: '
+                             '{}), later runs of the same frames read the '
+                             'cache instead of decoding.'.format(
+                                 DEFAULT_CACHE_DIR))
+    parser.add_argument('--cache-channel', action='store_true',
+                        help='Cache only the selected color channel (3 '
+                             'times smaller cache, grayscale annotated '
+                             'video).')
+    parser.add_argument('--detection-cache', nargs='?',
+                        const=DETECTIONS_DIR, default=None, metavar='DIR',
+                        help='Cache measurements in the directory (default: '
+                             '{}), runs with the same video, frames and '
+                             'preprocessing parameters skip detection.'
+                             .format(DETECTIONS_DIR))
+    parser.add_argument('--detection-cache-size', type=float,
+                        default=DEFAULT_MAX_SIZE / 1024 ** 2, metavar='MB',
+                        help='Maximal size of the measurements cache, least '
+                             'recently used entries are removed.')
+    parser.add_argument('--log-level', default='WARNING',
+                        choices=LOG_LEVELS,
+                        help='Lowest printed log level, DEBUG prints states '
+                             'of all tracks in every frame (slow).')
+    parser.add_argument('--metrics', default=None,
+                        help='JSON file for timers of the stages and '
+                             'per-frame measurement and track counts.')
+    add_parameter_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_parameter_arguments(parser):
+    """
+    Adds --parameters option and options of all parameters (values in JSON)
+    to the argument parser.
+    :param parser: argparse.ArgumentParser object.
+    """
+    parser.add_argument('--parameters', default=None,
+                        help='JSON parameters file saved by the GUI.')
+    for key, value in sorted(default_parameters().items()):
+        parser.add_argument('--' + key, type=json.loads, default=None,
+                            metavar='JSON',
+                            help='default: {}'.format(json.dumps(value)))
+
+
+def parameters_from_arguments(args):
+    """
+    :param args: arguments parsed with add_parameter_arguments() options.
+    :return: dictionary of parameters - defaults, updated with the
+             parameters file and with parameters given in command line.
+    """
+    if args.parameters:
+        parameters = load_parameters(args.parameters)
+    else:
+        parameters = default_parameters()
+    for key in default_parameters():
+        if getattr(args, key) is not None:
+            parameters[key] = getattr(args, key)
+    return parameters
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure_logging(args.log_level)
+    parameters = parameters_from_arguments(args)
+
+    stop_frame = args.stop
+    if stop_frame is None:
+        cap = cv2.VideoCapture(args.video)
+        stop_frame = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+        cap.release()
+    if args.start < 0 or args.start >= stop_frame:
+        sys.exit('Wrong start/end frame number')
+
+    run(args.video, args.start, stop_frame, parameters, args.output,
+        None if args.no_video else args.output_video, args.workers,
+        args.threads, args.output_binary, args.velocities, args.covariances,
+        args.frame_cache, args.cache_channel, args.detection_cache,
+        int(args.detection_cache_size * 1024 ** 2))
+    if args.metrics:
+        METRICS.dump(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+
+def gated_pairs(priors, measurements, gate):
+    """
+    Finds all (prior, measurement) pairs which are not further from each
+    other than the gate. KD-tree is used, so only near pairs are visited.
+    :param priors: N x 2 array of predicted positions.
+    :param measurements: M x 2 array of measured positions.
+    :param gate: maximal distance [px] between prior and measurement.
+    :return: rows (prior indexes), columns (measurement indexes), distances
+    """
+    if not len(priors) or not len(measurements):
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, np.zeros(0)
+    pairs = cKDTree(priors).sparse_distance_matrix(
+        cKDTree(measurements), gate, output_type='ndarray')
+    return pairs['i'].astype(np.intp), pairs['j'].astype(np.intp), pairs['v']
+
+
+def gated_assignment(priors, measurements, gate):
+    """
+    Assignment between priors and measurements minimizing sum of distances,
+    restricted to pairs inside the gate. Graph of gated pairs is split into
+    connected components and Munkres algorithm (linear_sum_assignment) is run
+    for every component separately, so the cost depends on the number of
+    near pairs instead of N x M.
+    Example of use:
+        rows, columns, costs = gated_assignment(x[:, :2], measurements, 20)
+    :param priors: N x 2 array of predicted positions.
+    :param measurements: M x 2 array of measured positions.
+    :param gate: maximal distance [px] between prior and measurement.
+    :return: rows (prior indexes), columns (measurement indexes) and
+             distances of assigned pairs
+    """
+    priors = np.asarray(priors, dtype=float).reshape(-1, 2)
+    measurements = np.asarray(measurements, dtype=float).reshape(-1, 2)
+    rows, columns, costs = gated_pairs(priors, measurements, gate)
+    if not len(rows):
+        return rows, columns, costs
+
+    # bipartite graph - priors are nodes 0..N-1, measurements N..N+M-1
+    n = len(priors)
+    nodes = n + len(measurements)
+    graph = coo_matrix((np.ones(len(rows)), (rows, columns + n)),
+                       shape=(nodes, nodes))
+    n_components, labels = connected_components(graph, directed=False)
+    edge_labels = labels[rows]
+
+    # components with single pair need no solving
+    edges_per_component = np.bincount(edge_labels, minlength=n_components)
+    single = edges_per_component[edge_labels] == 1
+    assigned_rows = [rows[single]]
+    assigned_columns = [columns[single]]
+    assigned_costs = [costs[single]]
+
+    # solve every bigger component independently
+    order = np.argsort(edge_labels[~single], kind='stable')
+    multi_rows = rows[~single][order]
+    multi_columns = columns[~single][order]
+    multi_costs = costs[~single][order]
+    bounds = np.flatnonzero(np.diff(edge_labels[~single][order])) + 1
+    for component_rows, component_columns, component_costs in zip(
+            np.split(multi_rows, bounds), np.split(multi_columns, bounds),
+            np.split(multi_costs, bounds)):
+        if not len(component_rows):
+            continue
+        local_rows, row_index = np.unique(component_rows,
+                                          return_inverse=True)
+        local_columns, column_index = np.unique(component_columns,
+                                                return_inverse=True)
+        # pairs outside the gate are not allowed
+        forbidden = 2 * gate * (len(local_rows) + len(local_columns)) + 1
+        matrix = np.full((len(local_rows), len(local_columns)), forbidden,
+                         dtype=float)
+        matrix[row_index, column_index] = component_costs
+        row_result, column_result = linear_sum_assignment(matrix)
+        allowed = matrix[row_result, column_result] < forbidden
+        assigned_rows.append(local_rows[row_result[allowed]])
+        assigned_columns.append(local_columns[column_result[allowed]])
+        assigned_costs.append(matrix[row_result, column_result][allowed])
+
+    rows = np.concatenate(assigned_rows)
+    order = np.argsort(rows, kind='stable')
+    return rows[order], np.concatenate(assigned_columns)[order], \
+        np.concatenate(assigned_costs)[order]
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Background subtraction stage of the preprocessing. OpenCV MOG2 or KNN
+background model is learned from the frames in their order, and the
+foreground mask of every frame is returned at the frame resolution.
+The model can be learned on downscaled frames - much faster for large
+frames - and its mask is upscaled back.
+"""
+
+import threading
+
+import cv2
+
+# 'none' - no background subtraction, 'MOG2' or 'KNN' - OpenCV models
+BACKGROUND_METHODS = ('none', 'MOG2', 'KNN')
+
+
+class BackgroundSubtractor(object):
+    """
+    Background model with foreground masks at the input resolution.
+    Threads can share one object, the model is updated under lock.
+    Example of use:
+        background = BackgroundSubtractor('MOG2', scale=0.5)
+        for frame in frames:
+            mask = background.apply(frame)
+    """
+
+    def __init__(self, method='MOG2', scale=1., history=500,
+                 var_threshold=None, learning_rate=-1):
+        """
+        :param method: 'MOG2' or 'KNN'.
+        :param scale: scale of the frames the model is learned on (0 - 1].
+        :param history: number of frames the model is learned from.
+        :param var_threshold: threshold of the squared distance between
+                              pixel and model to decide if pixel is
+                              foreground, OpenCV default (16 for MOG2, 400
+                              for KNN) if None.
+        :param learning_rate: 0 - 1, negative - automatic (1 / history).
+        """
+        if method == 'MOG2':
+            self._model = cv2.createBackgroundSubtractorMOG2(
+                history, 16 if var_threshold is None else var_threshold,
+                False)
+        elif method == 'KNN':
+            self._model = cv2.createBackgroundSubtractorKNN(
+                history, 400. if var_threshold is None else var_threshold,
+                False)
+        else:
+            raise ValueError('Unknown background method: {}'.format(method))
+        self.method = method
+        self.scale = scale
+        self.learning_rate = learning_rate
+        self._lock = threading.Lock()
+
+    def apply(self, frame):
+        """
+        Updates the model with the frame.
+        :param frame: grayscale or BGR frame.
+        :return: foreground mask of the frame size - 255 for foreground, 0
+                 for background pixels.
+        """
+        height, width = frame.shape[:2]
+        small = frame
+        if self.scale != 1:
+            small = cv2.resize(frame, None, fx=self.scale, fy=self.scale,
+                               interpolation=cv2.INTER_AREA)
+        with self._lock:
+            mask = self._model.apply(small, learningRate=self.learning_rate)
+        if small is not frame:
+            mask = cv2.resize(mask, (width, height),
+                              interpolation=cv2.INTER_LINEAR)
+            ret, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+        return mask
+
+
+def background_from_parameters(parameters):
+    """
+    :param parameters: dictionary of processing parameters.
+    :return: BackgroundSubtractor object, None if background subtraction
+             is switched off.
+    """
+    method = parameters.get('background', 'none')
+    if method == 'none':
+        return None
+    return BackgroundSubtractor(method,
+                                parameters.get('background_scale', 1.),
+                                parameters.get('background_history', 500),
+                                parameters.get('background_var_threshold'),
+                                parameters.get('background_learning_rate',
+                                               -1))
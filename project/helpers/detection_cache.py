@@ -0,0 +1,216 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the measurements (points found in every frame). The
+entry is keyed by the fingerprint of the source video, frame range and
+hash of all preprocessing and detection parameters, so a run which changes
+only the tracking parameters (gate, strikes, covariances) reuses the
+measurements and goes straight to the Kalman filter.
+
+Every entry is one .npz file - number of points per frame, all points
+concatenated and JSON header. Least recently used entries are removed when
+the cache grows over its maximal size.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from helpers.frame_cache import source_fingerprint
+from helpers.pipeline import DEFAULT_PARAMETERS as PROCESSING_PARAMETERS
+from helpers.tracking import DEFAULT_PARAMETERS as TRACKING_PARAMETERS
+
+# version of the entries, changed when the detection results change
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'multiple_blob_detection', 'detections')
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+
+def parameters_hash(parameters):
+    """
+    :param parameters: dictionary of processing and tracking parameters.
+    :return: hash of all parameters except the tracking ones - missing
+             processing parameters have their default values.
+    """
+    upstream = dict(PROCESSING_PARAMETERS)
+    upstream.update((key, value) for key, value in parameters.items()
+                    if key not in TRACKING_PARAMETERS)
+    return hashlib.sha1(json.dumps(upstream, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+
+
+def detection_key(video_file, start_frame, stop_frame, parameters):
+    """
+    Measurements don't depend on the number of workers or threads -
+    frames which depend on the previous frames are processed in their
+    order (see pipeline.order_dependent()).
+    :param video_file: path to the analysed video.
+    :param start_frame: integer, first analysed frame.
+    :param stop_frame: integer, last analysed frame.
+    :param parameters: dictionary of processing and tracking parameters.
+    :return: dictionary identifying the measurements.
+    """
+    return {'version': CACHE_VERSION,
+            'source': source_fingerprint(video_file),
+            'start': start_frame, 'stop': stop_frame,
+            'parameters': parameters_hash(parameters)}
+
+
+def read_entry_header(path):
+    """
+    :param path: path of the cache entry.
+    :return: dictionary of the entry header, None if it can't be read.
+    """
+    try:
+        with np.load(path) as entry:
+            return json.loads(str(entry['header']))
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+class DetectionCache(object):
+    """
+    Directory of cached measurements.
+    Example of use:
+        cache = DetectionCache()
+        key = detection_key('video.avi', 0, 1000, parameters)
+        measurements = cache.load(key)
+        if measurements is None:
+            measurements = [...]
+            cache.store(key, measurements)
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param cache_dir: directory of the entries, DEFAULT_CACHE_DIR if
+                          None.
+        :param max_size: maximal size of all entries [B], least recently
+                         used entries are removed above it.
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_size = max_size
+
+    def path(self, key):
+        """
+        :return: path of the entry of the key.
+        """
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode(
+            'utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.npz')
+
+    def load(self, key):
+        """
+        :param key: see detection_key().
+        :return: list of N x 2 arrays of points per frame, None if the
+                 measurements are not cached.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                header = json.loads(str(entry['header']))
+                counts = entry['counts']
+                points = entry['points']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        if header.get('key') != key:
+            return None
+        # last use for the eviction
+        os.utime(path, None)
+        return np.split(points, np.cumsum(counts)[:-1])
+
+    def store(self, key, measurements):
+        """
+        Writes the entry and evicts the least recently used entries.
+        :param key: see detection_key().
+        :param measurements: list of (x, y) lists or N x 2 arrays per frame.
+        """
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        frames = [np.asarray(points, dtype=np.float64).reshape(-1, 2)
+                  for points in measurements]
+        counts = np.array([len(points) for points in frames], dtype=np.int64)
+        points = np.concatenate(frames) if frames else np.zeros((0, 2))
+        header = {'key': key, 'frames': len(frames),
+                  'points': int(counts.sum()), 'created': time.time()}
+        path = self.path(key)
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as entry_file:
+            np.savez(entry_file, counts=counts, points=points,
+                     header=np.array(json.dumps(header, sort_keys=True)))
+        # readers see the old or the new entry, never a partial one
+        os.replace(temporary, path)
+        self.evict(self.max_size, keep=path)
+
+    def entries(self):
+        """
+        :return: list of (path, size [B], last use time, header) of all
+                 entries, the least recently used first.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            entries.append((path, stat.st_size, stat.st_mtime,
+                            read_entry_header(path)))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self, max_size, keep=None):
+        """
+        Removes the least recently used entries until all entries fit in
+        max_size.
+        :param max_size: maximal size of all entries [B].
+        :param keep: path of the entry which is never removed.
+        :return: list of removed paths.
+        """
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        removed = []
+        for path, size, used, header in entries:
+            if total <= max_size:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
+            removed.append(path)
+        return removed
+
+    def purge(self, video_file=None):
+        """
+        Removes entries of the video, or all entries.
+        :param video_file: path to the video, None - all entries.
+        :return: list of removed paths.
+        """
+        video_path = None if video_file is None else \
+            os.path.abspath(video_file)
+        removed = []
+        for path, size, used, header in self.entries():
+            if video_path is not None and (
+                    header is None or
+                    header['key']['source']['path'] != video_path):
+                continue
+            os.remove(path)
+            removed.append(path)
+        return removed
+
+
+def cached_items(measurements, frames=None):
+    """
+    :param measurements: cached points per frame, see DetectionCache.load().
+    :param frames: iterable of the decoded frames for the annotated video,
+                   None - frames are not decoded.
+    :return: (frame, points) pairs as yielded by pipeline.detect_blobs(),
+             frame is None if frames are not given.
+    """
+    if frames is None:
+        return ((None, points) for points in measurements)
+    return zip(frames, measurements)
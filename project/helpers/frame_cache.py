@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Cache of decoded frames on disk. Frames of the selected range of the video
+(BGR, or only the selected color channel) are decoded once and written to
+a raw file, so later runs, the preview player and worker processes read
+them memory mapped - without decoding and without copying.
+
+Cache file starts with a small JSON header (HEADER_SIZE bytes, padded with
+spaces) describing the source video (path, size and modification time),
+frame range, frame shape and dtype, followed by the frames. The cache is
+rebuilt when the source video changes.
+"""
+
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+
+from helpers.functions import iter_frames
+
+# version of the cache format, stored in the header
+CACHE_VERSION = 1
+HEADER_SIZE = 4096
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'multiple_blob_detection', 'frames')
+
+
+def source_fingerprint(video_file):
+    """
+    :param video_file: path to the video.
+    :return: dictionary identifying the version of the video file.
+    """
+    stat = os.stat(video_file)
+    return {'path': os.path.abspath(video_file), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+def read_header(path):
+    """
+    :param path: path of the cache file.
+    :return: dictionary of the header, None if it's not a cache file.
+    """
+    try:
+        with open(path, 'rb') as cache_file:
+            header = json.loads(cache_file.read(HEADER_SIZE).decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(header, dict) or \
+            header.get('version') != CACHE_VERSION:
+        return None
+    return header
+
+
+def _write_header(path, header):
+    data = json.dumps(header, sort_keys=True).encode('utf-8')
+    if len(data) > HEADER_SIZE:
+        raise ValueError('Frame cache header is too long')
+    with open(path, 'r+b') as cache_file:
+        cache_file.write(data.ljust(HEADER_SIZE))
+
+
+def map_frames(path, header, mode='r'):
+    """
+    :param path: path of the cache file.
+    :param header: header of the file, see read_header().
+    :param mode: mode of np.memmap ('r', 'r+', 'c').
+    :return: memory mapped frames, array of shape (count,) + frame shape.
+    """
+    return np.memmap(path, header['dtype'], mode, HEADER_SIZE,
+                     (header['count'],) + tuple(header['shape']))
+
+
+class FrameCache(object):
+    """
+    Directory of frame cache files, one file per video, frame range and
+    color channel.
+    Example of use:
+        cache = FrameCache('/tmp/frames')
+        frames = cache.frames('video.avi', 0, 1000, channel=2)
+        video = cache.capture('video.avi', 0, 1000)
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        :param cache_dir: directory of the cache files, DEFAULT_CACHE_DIR
+                          if None.
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+
+    def path(self, video_file, start_frame, stop_frame, channel=None):
+        """
+        :return: path of the cache file of the video frames.
+        """
+        key = hashlib.sha1(os.path.abspath(video_file).encode('utf-8'))
+        name = '{}_{}-{}_{}.frames'.format(
+            key.hexdigest()[:16], start_frame, stop_frame,
+            'bgr' if channel is None else channel)
+        return os.path.join(self.cache_dir, name)
+
+    def load(self, video_file, start_frame, stop_frame, channel=None):
+        """
+        :return: memory mapped frames (read only), None if there is no
+                 complete cache of the current version of the video.
+        """
+        path = self.path(video_file, start_frame, stop_frame, channel)
+        header = read_header(path)
+        if header is None or not header['complete'] or \
+                header['source'] != source_fingerprint(video_file):
+            return None
+        return map_frames(path, header)
+
+    def build(self, video_file, start_frame, stop_frame, channel=None):
+        """
+        Decodes the frames and writes them to the cache file.
+        :param video_file: path to the video.
+        :param start_frame: integer, first cached frame.
+        :param stop_frame: integer, last cached frame.
+        :param channel: index of the cached color channel, None - BGR
+                        frames.
+        :return: memory mapped frames (read only).
+        """
+        source = source_fingerprint(video_file)
+        video = cv2.VideoCapture(video_file)
+        if not video.isOpened():
+            raise IOError('Unable to open: ' + video_file)
+        fps = video.get(cv2.CAP_PROP_FPS)
+        count = stop_frame - start_frame + 1
+        frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count > 0:
+            count = max(min(count, frame_count - start_frame), 1)
+        frames = iter_frames(video, start_frame, stop_frame)
+        if channel is not None:
+            frames = (frame[:, :, channel] for frame in frames)
+        first = next(frames, None)
+        if first is None:
+            raise IOError('No frames to cache in: ' + video_file)
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        path = self.path(video_file, start_frame, stop_frame, channel)
+        # new file, processes still mapping the old one keep reading it
+        if os.path.exists(path):
+            os.remove(path)
+        header = {'version': CACHE_VERSION, 'source': source,
+                  'start': start_frame, 'stop': stop_frame,
+                  'channel': channel, 'shape': list(first.shape),
+                  'dtype': first.dtype.str, 'count': count, 'fps': fps,
+                  'complete': False}
+        with open(path, 'wb') as cache_file:
+            cache_file.truncate(HEADER_SIZE + count * first.nbytes)
+        _write_header(path, header)
+
+        cached = map_frames(path, header, 'r+')
+        cached[0] = first
+        written = 1
+        for frame in frames:
+            if written == count:
+                break
+            cached[written] = frame
+            written += 1
+        frames.close()
+        cached.flush()
+        del cached
+        # frame count reported by the container can be too high
+        if written < count:
+            with open(path, 'r+b') as cache_file:
+                cache_file.truncate(HEADER_SIZE + written * first.nbytes)
+        header['count'] = written
+        header['complete'] = True
+        _write_header(path, header)
+        return map_frames(path, header)
+
+    def frames(self, video_file, start_frame, stop_frame, channel=None):
+        """
+        :return: memory mapped frames <start_frame, stop_frame> from the
+                 cache, decoded and cached first if needed.
+        """
+        frames = self.load(video_file, start_frame, stop_frame, channel)
+        if frames is None:
+            frames = self.build(video_file, start_frame, stop_frame, channel)
+        return frames
+
+    def capture(self, video_file, start_frame, stop_frame, channel=None):
+        """
+        :return: CachedCapture object of the frames <start_frame,
+                 stop_frame>, decoded and cached first if needed.
+        """
+        frames = self.frames(video_file, start_frame, stop_frame, channel)
+        header = read_header(self.path(video_file, start_frame, stop_frame,
+                                       channel))
+        return CachedCapture(frames, start_frame, header['fps'])
+
+
+class CachedCapture(object):
+    """
+    cv2.VideoCapture like reader of the cached frames, for the code reading
+    frames with read() - iter_frames() and the preview player. Returned
+    frames are read only views of the cache.
+    """
+
+    def __init__(self, frames, start_frame=0, fps=25.):
+        """
+        :param frames: memory mapped frames, see FrameCache.frames().
+        :param start_frame: number of the first cached frame in the video.
+        :param fps: frames per second reported by get().
+        """
+        self.frames = frames
+        self.start_frame = start_frame
+        self.fps = fps
+        self._position = start_frame
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self):
+        index = self._position - self.start_frame
+        if not self._opened or not 0 <= index < len(self.frames):
+            return False, None
+        self._position += 1
+        return True, self.frames[index]
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._position)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.start_frame + len(self.frames))
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.frames.shape[2])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.frames.shape[1])
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        return 0.
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self._position = int(value)
+        return True
+
+    def release(self):
+        self._opened = False
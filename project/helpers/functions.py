@@ -1,15 +1,21 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import logging
 import sys
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from numpy import dot, ma  # masked arrays
-from scipy.linalg import inv
+from numpy import ma  # masked arrays
 from scipy.spatial.distance import squareform, pdist
-from scipy.optimize import linear_sum_assignment
+
+from helpers.association import gated_assignment
+from helpers.instrumentation import METRICS
+from helpers.kalman import KalmanBank
+from helpers.roi import RegionOfInterest
+from helpers.thresholding import otsu_thresholds
+
+log = logging.getLogger(__name__)
 
 # from filterpy.kalman import KalmanFilter
 # from filterpy.common import Q_discrete_white_noise
@@ -32,68 +38,50 @@ def otsu_binary(img):
 
     # plt.close('all')
     blur = cv2.GaussianBlur(img, (5, 5), 0)
-    # find normalized_histogram, and its cumulative distribution function
+    # threshold of the blurred image histogram, all candidate thresholds
+    # at once, see thresholding.otsu_thresholds()
     hist = cv2.calcHist([blur], [0], None, [256], [0, 256])
-    hist_norm = hist.ravel() / hist.max()
-    Q = hist_norm.cumsum()
-    bins = np.arange(256)
-    fn_min = np.inf
-    thresh = -1
-
-    for i in range(1, 255):
-        p1, p2 = np.hsplit(hist_norm, [i])  # probabilities
-        q1 = Q[i]
-        q2 = Q[255] - q1  # cum sum of classes
-        b1, b2 = np.hsplit(bins, [i])  # weights
-        # finding means and variances
-        m1 = np.sum(p1 * b1) / q1
-        m2 = np.sum(p2 * b2) / q2
-        v1, v2 = np.sum(((b1 - m1) ** 2) * p1) / q1, np.sum(
-            ((b2 - m2) ** 2) * p2) / q2
-        # calculates the minimization function
-        fn = v1 * q1 + v2 * q2
-        if fn < fn_min:
-            fn_min = fn
-            thresh = i
-    # find otsu's threshold value with OpenCV function
-    ret, otsu = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY +
-                              cv2.THRESH_OTSU)
-    # print("{} {}".format(thresh, ret))
+    thresh = int(otsu_thresholds(hist.ravel()))
 
     ret, img_thresh1 = cv2.threshold(img, thresh, 255, cv2.THRESH_BINARY)
     return img_thresh1
 
 
-def select_frames(video, frame_start, frame_stop):
+def iter_frames(video, frame_start, frame_stop):
     """
-    Function that return selected frames from video.
+    Generator that decodes selected frames from video one by one, so only
+    one frame is kept in memory at the time.
     :param video: VideoCapture object from OpenCV
     :param frame_start: integer, frame from selection should be started
     :param frame_stop: integer, ending frame of selected section
-    :return: video fragment <start_frame, stop_frame>
+    :return: frames <start_frame, stop_frame>
     """
-    # cap = cv2.VideoCapture(video)
     # pass object, not string
     cap = video
-    # font = cv2.FONT_HERSHEY_SIMPLEX
-    video_fragment = []
     cap.set(1, frame_start)
+    try:
+        while cap.isOpened():
+            with METRICS.timer('decode'):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+            if cap.get(1) == frame_stop + 1:
+                break
+    finally:
+        cap.release()
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        video_fragment.append(frame)
-        if cv2.waitKey(1) & 0xFF == ord('q') or not ret \
-                or (cap.get(1)) == frame_stop + 1:
-            break
-    # img, text, (x,y), font, size, color, thickens
-    #     cv2.putText(frame, str(round(cap.get(0)/1000, 2)) + 's',
-    #                 (10, 15), font, 0.5, (255, 255, 255), 1)
-    #     cv2.putText(frame, 'f.nr:' + str(cap.get(1)),
-    #                 (100, 15), font, 0.5, (255, 255, 255), 1)
-    #     cv2.imshow('frame', frame)
-    cap.release()
-    cv2.destroyAllWindows()
-    return video_fragment
+
+def select_frames(video, frame_start, frame_stop):
+    """
+    Function that return selected frames from video.
+    Keeps the whole fragment in memory - use iter_frames() for long videos.
+    :param video: VideoCapture object from OpenCV
+    :param frame_start: integer, frame from selection should be started
+    :param frame_stop: integer, ending frame of selected section
+    :return: video fragment <start_frame, stop_frame>
+    """
+    return list(iter_frames(video, frame_start, frame_stop))
 
 
 def read_image(path, name, ext, amount):
@@ -308,11 +296,10 @@ def video_analise(video, start_f, stop_f):
                             vid_fragment[frame_nr][3D pixel matrix, BGR]
     """
     vid_frag = select_frames(video, start_f, stop_f)
-    try:
-        height = vid_frag[0].shape[0]
-        width = vid_frag[0].shape[1]
-    except IndexError:
+    if not vid_frag:
         raise IndexError('No video loaded. Check video path.')
+    # analyse only area near the nozzles, the rest of the frame is gray
+    region = RegionOfInterest((0, 161, 0, 386), fill=120)
 
     # kernel for morphological operations
     # check cv2.getStructuringElement() doc for more info
@@ -326,11 +313,7 @@ def video_analise(video, start_f, stop_f):
     for frame in vid_frag:
         if cv2.waitKey(15) & 0xFF == ord('q'):
             break
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        for m in range(height):  # height
-            for n in range(width):  # width
-                if n > 385 or m > 160:
-                    gray_frame[m][n] = 120
+        gray_frame = region.crop(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
 
         # create a CLAHE object (Arguments are optional)
         # clahe = cv2.createCLAHE(clipLimit=8.0, tileGridSize=(8, 8))
@@ -353,7 +336,8 @@ def video_analise(video, start_f, stop_f):
         # create LoG kernel for finding local maximas
         log_img = cv2.filter2D(dilate, cv2.CV_32F, get_log_kernel(30, 15))
         # get local maximas of filtered image per frame
-        maxima_points.append(local_maxima(log_img))
+        maxima_points.append(region.to_frame(local_maxima(log_img),
+                                             vid_frag[0].shape))
         if i % 10 == 0:
             print(i)
         i += 1
@@ -365,6 +349,8 @@ def kalman(max_points, stop_frame, vid_fragment):
     Kalman Filter function. Takes measurements from video analyse function
     and estimates positions of detected objects. Munkres algorithm is used for
     assignments between estimates (states) and measurements.
+    Original batch version, kept for comparison in the benchmark - runs use
+    the online tracking.BlobTracker.
     :param max_points: measurements.
     :param stop_frame: number of frames to analise
     :param vid_fragment: video fragment for estimates displaying
@@ -376,39 +362,21 @@ def kalman(max_points, stop_frame, vid_fragment):
     font = cv2.FONT_HERSHEY_SIMPLEX  # font for displaying info on the image
     index_error = 0
     value_error = 0
-    # step of filter
-    dt = 1.
-    R_var = 1  # measurements variance between x-x and y-y
-    # Q_var = 0.1  # model variance
+    # Kalman filters of all objects, max number of states - as much as frames
     # state covariance matrix - no initial covariances, variances only
-    # [10^2 px, 10^2 px, ..] -
-    P = np.diag([100, 100, 10, 10, 1, 1])
-    # state transition matrix for 6 state variables
-    # (position - velocity - acceleration,
-    # x, y)
-    F = np.array([[1, 0, dt, 0, 0.5 * pow(dt, 2), 0],
-                  [0, 1, 0, dt, 0, 0.5 * pow(dt, 2)],
-                  [0, 0, 1, 0, dt, 0],
-                  [0, 0, 0, 1, 0, dt],
-                  [0, 0, 0, 0, 1, 0],
-                  [0, 0, 0, 0, 0, 1]])
-    # x and y coordinates only - measurements matrix
-    H = np.array([[1., 0., 0., 0., 0., 0.],
-                  [0., 1., 0., 0., 0., 0.]])
-    # no initial corelation between x and y positions - variances only
-    R = np.array([[R_var, 0.], [0., R_var]])  # measurement covariance matrix
-    # Q must be the same shape as P
-    Q = np.diag([100, 100, 10, 10, 1, 1])  # model covariance matrix
-
-    # create state vectors, max number of states - as much as frames
-    x = np.zeros((stop_frame, 6))
+    # [10^2 px, 10^2 px, ..], model covariance matrix Q must be the same
+    # shape as P, measurements variance R between x-x and y-y is 1
+    bank = KalmanBank(stop_frame, 'constant_acceleration', dt=1.,
+                      state_covariance=[100, 100, 10, 10, 1, 1],
+                      model_covariance=[100, 100, 10, 10, 1, 1],
+                      measurement_variance=1)
+    x = bank.x
     # state initialization - initial state is equal to measurements
     m = 0
     try:
         for i in range(len(max_points[0])):
             if max_points[0][i][0] > 0 and max_points[0][i][1] > 0:
-                x[m] = [max_points[0][i][0], max_points[0][i][1],
-                        0, 0, 0, 0]
+                bank.initialize(m, max_points[0][i])
                 m += 1
     # required for django runserver tests
     except IndexError:
@@ -439,6 +407,7 @@ def kalman(max_points, stop_frame, vid_fragment):
     removed_states = []
     new_detection = []
     ff_nr = 0  # frame number
+    debug = log.isEnabledFor(logging.DEBUG)
     # kalman filter loop
     for frame in range(stop_frame):
         # measurements in one frame
@@ -453,90 +422,32 @@ def kalman(max_points, stop_frame, vid_fragment):
             for meas in frame_measurements:
                 if meas[0] > 0 and meas[1] > 0:
                     measurements.append([meas[0], meas[1]])
-        # count prior
-        for i in range(est_number):
-            x[i][::] = dot(F, x[i][::])
-        P = dot(F, P).dot(F.T) + Q
-        S = dot(H, P).dot(H.T) + R
-        K = dot(P, H.T).dot(inv(S))
         ######################################################################
         # prepare for update phase -> get (prior - measurement) assignment
-        posterior_list = []
-        for i in range(est_number):
-            if not np.isnan(x[i][0]) and not np.isnan(x[i][1]):
-                posterior_list.append(i)
-                # print(i)
-        # print(posterior_list)
-        #
-        # print('state\n', x[0:est_number, 0:2])
-        # print('\n')
-        #    temp_matrix = np.array(x[0:est_number, 0:2])
-        try:
-            temp_matrix = np.array(x[posterior_list, 0:2])
-            temp_matrix = np.append(temp_matrix, measurements, axis=0)
-        except ValueError:
-            value_error = 1
-
-        # print(temp_matrix)
-        distance = pdist(temp_matrix, 'euclidean')  # returns vector
-
-        # make square matrix out of vector
-        distance = squareform(distance)
-        temp_distance = distance
-        # remove elements that are repeated - (0-1), (1-0) etc.
-        #    distance = distance[est_number::, 0:est_number]
-        distance = distance[0:len(posterior_list), len(posterior_list)::]
-
-        # munkres
-        row_index, column_index = linear_sum_assignment(distance)
-        final_cost = distance[row_index, column_index].sum()
-        unit_cost = []
-        index = []
-        for i in range(len(row_index)):
-            # index(object, measurement)
-            index.append([row_index[i], column_index[i]])
-            unit_cost.append(distance[row_index[i], column_index[i]])
-
+        posterior_list = np.flatnonzero(~np.isnan(x[:est_number, 0]))
+        # count prior of all existing objects at once
+        bank.predict(posterior_list)
+        # assignment between priors and measurements, only pairs closer
+        # than the gate are considered
+        row_index, column_index, unit_cost = gated_assignment(
+            x[posterior_list, 0:2], measurements, 20)
+        # index(object, measurement)
+        index = np.column_stack((posterior_list[row_index], column_index))
         ######################################################################
-        # index correction - take past states into account
-        removed_states.sort()
-        for removed_index in removed_states:
-            for i in range(len(index)):
-                if index[i][0] >= removed_index:
-                    index[i][0] += 1
+        # find object to reject - objects without measurement in the gate
+        reject = np.zeros(len(posterior_list))
+        reject[row_index] = 1
+
         ######################################################################
-        # find object to reject
-        state_list = [index[i][0] for i in range(len(index))]
-        reject = np.ones(len(posterior_list))
-        i = 0
-        for post_index in posterior_list:
-            if post_index not in state_list:
-                reject[i] = 0
-            i += 1
-        # check if distance (residual) isn't to high for assignment
-        for i in range(len(unit_cost)):
-            if unit_cost[i] > 20:
-                print('cost to high, removing', i)
-                reject[i] = 0
-
-        #####################################################################
-
-        # update phase
+        # update phase - posterior of all objects that got measurements
+        bank.update(index[:, 0],
+                    np.reshape(measurements, (-1, 2))[index[:, 1]])
         for i in range(len(index)):
-            # find object that should get measurement next
-            # count residual y: measurement - state
-            if index[i][1] >= 0:
-                y = np.array([measurements[index[i][1]] -
-                              dot(H, x[index[i][0], ::])])
-                # posterior
-                x[index[i][0], ::] = x[index[i][0], ::] + dot(K, y.T).T
-                # append new positions
-            #        if x[i][0] and x[i][1]:
+            # append new positions
             x_est[index[i][0]].append([x[index[i][0], 0]])
             y_est[index[i][0]].append([x[index[i][0], 1]])
-        # posterior state covariance matrix
-        P = dot(np.identity(6) - dot(K, H), P)
-        print('posterior\n', x[0:est_number, 0:2])
+        if debug:
+            log.debug('posterior\n%s', x[0:est_number, 0:2])
         ######################################################################
         # find new objects and create new states for them
         new_index = []
@@ -555,8 +466,7 @@ def kalman(max_points, stop_frame, vid_fragment):
         # for every detections in the last frame
         for i in range(len(new_detection[len(new_detection) - 1])):
             if new_detection[frame][i] and new_detection[frame][i][0] > 380:
-                x[est_number, ::] = [new_detection[frame][i][0],
-                                     new_detection[frame][i][1], 0, 0, 0, 0]
+                bank.initialize(est_number, new_detection[frame][i])
                 est_number += 1
                 # print('state added', est_number)
                 # print('new posterior\n', x[0:est_number, 0:2])
@@ -570,13 +480,16 @@ def kalman(max_points, stop_frame, vid_fragment):
         for track in no_track_list:
             if track >= 0:
                 striked_tracks[track] += 1
-                print('track/strikes', track, striked_tracks[track])
+                if debug:
+                    log.debug('track %d strikes %d', track,
+                              striked_tracks[track])
         for i in range(len(striked_tracks)):
             if striked_tracks[i] >= 1:
-                x[i, ::] = [None, None, None, None, None, None]
+                x[i, ::] = np.nan
                 if i not in removed_states:
                     removed_states.append(i)
-                print('state_removed', i)
+                if debug:
+                    log.debug('state %d removed', i)
 
         ######################################################################
         # if not index_error or not value_error:
@@ -609,7 +522,8 @@ def kalman(max_points, stop_frame, vid_fragment):
         #     cv2.imshow('bin', vid_fragment[frame])
         #     cv2.waitKey(10)
 
-            print(ff_nr, '--------------------------------------')
+            if debug:
+                log.debug('frame %d done', ff_nr)
             ff_nr += 1
             # print(removed_states)
             # print(index)
@@ -617,6 +531,8 @@ def kalman(max_points, stop_frame, vid_fragment):
 
 
 def plot_points(vid_frag, max_points, x_est, y_est, est_number):
+    # imported here, so the processing functions work without display
+    import matplotlib.pyplot as plt
     # plot raw measurements
     for frame_positions in max_points:
         for pos in frame_positions:
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the processing - logging and metrics.
+Modules log with the standard logging module (logging.getLogger(__name__)).
+Per-frame messages are DEBUG and are formatted only if DEBUG is enabled,
+so by default they cost nothing in the hot loops.
+Metrics are collected in the METRICS registry: counters, histograms
+(count, sum, min, max and power of two buckets) and timers - histograms of
+durations [s]. Registry can be dumped as JSON, and profiling hooks receive
+every recorded value.
+Example of use:
+    with METRICS.timer('detection.preprocess'):
+        frame = preprocess_frame(frame, parameters)
+    METRICS.observe('tracking.tracks', len(tracks))
+    METRICS.dump('metrics.json')
+Metrics recorded in the worker processes (headless --workers) stay in the
+workers, only the main process registry is dumped.
+"""
+
+import json
+import logging
+import math
+import threading
+import time
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+
+def configure_logging(level='WARNING'):
+    """
+    Prints log messages of all modules to stderr.
+    :param level: name of the lowest printed level, see LOG_LEVELS.
+    """
+    logging.basicConfig(level=getattr(logging, level.upper()),
+                        format='%(asctime)s %(levelname)s %(name)s: '
+                               '%(message)s')
+
+
+class Histogram(object):
+    """
+    Summary of recorded values - count, sum, min, max and counts in power
+    of two buckets (bucket 2^e holds values in (2^(e-1), 2^e]).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        exponent = math.frexp(value)[1] if value > 0 else None
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    def as_dict(self):
+        """
+        :return: dictionary - count, sum, mean, min, max and buckets
+                 (upper bound -> count, non positive values in '0').
+        """
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else 0.,
+            'min': self.min,
+            'max': self.max,
+            'buckets': dict(('0' if exponent is None else
+                             repr(math.ldexp(1., exponent)), count)
+                            for exponent, count in self.buckets.items()),
+        }
+
+
+class _Timer(object):
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record_time(self.name,
+                                 time.perf_counter() - self.start)
+
+
+class Metrics(object):
+    """
+    Thread safe registry of counters, histograms and timers.
+    """
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: record values, everything is ignored if False.
+        """
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self.timers = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        Registers profiling hook, called in the recording thread as
+        hook(kind, name, value), kind is 'counter', 'histogram' or 'timer'.
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def _notify(self, kind, name, value):
+        for hook in self._hooks:
+            hook(kind, name, value)
+
+    def increment(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        if self._hooks:
+            self._notify('counter', name, value)
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(value)
+        if self._hooks:
+            self._notify('histogram', name, value)
+
+    def record_time(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = Histogram()
+            histogram.record(seconds)
+        if self._hooks:
+            self._notify('timer', name, seconds)
+
+    def timer(self, name):
+        """
+        :return: context manager recording its wall time [s] as timer.
+        """
+        return _Timer(self, name)
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.timers = {}
+
+    def as_dict(self):
+        """
+        :return: dictionary - counters, histograms and timers [s], see
+                 Histogram.as_dict().
+        """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': dict((name, histogram.as_dict())
+                                   for name, histogram
+                                   in self.histograms.items()),
+                'timers': dict((name, histogram.as_dict())
+                               for name, histogram in self.timers.items()),
+            }
+
+    def dump(self, path):
+        """
+        Writes metrics as JSON file.
+        """
+        with open(path, 'w') as metrics_file:
+            json.dump(self.as_dict(), metrics_file, indent=4, sort_keys=True)
+
+
+# registry of the whole process
+METRICS = Metrics()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# number of state variables of the motion models - positions, velocities
+# and accelerations in x and y
+MOTION_MODELS = {
+    'constant_velocity': 4,
+    'constant_acceleration': 6,
+}
+
+
+def transition_matrix(model, dt):
+    """
+    State transition matrix of the motion model. State vector is
+    [x, y, vx, vy] for constant velocity and [x, y, vx, vy, ax, ay] for
+    constant acceleration model.
+    :param model: 'constant_velocity' or 'constant_acceleration'.
+    :param dt: step of filter.
+    :return: F matrix.
+    """
+    if model == 'constant_velocity':
+        return np.array([[1, 0, dt, 0],
+                         [0, 1, 0, dt],
+                         [0, 0, 1, 0],
+                         [0, 0, 0, 1]], dtype=float)
+    if model == 'constant_acceleration':
+        return np.array([[1, 0, dt, 0, 0.5 * pow(dt, 2), 0],
+                         [0, 1, 0, dt, 0, 0.5 * pow(dt, 2)],
+                         [0, 0, 1, 0, dt, 0],
+                         [0, 0, 0, 1, 0, dt],
+                         [0, 0, 0, 0, 1, 0],
+                         [0, 0, 0, 0, 0, 1]], dtype=float)
+    raise ValueError('Unknown motion model: {}'.format(model))
+
+
+class KalmanBank(object):
+    """
+    Bank of Kalman filters of all tracked objects. States and covariance
+    matrices of the objects are kept in contiguous arrays (one row per
+    object), so prediction and update of all objects are single NumPy
+    operations. Measurements are (x, y) positions, so H matrix selects first
+    two state variables.
+    Example of use:
+        bank = KalmanBank(100)
+        bank.initialize([0, 1], [[10, 20], [30, 40]])
+        bank.predict([0, 1])
+        bank.update([1], [[31, 42]])
+        positions = bank.x[[0, 1], :2]
+    """
+
+    def __init__(self, capacity, model='constant_acceleration', dt=1.,
+                 state_covariance=(100, 100, 10, 10, 1, 1),
+                 model_covariance=(100, 100, 10, 10, 1, 1),
+                 measurement_variance=1.):
+        """
+        :param capacity: number of objects (rows) in the bank.
+        :param model: motion model, one of MOTION_MODELS.
+        :param dt: step of filter.
+        :param state_covariance: diagonal of the initial state covariance
+                                 matrix P. Only first n values are used for
+                                 n state variables model.
+        :param model_covariance: diagonal of the model covariance matrix Q.
+        :param measurement_variance: variance of x and y measurements (R).
+        """
+        self.model = model
+        self.dim = MOTION_MODELS[model]
+        self.F = transition_matrix(model, dt)
+        self.P0 = np.diag(np.asarray(state_covariance, float)[:self.dim])
+        self.Q = np.diag(np.asarray(model_covariance, float)[:self.dim])
+        self.R = np.eye(2) * measurement_variance
+        self.x = np.zeros((capacity, self.dim))
+        self.P = np.zeros((capacity, self.dim, self.dim))
+
+    @property
+    def capacity(self):
+        return self.x.shape[0]
+
+    def resize(self, capacity):
+        """
+        Changes number of rows of the bank, states of the first rows are
+        kept.
+        :param capacity: new number of objects (rows).
+        """
+        kept = min(capacity, self.capacity)
+        x = np.zeros((capacity, self.dim))
+        P = np.zeros((capacity, self.dim, self.dim))
+        x[:kept] = self.x[:kept]
+        P[:kept] = self.P[:kept]
+        self.x, self.P = x, P
+
+    def initialize(self, indices, positions):
+        """
+        Starts new objects - position equal to the measurement, velocity and
+        acceleration equal to 0, initial covariance matrix.
+        :param indices: rows of the bank for new objects.
+        :param positions: (x, y) positions of new objects.
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.x[indices] = 0
+        self.x[indices, :2] = positions
+        self.P[indices] = self.P0
+
+    def predict(self, indices):
+        """
+        Prior of given objects: x = F x, P = F P F' + Q.
+        :param indices: rows of the bank to predict.
+        """
+        F = self.F
+        self.x[indices] = self.x[indices].dot(F.T)
+        self.P[indices] = np.matmul(np.matmul(F, self.P[indices]), F.T) + \
+            self.Q
+
+    def update(self, indices, measurements):
+        """
+        Posterior of given objects with assigned measurements:
+        y = z - H x, S = H P H' + R, K = P H' inv(S), x = x + K y,
+        P = (I - K H) P.
+        :param indices: rows of the bank to update.
+        :param measurements: (x, y) measurements, one for every index.
+        """
+        if not len(indices):
+            return
+        x = self.x[indices]
+        P = self.P[indices]
+        y = np.asarray(measurements, dtype=float).reshape(-1, 2) - x[:, :2]
+        # H P H' and P H' - H selects positions
+        S = P[:, :2, :2] + self.R
+        K = np.matmul(P[:, :, :2], np.linalg.inv(S))
+        self.x[indices] = x + np.einsum('kij,kj->ki', K, y)
+        self.P[indices] = P - np.matmul(K, P[:, :2, :])
+
+    def positions(self, indices):
+        """
+        :param indices: rows of the bank.
+        :return: (x, y) positions of given objects.
+        """
+        return self.x[indices, :2]
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Cache of kernels and filter objects used by the preprocessing. They depend
+only on the parameters, so they are built once per parameters tuple and
+shared by the GUI preview and the full run. Caches are LRU with bounded
+size, so changing parameters with sliders does not grow memory.
+"""
+
+import threading
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from helpers.functions import get_log_kernel
+
+
+@lru_cache(maxsize=32)
+def structuring_element(kernel_type, size):
+    """
+    Square structuring element for morphological operations.
+    :param kernel_type: cv2.MORPH_RECT, cv2.MORPH_ELLIPSE or
+                        cv2.MORPH_CROSS.
+    :param size: width and height of the kernel.
+    :return: read-only kernel array.
+    """
+    kernel = cv2.getStructuringElement(kernel_type, (size, size))
+    kernel.setflags(write=False)
+    return kernel
+
+
+@lru_cache(maxsize=8)
+def log_kernel(size, sigma):
+    """
+    Laplacian of Gaussian kernel, see functions.get_log_kernel().
+    :param size: half of the kernel width.
+    :param sigma: standard deviation of the Gaussian.
+    :return: read-only (2 * size + 1) x (2 * size + 1) kernel array.
+    """
+    kernel = get_log_kernel(size, sigma)
+    kernel.setflags(write=False)
+    return kernel
+
+
+@lru_cache(maxsize=8)
+def log_separable_kernels(size, sigma):
+    """
+    1-D kernels of the LoG kernel decomposition:
+    LoG(x, y) = d(x) g(y) + g(x) d(y) - mean, where g is normalized
+    Gaussian and d is its second derivative (scaled as in get_log_kernel).
+    Valid only if no Gaussian value is cut off in get_log_kernel().
+    :param size: half of the kernel width.
+    :param sigma: standard deviation of the Gaussian.
+    :return: gaussian, derivative - read-only 1-D kernels, mean - value
+             subtracted from every element of the kernel.
+    """
+    x = np.linspace(-size, size, 2 * size + 1)
+    gaussian = np.exp(-x ** 2 / (2 * sigma ** 2))
+    gaussian /= gaussian.sum()
+    derivative = gaussian * (x ** 2 - sigma ** 2) / sigma ** 4
+    mean = 2 * derivative.sum() * gaussian.sum() / len(x) ** 2
+    gaussian.setflags(write=False)
+    derivative.setflags(write=False)
+    return gaussian, derivative, mean
+
+
+def clahe_filter(clip_limit, tile_size):
+    """
+    CLAHE object of OpenCV. The object is not thread safe, so every thread
+    gets its own object.
+    :param clip_limit: threshold for contrast limiting.
+    :param tile_size: number of tiles in rows and columns.
+    :return: cv2.CLAHE object.
+    """
+    return _clahe_filter(clip_limit, tile_size, threading.get_ident())
+
+
+@lru_cache(maxsize=32)
+def _clahe_filter(clip_limit, tile_size, thread):
+    return cv2.createCLAHE(clipLimit=clip_limit,
+                           tileGridSize=(tile_size, tile_size))
+
+
+def clear_caches():
+    """
+    Drops all cached kernels and filter objects.
+    """
+    structuring_element.cache_clear()
+    log_kernel.cache_clear()
+    log_separable_kernels.cache_clear()
+    _clahe_filter.cache_clear()
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Laplacian of Gaussian filtration. LoG kernel is a sum of two separable
+terms (second derivative of Gaussian in x times Gaussian in y and vice
+versa), and the mean subtracted from get_log_kernel() is a constant kernel,
+so instead of the dense (2 * size + 1)^2 kernel filtration can be done with
+1-D passes or with convolution in the frequency domain. All methods give the
+same result as cv2.filter2D with functions.get_log_kernel(), up to float32
+rounding.
+"""
+
+import math
+import sys
+
+import cv2
+import numpy as np
+from scipy.signal import fftconvolve
+
+from helpers.kernels import log_kernel, log_separable_kernels
+
+LOG_METHODS = ('auto', 'dense', 'separable', 'fft')
+
+# relative costs of the methods used by the automatic selection - per pixel
+# and kernel tap for the separable method, per pixel and log2(pixels) for
+# the FFT, measured on 1080p frames
+SEPARABLE_COST = 4.
+FFT_COST = 26.
+
+
+def is_separable(size, sigma):
+    """
+    Kernel from get_log_kernel() is separable if no value of the Gaussian
+    was cut off as smaller than float epsilon.
+    :param size: half of the kernel width.
+    :param sigma: standard deviation of the Gaussian.
+    """
+    return sigma > 0 and \
+        math.exp(-(size / sigma) ** 2) >= sys.float_info.epsilon
+
+
+def select_method(size, sigma, shape):
+    """
+    Chooses the fastest LoG method for given kernel and frame size.
+    :param size: half of the kernel width.
+    :param sigma: standard deviation of the Gaussian.
+    :param shape: shape of the filtered frame.
+    :return: 'dense', 'separable' or 'fft'.
+    """
+    if not is_separable(size, sigma):
+        return 'dense'
+    pixels = (shape[0] + 2 * size) * (shape[1] + 2 * size)
+    separable = SEPARABLE_COST * (2 * size + 1)
+    fft = FFT_COST * math.log(max(pixels, 2), 2)
+    return 'separable' if separable <= fft else 'fft'
+
+
+def log_filter(frame, size, sigma, method='auto'):
+    """
+    Filters grayscale frame with the LoG kernel, borders are reflected
+    (cv2.BORDER_REFLECT_101) like in cv2.filter2D.
+    Example of use:
+        response = log_filter(binary, 20, 10)
+    :param frame: grayscale frame.
+    :param size: half of the kernel width.
+    :param sigma: standard deviation of the Gaussian.
+    :param method: one of LOG_METHODS, 'auto' selects the fastest one.
+    :return: float32 filter response.
+    """
+    if method not in LOG_METHODS:
+        raise ValueError('Unknown LoG method: {}'.format(method))
+    if method == 'auto':
+        method = select_method(size, sigma, frame.shape)
+    elif method != 'dense' and not is_separable(size, sigma):
+        method = 'dense'
+
+    if method == 'dense':
+        return cv2.filter2D(frame, cv2.CV_32F, log_kernel(size, sigma))
+    if method == 'separable':
+        gaussian, derivative, mean = log_separable_kernels(size, sigma)
+        response = cv2.sepFilter2D(frame, cv2.CV_32F, derivative, gaussian)
+        response += cv2.sepFilter2D(frame, cv2.CV_32F, gaussian, derivative)
+        if mean:
+            width = 2 * size + 1
+            response -= mean * cv2.boxFilter(
+                frame, cv2.CV_32F, (width, width), normalize=False)
+        return response
+    padded = np.pad(frame.astype(np.float32), size, mode='reflect')
+    return fftconvolve(padded, log_kernel(size, sigma).astype(np.float32),
+                       mode='valid').astype(np.float32)
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Live tracking of a camera, network stream or pipe (anything cv2.VideoCapture
+opens), or of a video file replayed at a fixed frame rate. Frames are read
+in their own thread into a short queue, and the tracking loop skips frames
+which waited longer than the latency target - under overload frames are
+dropped instead of queueing, so the latency stays bounded. Estimates of
+every frame are emitted as soon as the filter is done with it, and
+latency from reading the frame to emitting its estimates is recorded.
+"""
+
+import array
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from helpers.background import background_from_parameters
+from helpers.functions import blob_detect
+from helpers.instrumentation import METRICS
+from helpers.pipeline import detect_frame
+from helpers.roi import region_from_parameters
+from helpers.thresholding import thresholder_from_parameters
+from helpers.tiling import tiler_from_parameters
+from helpers.tracking import BlobTracker
+
+# reported latency percentiles
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class ReplayCapture(object):
+    """
+    Video file played as a live source - read() returns every frame at its
+    time given by the frame rate, frames which are already late are
+    skipped, as a camera overwrites frames nobody has read.
+    Example of use:
+        capture = ReplayCapture('CIMG4027.MOV', fps=30)
+        ret, frame = capture.read()
+    """
+
+    def __init__(self, video_file, fps=None):
+        """
+        :param video_file: path to the video.
+        :param fps: frame rate of the replay, frame rate of the video if
+                    None.
+        """
+        self._capture = cv2.VideoCapture(video_file)
+        self.fps = fps or self._capture.get(cv2.CAP_PROP_FPS) or 25.
+        # number of frames skipped because they were late
+        self.skipped = 0
+        self._start = None
+        self._next = 0
+
+    def isOpened(self):
+        return self._capture.isOpened()
+
+    def read(self):
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = now
+        # newest frame whose time has come
+        due = int((now - self._start) * self.fps)
+        while self._next < due:
+            if not self._capture.grab():
+                return False, None
+            self._next += 1
+            self.skipped += 1
+        wait = self._start + self._next / self.fps - now
+        if wait > 0:
+            time.sleep(wait)
+        ret, frame = self._capture.read()
+        self._next += 1
+        return ret, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._next)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        return self._capture.get(prop)
+
+    def release(self):
+        self._capture.release()
+
+
+class FrameGrabber(object):
+    """
+    Reads frames of the source in its own thread into a bounded queue of
+    (frame number, read time, frame). The oldest frame is dropped when the
+    queue is full.
+    Example of use:
+        grabber = FrameGrabber(cv2.VideoCapture(0))
+        grabber.start()
+        number, timestamp, frame = grabber.get(max_age=0.05)
+        grabber.stop()
+    """
+
+    def __init__(self, capture, queue_size=8):
+        """
+        :param capture: cv2.VideoCapture like object, released by stop().
+        :param queue_size: maximal number of frames waiting for processing.
+        """
+        self._capture = capture
+        self._queue = deque()
+        self._queue_size = queue_size
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, name='grabber')
+        self._thread.daemon = True
+        # frames read from the source and dropped before processing
+        self.grabbed = 0
+        self.dropped = 0
+
+    def _run(self):
+        try:
+            while not self._stopped:
+                ret, frame = self._capture.read()
+                timestamp = time.perf_counter()
+                if not ret:
+                    break
+                # frame numbers of the source if it has them (files,
+                # some streams), counted frames otherwise
+                position = self._capture.get(cv2.CAP_PROP_POS_FRAMES)
+                number = int(position) - 1 if position > 0 else self.grabbed
+                with self._condition:
+                    if len(self._queue) == self._queue_size:
+                        self._queue.popleft()
+                        self.dropped += 1
+                    self._queue.append((number, timestamp, frame))
+                    self.grabbed += 1
+                    self._condition.notify()
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify()
+
+    def start(self):
+        self._thread.start()
+
+    def get(self, max_age=None):
+        """
+        Waits for a frame. Frames older than max_age are dropped, but the
+        newest frame is always returned.
+        :param max_age: maximal time [s] the frame waited for processing,
+                        None - no limit.
+        :return: (frame number, read time, frame), None at the end of the
+                 source.
+        """
+        with self._condition:
+            while not self._queue and not self._finished:
+                self._condition.wait()
+            if not self._queue:
+                return None
+            if max_age is not None:
+                now = time.perf_counter()
+                while len(self._queue) > 1 and \
+                        now - self._queue[0][1] > max_age:
+                    self._queue.popleft()
+                    self.dropped += 1
+            return self._queue.popleft()
+
+    def stop(self):
+        self._stopped = True
+        self._thread.join()
+        self._capture.release()
+
+
+def latency_report(latencies, target=None):
+    """
+    :param latencies: latencies [s] of the processed frames.
+    :param target: latency target [s], frames above it are counted.
+    :return: dictionary - percentiles, mean and max [ms] and number of
+             frames over the target.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000.
+    if not len(latencies):
+        return {}
+    report = dict(('p{}'.format(percentile), value) for percentile, value in
+                  zip(LATENCY_PERCENTILES,
+                      np.percentile(latencies, LATENCY_PERCENTILES).tolist()))
+    report['mean'] = float(latencies.mean())
+    report['max'] = float(latencies.max())
+    if target is not None:
+        report['over_target'] = int((latencies > target * 1000.).sum())
+    return report
+
+
+def track_live(capture, parameters, on_update=None, max_latency=0.1,
+               max_frames=None, duration=None,
+               detector_factory=blob_detect, queue_size=8):
+    """
+    Tracks blobs of the live source until it ends, max_frames are processed
+    or duration passes.
+    Example of use:
+        report = track_live(cv2.VideoCapture(0), parameters,
+                            lambda number, ids, positions: print(ids))
+    :param capture: cv2.VideoCapture like object, released at the end.
+    :param parameters: dictionary of processing and tracking parameters.
+    :param on_update: optional callable(frame number, ids, positions) -
+                      estimates of every processed frame (see
+                      tracking.BlobTracker.update()), called right after
+                      the filter.
+    :param max_latency: latency target [s] - frames which would exceed it
+                        are dropped, the newest frame is always processed.
+    :param max_frames: number of processed frames, None - no limit.
+    :param duration: maximal tracking time [s], None - no limit.
+    :param detector_factory: function returning the blob detector.
+    :param queue_size: maximal number of frames waiting for processing.
+    :return: report - frame counts, processed frames per second and latency
+             percentiles (see latency_report()).
+    """
+    region = region_from_parameters(parameters)
+    thresholder = thresholder_from_parameters(parameters)
+    background = background_from_parameters(parameters)
+    tiler = tiler_from_parameters(parameters, detector_factory)
+    blob_detector = detector_factory()
+    tracker = BlobTracker(parameters)
+    latencies = array.array('d')
+    # smoothed processing time of one frame
+    processing = 0.
+    previous = None
+
+    grabber = FrameGrabber(capture, queue_size)
+    start = time.perf_counter()
+    grabber.start()
+    try:
+        while max_frames is None or len(latencies) < max_frames:
+            if duration is not None and \
+                    time.perf_counter() - start > duration:
+                break
+            # frame has to be done within the target, including processing
+            item = grabber.get(max(max_latency - processing, 0.))
+            if item is None:
+                break
+            number, timestamp, frame = item
+            processing_start = time.perf_counter()
+            points = detect_frame(frame, parameters, blob_detector, region,
+                                  thresholder, background, tiler)
+            # states are predicted over the dropped frames
+            steps = 1 if previous is None else max(number - previous, 1)
+            ids, positions = tracker.update(points, steps)
+            previous = number
+            if on_update is not None:
+                on_update(number, ids, positions)
+            done = time.perf_counter()
+            processing = 0.9 * processing + 0.1 * (done - processing_start) \
+                if latencies else done - processing_start
+            latencies.append(done - timestamp)
+            METRICS.record_time('live.latency', done - timestamp)
+    finally:
+        grabber.stop()
+        if tiler is not None:
+            tiler.close()
+    elapsed = time.perf_counter() - start
+    # dropped by the latency target, full queue or left at the end
+    dropped = grabber.grabbed - len(latencies)
+    METRICS.increment('live.dropped', dropped)
+    report = {
+        'grabbed': grabber.grabbed,
+        'processed': len(latencies),
+        'dropped': dropped,
+        'source_skipped': getattr(capture, 'skipped', 0),
+        'fps': len(latencies) / elapsed if elapsed else 0.,
+        'estimated_objects': tracker.est_number,
+        'latency_ms': latency_report(latencies, max_latency),
+    }
+    return report
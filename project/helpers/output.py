@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import cv2
+
+from helpers.instrumentation import METRICS
+from helpers.stages import Sink, StageStats, handover
+from helpers.tracking import kalman_tracking
+from helpers.trajectory_io import BinaryTrajectoryWriter, CsvTrajectoryWriter
+from helpers.trajectories import TrajectoryStore
+
+
+class ResultsWriter(object):
+    """
+    Writes estimated positions of one frame after another to the trajectory
+    files (CSV and/or binary, see helpers.trajectory_io) and draws
+    measurements and estimates on the frames of the output video.
+    Example of use:
+        writer = ResultsWriter('results.csv', 'blob.avi')
+        writer.write(0, frame, points, store)
+        writer.close()
+    """
+
+    def __init__(self, results_file, video_output='blob.avi', fps=20,
+                 binary_output=None, velocities=False, covariances=False):
+        """
+        :param results_file: path of the CSV output file (frame,ID,x,y),
+                             None to skip the CSV.
+        :param video_output: path of the annotated output video, None to skip
+                             the video.
+        :param fps: frame rate of the output video.
+        :param binary_output: path of the binary trajectories directory, None
+                              to skip it.
+        :param velocities: write velocities to the binary output.
+        :param covariances: write covariance matrices to the binary output.
+        """
+        self.video_output = video_output
+        self.fps = fps
+        # what the store has to keep for the binary output
+        self.keep_states = bool(binary_output) and velocities
+        self.keep_covariances = bool(binary_output) and covariances
+        self._out_vid = None
+        self._writers = []
+        if results_file:
+            self._writers.append(CsvTrajectoryWriter(results_file))
+        if binary_output:
+            self._writers.append(BinaryTrajectoryWriter(
+                binary_output, velocities, covariances))
+
+    def write(self, frame_number, frame, points, store):
+        """
+        :param frame_number: number of the frame in the store.
+        :param frame: BGR frame, annotations are drawn on it. None if only
+                      trajectories are written.
+        :param points: measurements - (x, y) points of the frame.
+        :param store: TrajectoryStore with estimates of the frame.
+        """
+        rows = store.by_frame(frame_number)
+        with METRICS.timer('output.trajectories'):
+            for writer in self._writers:
+                writer.write(store, rows)
+        if frame is not None and self.video_output:
+            with METRICS.timer('output.render'):
+                self.render(frame_number, frame, points, store.track[rows],
+                            store.x[rows], store.y[rows])
+
+    def render(self, frame_number, frame, points, tracks, xs, ys):
+        """
+        Draws measurements and estimates on the frame and writes it to the
+        output video.
+        :param frame_number: number of the frame, drawn on it.
+        :param frame: BGR frame, or single channel frame.
+        :param points: measurements - (x, y) points of the frame.
+        :param tracks: ids of the estimated objects.
+        :param xs: x positions of the estimated objects.
+        :param ys: y positions of the estimated objects.
+        """
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        elif not frame.flags.writeable:
+            # read only frames of the frame cache
+            frame = frame.copy()
+        # mark detections on the frame - blue dots
+        for point in points:
+            cv2.circle(frame, (int(point[0]), int(point[1])), 2,
+                       (255, 0, 0), -1)
+        # for estimates
+        for est, float_x, float_y in zip(tracks, xs, ys):
+            tmp_x = int(float_x)
+            tmp_y = int(float_y)
+            # mark estimates on the frame - red dots
+            cv2.circle(frame, (tmp_x, tmp_y), 2, (0, 0, 255), -1)
+            cv2.putText(frame, str(est),
+                        (tmp_x + 5, tmp_y - 5),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                        (0, 0, 255), 1, cv2.LINE_AA)
+        # draw frame counter
+        height, width = frame.shape[:2]
+        cv2.putText(frame, 'f_nr: ' + str(frame_number),
+                    (50, height - 10),
+                    cv2.FONT_HERSHEY_COMPLEX, 0.3, (255, 255, 255),
+                    1, cv2.LINE_AA)
+
+        if self._out_vid is None:
+            fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+            self._out_vid = cv2.VideoWriter(self.video_output, fourcc,
+                                            self.fps, (width, height))
+        self._out_vid.write(frame)
+
+    def close(self):
+        if self._out_vid is not None:
+            self._out_vid.release()
+        for writer in self._writers:
+            writer.close()
+
+
+def track_and_render(items, stop_frame, parameters, writer, progress=None,
+                     measurements=None, report=None, queue_size=8):
+    """
+    Runs Kalman filter on the measurements and writes results of every
+    frame as soon as the filter is done with it, so the frames decoded for
+    detection are annotated without decoding the video again. Writing runs
+    in its own thread.
+    Example of use:
+        items = detect_blobs(frames, parameters, detector, with_frames=True)
+        writer = ResultsWriter('results.csv', 'blob.avi')
+        store, est_number = track_and_render(items, 100, parameters, writer)
+    :param items: iterable of (frame, points) pairs - BGR frame and its
+                  measurements.
+    :param stop_frame: number of frames to analise.
+    :param parameters: dictionary of filter parameters.
+    :param writer: ResultsWriter object, closed at the end.
+    :param progress: optional callable, receives progress in percents.
+    :param measurements: optional list, measurements of every frame are
+                         appended to it.
+    :param report: optional dictionary, statistics of the 'track' and
+                   'write' stages are put into it.
+    :param queue_size: maximal number of frames waiting for writing.
+    :return: store - TrajectoryStore with estimates, est_number - number of
+             estimated objects.
+    """
+    store = TrajectoryStore(writer.keep_states, writer.keep_covariances)
+    sink = Sink(lambda item: writer.write(item[0], item[1][0], item[1][1],
+                                          store), queue_size, 'write')
+    tracking_stats = StageStats('track')
+
+    def points(frames):
+        for frame_number, (frame, frame_points) in frames:
+            if measurements is not None:
+                measurements.append(frame_points)
+            yield frame_points
+
+    try:
+        store, est_number = kalman_tracking(
+            points(handover(enumerate(items), sink, tracking_stats)),
+            stop_frame, parameters, progress, store)
+    finally:
+        sink.close()
+        writer.close()
+    if report is not None:
+        report['track'] = tracking_stats.as_dict()
+        report['write'] = sink.stats.as_dict()
+    return store, est_number
+
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Parallel preprocessing and blobs detection. Frames are independent of each
+other, so they are processed by a pool of worker processes. Frames are not
+pickled - main process copies every decoded frame into one of the shared
+memory slots and sends only the slot number to the worker. Frames of the
+frame cache (see helpers.frame_cache) are not copied at all - workers map
+the cache file and get only the frame index. Measurements are returned in
+the order of frames.
+"""
+
+import logging
+import mmap
+import multiprocessing
+import os
+from collections import deque
+from itertools import chain
+
+import cv2
+import numpy as np
+
+from helpers.functions import blob_detect
+from helpers.pipeline import detect_blobs, detect_frame, order_dependent
+from helpers.roi import region_from_parameters
+from helpers.thresholding import thresholder_from_parameters
+from helpers.tiling import tiler_from_parameters
+
+log = logging.getLogger(__name__)
+
+# state of the worker process, set by _init_worker()
+_worker = {}
+
+
+def _init_worker(buffers, shape, dtype, parameters, detector_factory,
+                 cache_file=None):
+    # one OpenCV thread per process, processes are the parallelism
+    cv2.setNumThreads(1)
+    if cache_file is None:
+        _worker['frames'] = [np.frombuffer(buffer, dtype=dtype).reshape(shape)
+                             for buffer in buffers]
+    else:
+        # buffers is the offset of the frames in the cache file, shape of
+        # all frames, slots are frame indexes
+        _worker['frames'] = np.memmap(cache_file, dtype, 'r', buffers, shape)
+    _worker['parameters'] = parameters
+    _worker['blob_detector'] = detector_factory()
+    _worker['region'] = region_from_parameters(parameters)
+    # thresholds are not smoothed and there is no background model in the
+    # workers, see pipeline.order_dependent()
+    _worker['thresholder'] = thresholder_from_parameters(parameters)
+    _worker['tiler'] = tiler_from_parameters(parameters, detector_factory)
+
+
+def _detect_slot(slot):
+    return detect_frame(_worker['frames'][slot], _worker['parameters'],
+                        _worker['blob_detector'], _worker['region'],
+                        _worker['thresholder'], None, _worker['tiler'])
+
+
+def default_workers():
+    """
+    :return: number of available CPU cores.
+    """
+    return os.cpu_count() or 1
+
+
+def parallel_detect(frames, parameters, workers=None,
+                    detector_factory=blob_detect, slots=None,
+                    with_frames=False):
+    """
+    Generator of measurements computed by the pool of processes - parallel
+    version of pipeline.detect_blobs(). Frames which depend on the previous
+    frames (see pipeline.order_dependent()) are processed one by one in the
+    calling process.
+    Example of use:
+        frames = iter_frames(video, 0, 100)
+        for points in parallel_detect(frames, parameters, workers=8):
+            ...
+    :param frames: iterable of BGR frames, all of the same shape, or memory
+                   mapped frames of the frame cache (see
+                   frame_cache.FrameCache.frames()) read by workers directly.
+    :param parameters: dictionary of processing parameters.
+    :param workers: number of processes, number of CPU cores if None.
+    :param detector_factory: module level function returning blob detector,
+                             called once in every worker.
+    :param slots: number of shared frame buffers (frames in flight),
+                  2 * workers if None.
+    :param with_frames: yield (frame, points) pairs instead of points.
+    :return: (x, y) points per frame, see pipeline.find_points().
+    """
+    if order_dependent(parameters):
+        log.warning('Frames are processed in order in one process - '
+                    'measurements depend on the previous frames')
+        for item in detect_blobs(frames, parameters, detector_factory(),
+                                 with_frames, detector_factory):
+            yield item
+        return
+    workers = workers or default_workers()
+    slots = slots or 2 * workers
+    if isinstance(frames, np.memmap) and isinstance(frames.base, mmap.mmap):
+        for item in _parallel_detect_mapped(frames, parameters, workers,
+                                            detector_factory, slots,
+                                            with_frames):
+            yield item
+        return
+    # peek first frame to get shape of the buffers
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        return
+    frames = chain([first], frames)
+
+    buffers = [multiprocessing.RawArray('B', first.nbytes)
+               for _ in range(slots)]
+    views = [np.frombuffer(buffer, dtype=first.dtype).reshape(first.shape)
+             for buffer in buffers]
+    free = list(range(slots))
+    pending = deque()
+    pool = multiprocessing.Pool(workers, _init_worker,
+                                (buffers, first.shape, first.dtype,
+                                 parameters, detector_factory))
+    try:
+        for frame in frames:
+            if not free:
+                # wait for the oldest frame, results go out in order
+                slot, oldest, result = pending.popleft()
+                yield (oldest, result.get()) if with_frames else result.get()
+                free.append(slot)
+            slot = free.pop()
+            views[slot][...] = frame
+            pending.append((slot, frame,
+                            pool.apply_async(_detect_slot, (slot,))))
+        while pending:
+            slot, oldest, result = pending.popleft()
+            yield (oldest, result.get()) if with_frames else result.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _parallel_detect_mapped(frames, parameters, workers, detector_factory,
+                            slots, with_frames):
+    # workers map the same file, only frame indexes are sent
+    pending = deque()
+    pool = multiprocessing.Pool(workers, _init_worker,
+                                (frames.offset, frames.shape, frames.dtype,
+                                 parameters, detector_factory,
+                                 frames.filename))
+    try:
+        for index in range(len(frames)):
+            if len(pending) == slots:
+                oldest, result = pending.popleft()
+                yield (frames[oldest], result.get()) if with_frames \
+                    else result.get()
+            pending.append((index, pool.apply_async(_detect_slot, (index,))))
+        while pending:
+            oldest, result = pending.popleft()
+            yield (frames[oldest], result.get()) if with_frames \
+                else result.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+
+from helpers.kernels import structuring_element
+
+# measurement detectors selectable with the 'detector' parameter
+DETECTORS = ('blobs', 'peaks')
+
+
+def local_maxima_peaks(gray_image, size=27, min_response=0, max_peaks=None,
+                       merge=False):
+    """
+    Finds local maxima in grayscale image - vectorized version of
+    functions.local_maxima(). Non maximum suppression is a single dilation
+    with size x size square kernel, pixels equal to the dilated image and
+    greater than min_response are the peaks. Unlike local_maxima(), image
+    is not wrapped around at borders.
+    Example of use:
+        points = local_maxima_peaks(log_image, size=15, max_peaks=500)
+    :param gray_image: input 2D image (uint8, uint16, int16, float32 or
+                       float64).
+    :param size: width of the neighbourhood of the peak.
+    :param min_response: peaks have to be greater than this value.
+    :param max_peaks: maximal number of returned peaks, the strongest ones
+                      are kept. No limit if None or 0.
+    :param merge: return one peak per flat maximum (e.g. white blob of the
+                  binary image) - centroid of connected peak pixels -
+                  instead of all its pixels.
+    :return: N x 2 array of (x, y) peaks coordinates, ordered by rows.
+    """
+    dilated = cv2.dilate(gray_image, structuring_element(cv2.MORPH_RECT,
+                                                         size))
+    peaks = (gray_image == dilated) & (gray_image > min_response)
+    if merge:
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            peaks.view(np.uint8), connectivity=8)
+        # label 0 is the background
+        centroids = centroids[1:]
+        if max_peaks and len(centroids) > max_peaks:
+            response = np.zeros(count)
+            np.maximum.at(response, labels[peaks], gray_image[peaks])
+            strongest = np.argpartition(response[1:], len(centroids) -
+                                        max_peaks)[-max_peaks:]
+            strongest.sort()
+            centroids = centroids[strongest]
+        return centroids
+    rows, columns = np.nonzero(peaks)
+    if max_peaks and len(rows) > max_peaks:
+        strongest = np.argpartition(gray_image[rows, columns],
+                                    len(rows) - max_peaks)[-max_peaks:]
+        strongest.sort()
+        rows, columns = rows[strongest], columns[strongest]
+    return np.column_stack((columns, rows))
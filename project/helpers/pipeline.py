@@ -0,0 +1,409 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import cv2
+
+from helpers.background import background_from_parameters
+from helpers.functions import blob_detect, local_maxima_blobs
+from helpers.instrumentation import METRICS
+from helpers.kernels import clahe_filter, log_kernel, structuring_element
+from helpers.laplacian import log_filter
+from helpers.peaks import local_maxima_peaks
+from helpers.pyramid import downscale, pyramid_level, refine_points, \
+    scale_parameters, to_full_resolution
+from helpers.roi import region_from_parameters
+from helpers.thresholding import thresholder_from_parameters
+from helpers.tiling import tiler_from_parameters
+
+# default processing parameters, the same as in the GUI
+DEFAULT_PARAMETERS = {
+    # 0 - blue, 1 - green, 2 - red
+    'color_channel': 2,
+    'clahe': False,
+    'clahe_clip_limit': 8.0,
+    'clahe_tile_size': 8,
+    # background subtraction - 'none', 'MOG2' or 'KNN', see
+    # background.BACKGROUND_METHODS
+    'background': 'none',
+    # scale of the frames the background model is learned on
+    'background_scale': 1.,
+    'background_history': 500,
+    # None - OpenCV default of the method
+    'background_var_threshold': None,
+    # negative - automatic
+    'background_learning_rate': -1,
+    # threshold the foreground pixels, otherwise the foreground mask
+    # replaces the threshold
+    'background_and_threshold': False,
+    # (x_min, x_max, y_min, y_max) - None means whole frame
+    'roi': None,
+    # polygons of (x, y) vertices, only pixels inside them are analysed,
+    # see roi.RegionOfInterest
+    'roi_polygons': (),
+    'threshold': 114,
+    # 'fixed', 'otsu' or 'adaptive', see thresholding.THRESHOLD_MODES
+    'threshold_mode': 'fixed',
+    # weight of the previous frames thresholds, 0 - no smoothing
+    'threshold_smoothing': 0.,
+    # tiles in rows and in columns of the 'adaptive' mode
+    'threshold_tiles': 4,
+    'erode': False,
+    'erode_type': cv2.MORPH_RECT,
+    'erode_size': 5,
+    'open': False,
+    'open_type': cv2.MORPH_RECT,
+    'open_size': 20,
+    'close': False,
+    'close_type': cv2.MORPH_RECT,
+    'close_size': 20,
+    'dilate': False,
+    'dilate_type': cv2.MORPH_RECT,
+    'dilate_size': 5,
+    'LoG': False,
+    'LoG_size': 20,
+    # 'auto', 'dense', 'separable' or 'fft', see laplacian.LOG_METHODS
+    'LoG_method': 'auto',
+    # measurements detector - 'blobs' (cv2.SimpleBlobDetector) or 'peaks'
+    # (local maxima of the preprocessed frame), see peaks.DETECTORS
+    'detector': 'blobs',
+    'peaks_size': 27,
+    'peaks_min_response': 0,
+    # maximal number of peaks per frame, 0 - no limit
+    'peaks_max': 0,
+    # one peak per flat maximum instead of all its pixels
+    'peaks_merge': False,
+    # detection on the frame downscaled 2^level times, 0 - full resolution,
+    # 'auto' - chosen from blob_size, see pyramid.select_level()
+    'pyramid_level': 0,
+    # expected blob diameter [px]
+    'blob_size': None,
+    # half of the full resolution refinement window [px], None - from
+    # blob_size and the level
+    'pyramid_refine_radius': None,
+    # morphological operations and detection on tiles of this size [px]
+    # processed in parallel, 0 - whole frame, see helpers.tiling
+    'tile_size': 0,
+    # threads processing the tiles, 0 - number of CPU cores
+    'tile_workers': 0,
+    # width of the tiles overlap [px], None - from the kernel sizes
+    'tile_overlap': None,
+}
+
+
+def color_channel(frame, channel):
+    """
+    Returns only one color channel of input frame.
+    Output is in grayscale.
+    :param frame: BGR frame, or already single channel frame (e.g. from the
+                  frame cache of one channel) which is returned as it is.
+    :param channel: index of the channel (0 - blue, 1 - green, 2 - red).
+    :return: single channel frame.
+    """
+    if frame.ndim == 2:
+        return frame
+    return frame[:, :, channel]
+
+
+def clahe(frame, clip_limit=8.0, tile_size=8):
+    """
+    Contrast Limited Adaptive Histogram Equalization of grayscale frame.
+    CLAHE object is cached for given clip limit and tile size.
+    """
+    return clahe_filter(clip_limit, tile_size).apply(frame)
+
+
+def threshold(frame, value):
+    """
+    Binary threshold of grayscale frame.
+    """
+    ret, frame = cv2.threshold(frame, value, 255, cv2.THRESH_BINARY)
+    return frame
+
+
+# stages of morphological() in order of application, with parameters they
+# depend on
+MORPHOLOGICAL_STAGES = (
+    ('erode', ('erode', 'erode_type', 'erode_size')),
+    ('open', ('open', 'open_type', 'open_size')),
+    ('close', ('close', 'close_type', 'close_size')),
+    ('dilate', ('dilate', 'dilate_type', 'dilate_size')),
+    ('LoG', ('LoG', 'LoG_size', 'LoG_method')),
+)
+
+
+def _kernel(parameters, operation):
+    kernel_type = parameters[operation + '_type']
+    kernel_size = parameters[operation + '_size']
+    if kernel_type and kernel_size:
+        return structuring_element(kernel_type, kernel_size)
+    return None
+
+
+def create_kernels(parameters):
+    """
+    Creates kernels for morphological operations.
+    Check cv2.getStructuringElement() doc for more info:
+    http://docs.opencv.org/3.0-beta/doc/py_tutorials/py_imgproc/
+    py_morphological_ops/py_morphological_ops.html
+
+    Assumed that all kernels (except LoG kernel) are square. Kernels are
+    cached, so calling it for every frame is cheap.
+    :param parameters: dictionary of processing parameters.
+    :return: opening_kernel, close_kernel, erosion_kernel, dilate_kernel,
+             LoG_kernel
+    """
+    kernels = [_kernel(parameters, operation)
+               for operation in ('open', 'close', 'erode', 'dilate')]
+    if parameters['LoG'] and parameters['LoG_size']:
+        kernels.append(log_kernel(parameters['LoG_size'],
+                                  int(parameters['LoG_size'] * 0.5)))
+    else:
+        kernels.append(None)
+    return tuple(kernels)
+
+
+def morphological_stage(name, frame, parameters):
+    """
+    Applies one of MORPHOLOGICAL_STAGES if it is selected by the user.
+    :param name: name of the stage.
+    :param frame: binary frame or result of the previous stage.
+    :param parameters: dictionary of processing parameters.
+    :return: processed frame, the same object if stage is not selected.
+    """
+    if not parameters[name]:
+        return frame
+    if name == 'erode':
+        return cv2.erode(frame, _kernel(parameters, 'erode'), iterations=1)
+    if name == 'open':
+        return cv2.morphologyEx(frame, cv2.MORPH_OPEN,
+                                _kernel(parameters, 'open'))
+    if name == 'close':
+        return cv2.morphologyEx(frame, cv2.MORPH_CLOSE,
+                                _kernel(parameters, 'close'))
+    if name == 'dilate':
+        return cv2.dilate(frame, _kernel(parameters, 'dilate'), iterations=1)
+    if name == 'LoG':
+        # LoG filtration for finding local maximas, method is chosen from
+        # kernel and frame size if not given
+        frame = log_filter(frame, parameters['LoG_size'],
+                           int(parameters['LoG_size'] * 0.5),
+                           parameters.get('LoG_method', 'auto'))
+        frame *= 255
+        # remove near 0 floats
+        frame[frame < 1e-5] = 0
+        return frame.astype('uint8')
+    raise ValueError('Unknown morphological stage: {}'.format(name))
+
+
+def morphological(frame, parameters):
+    """
+    Apply morphological operations selected by the user: erode -> open ->
+    close -> dilate -> LoG.
+    :param frame: binary frame.
+    :param parameters: dictionary of processing parameters.
+    :return: preprocessed frame.
+    """
+    for name, stage_parameters in MORPHOLOGICAL_STAGES:
+        frame = morphological_stage(name, frame, parameters)
+    return frame
+
+
+def preprocess_frame(frame, parameters, region=None, thresholder=None,
+                     background=None, level=0):
+    """
+    Full preprocessing chain of one frame: color channel -> ROI crop ->
+    (downscaling) -> background subtraction -> CLAHE -> threshold ->
+    morphological operations. Everything after the color channel extraction
+    runs only on the bounding box of the region of interest. With background
+    subtraction the foreground mask replaces the threshold, or only
+    foreground pixels are thresholded ('background_and_threshold').
+    :param frame: BGR frame.
+    :param parameters: dictionary of processing parameters.
+    :param region: RegionOfInterest object, created from parameters if not
+                   given.
+    :param thresholder: thresholding.Thresholder object, keeps thresholds
+                        of the previous frames for the smoothing. Created
+                        from parameters (no smoothing) if not given.
+    :param background: background.BackgroundSubtractor object learned from
+                       the previous frames, None - no background
+                       subtraction.
+    :param level: level of the pyramid - frame is downscaled 2^level times
+                  and kernel sizes are scaled to it, see helpers.pyramid.
+    :return: preprocessed grayscale frame cropped to the region of interest.
+    """
+    frame = binary_frame(frame, parameters, region, thresholder, background,
+                         level)
+    return morphological(frame, scale_parameters(parameters, level))
+
+
+def binary_frame(frame, parameters, region=None, thresholder=None,
+                 background=None, level=0):
+    """
+    Preprocessing chain of preprocess_frame() without the morphological
+    operations.
+    :return: binary grayscale frame cropped to the region of interest.
+    """
+    if region is None:
+        region = region_from_parameters(parameters)
+    if thresholder is None:
+        thresholder = thresholder_from_parameters(parameters)
+    frame = color_channel(frame, parameters['color_channel'])
+    frame = region.crop(frame)
+    if level:
+        frame = downscale(frame, level)
+    foreground = None
+    if background is not None:
+        foreground = background.apply(frame)
+        if not parameters.get('background_and_threshold', False):
+            return foreground
+    if parameters['clahe']:
+        frame = clahe(frame, parameters.get('clahe_clip_limit', 8.0),
+                      parameters.get('clahe_tile_size', 8))
+    frame = thresholder.apply(frame)
+    if foreground is not None:
+        frame = cv2.bitwise_and(frame, foreground)
+    return frame
+
+
+def find_points(frame, parameters, blob_detector):
+    """
+    Finds measurements in the preprocessed frame with the detector selected
+    by the 'detector' parameter.
+    :param frame: preprocessed grayscale frame.
+    :param parameters: dictionary of processing parameters.
+    :param blob_detector: cv2.SimpleBlobDetector object, not used by the
+                          'peaks' detector.
+    :return: list of (x, y) tuples ('blobs') or N x 2 array ('peaks').
+    """
+    detector = parameters.get('detector', 'blobs')
+    if detector == 'blobs':
+        return local_maxima_blobs(frame, blob_detector)
+    if detector == 'peaks':
+        return local_maxima_peaks(frame,
+                                  parameters.get('peaks_size', 27),
+                                  parameters.get('peaks_min_response', 0),
+                                  parameters.get('peaks_max', 0),
+                                  parameters.get('peaks_merge', False))
+    raise ValueError('Unknown detector: {}'.format(detector))
+
+
+def detect_frame(frame, parameters, blob_detector, region=None,
+                 thresholder=None, background=None, tiler=None):
+    """
+    Preprocesses one frame and finds blobs in it.
+    :param frame: BGR frame.
+    :param parameters: dictionary of processing parameters.
+    :param blob_detector: cv2.SimpleBlobDetector object.
+    :param region: RegionOfInterest object, created from parameters if not
+                   given.
+    :param thresholder: thresholding.Thresholder object, see
+                        preprocess_frame().
+    :param background: background.BackgroundSubtractor object, see
+                       preprocess_frame().
+    :param tiler: tiling.TileProcessor object - morphological operations
+                  and detection run on tiles in parallel, None - whole
+                  frame.
+    :return: (x, y) points in the full frame coordinates, see
+             find_points().
+    """
+    if region is None:
+        region = region_from_parameters(parameters)
+    level = pyramid_level(parameters)
+    if tiler is not None:
+        with METRICS.timer('detection.preprocess'):
+            frame_preprocessed = binary_frame(frame, parameters, region,
+                                              thresholder, background, level)
+        with METRICS.timer('detection.tiles'):
+            points = tiler.detect(frame_preprocessed,
+                                  scale_parameters(parameters, level),
+                                  morphological, find_points)
+    else:
+        with METRICS.timer('detection.preprocess'):
+            frame_preprocessed = preprocess_frame(frame, parameters, region,
+                                                  thresholder, background,
+                                                  level)
+        with METRICS.timer('detection.find_points'):
+            points = find_points(frame_preprocessed,
+                                 scale_parameters(parameters, level),
+                                 blob_detector)
+    METRICS.observe('detection.points', len(points))
+    if level:
+        with METRICS.timer('detection.refine'):
+            points = refine_full_resolution(frame, points,
+                                            frame_preprocessed.shape,
+                                            parameters, region, level)
+    return region.to_frame(points, frame.shape)
+
+
+def refine_full_resolution(frame, points, small_shape, parameters, region,
+                           level):
+    """
+    Maps points found on the downscaled frame to the full resolution and
+    refines them to sub-pixel positions, see pyramid.refine_points().
+    :param frame: BGR frame.
+    :param points: (x, y) points found in the downscaled, cropped frame.
+    :param small_shape: shape of the downscaled, cropped frame.
+    :param parameters: dictionary of processing parameters.
+    :param region: RegionOfInterest object.
+    :param level: level of the pyramid.
+    :return: N x 2 array of points in the full resolution cropped frame.
+    """
+    cropped = region.crop(color_channel(frame, parameters['color_channel']))
+    radius = parameters.get('pyramid_refine_radius')
+    if radius is None:
+        # blob and the error of its downscaled position
+        radius = int((parameters.get('blob_size') or 2 ** level) / 2) + \
+            2 ** level
+    return refine_points(cropped, to_full_resolution(points, small_shape,
+                                                     cropped.shape), radius)
+
+
+def order_dependent(parameters):
+    """
+    :param parameters: dictionary of processing parameters.
+    :return: True if measurements of a frame depend on the previous frames
+             - thresholds are smoothed over the frames or the background
+             model learns from them. Such frames have to be processed one
+             by one in their order, parallel runs fall back to it.
+    """
+    return bool(parameters.get('threshold_smoothing')) or \
+        parameters.get('background', 'none') != 'none'
+
+
+def detect_blobs(frames, parameters, blob_detector, with_frames=False,
+                 detector_factory=blob_detect):
+    """
+    Generator of measurements - local maximas found in every frame.
+    :param frames: iterable of BGR frames.
+    :param parameters: dictionary of processing parameters.
+    :param blob_detector: cv2.SimpleBlobDetector object.
+    :param with_frames: yield (frame, points) pairs instead of points.
+    :param detector_factory: function returning blob detector for the
+                             threads of the tiles, see helpers.tiling.
+    :return: (x, y) points per frame, see find_points().
+    """
+    region = region_from_parameters(parameters)
+    # one thresholder and background model for the whole run - they learn
+    # from the previous frames
+    thresholder = thresholder_from_parameters(parameters)
+    background = background_from_parameters(parameters)
+    tiler = tiler_from_parameters(parameters, detector_factory)
+    try:
+        for frame in frames:
+            points = detect_frame(frame, parameters, blob_detector, region,
+                                  thresholder, background, tiler)
+            yield (frame, points) if with_frames else points
+    finally:
+        if tiler is not None:
+            tiler.close()
+
+
+def record(items, store):
+    """
+    Pass items further down the pipeline while appending them to the store.
+    Use it only for small per frame results (e.g. measurements), never for
+    the frames.
+    """
+    for item in items:
+        store.append(item)
+        yield item
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Preprocessing of the frames shown by the GUI player. Result of every stage
+is cached with the key made of the frame key and of the parameters of the
+stage and of all stages before it, so when a slider of one stage is moved
+only this stage and the stages after it are computed again.
+"""
+
+import json
+from collections import OrderedDict
+
+from helpers.pipeline import MORPHOLOGICAL_STAGES, clahe, color_channel, \
+    morphological_stage
+from helpers.roi import region_from_parameters
+from helpers.thresholding import thresholder_from_parameters
+
+# stages of the preview with parameters they depend on, the last ones are
+# used only when thresholding is switched on
+PREVIEW_STAGES = (
+    ('channel', ('color_channel', 'roi', 'roi_polygons')),
+    ('clahe', ('clahe', 'clahe_clip_limit', 'clahe_tile_size')),
+    ('threshold', ('threshold', 'threshold_mode', 'threshold_tiles')),
+) + MORPHOLOGICAL_STAGES
+
+# default memory limit of the cache
+PREVIEW_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class StageCache(object):
+    """
+    LRU cache of arrays with limited memory - the least recently used
+    arrays are removed when total size of cached arrays exceeds the limit.
+    """
+
+    def __init__(self, max_bytes=PREVIEW_CACHE_BYTES):
+        """
+        :param max_bytes: maximal total size of cached arrays.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """
+        :return: cached array or None.
+        """
+        array = self._items.get(key)
+        if array is not None:
+            self._items.move_to_end(key)
+        return array
+
+    def put(self, key, array):
+        """
+        Caches the array, arrays bigger than the limit are not cached.
+        """
+        if array.nbytes > self.max_bytes:
+            return
+        if key in self._items:
+            self.nbytes -= self._items.pop(key).nbytes
+        self._items[key] = array
+        self.nbytes += array.nbytes
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self._items.popitem(last=False)[1].nbytes
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+
+def _stage_keys(frame_key, parameters, stages):
+    # key of every stage contains parameters of all stages before it
+    keys = []
+    values = []
+    for name, stage_parameters in stages:
+        values.append([parameters.get(key) for key in stage_parameters])
+        keys.append((frame_key, name, json.dumps(values)))
+    return keys
+
+
+def _apply(name, frame, parameters):
+    if name == 'channel':
+        frame = color_channel(frame, parameters['color_channel'])
+        # process only bounding box of the region of interest
+        return region_from_parameters(parameters).crop(frame).copy()
+    if name == 'clahe':
+        if not parameters['clahe']:
+            return frame
+        return clahe(frame, parameters['clahe_clip_limit'],
+                     parameters['clahe_tile_size'])
+    if name == 'threshold':
+        # single frame - thresholds are not smoothed
+        return thresholder_from_parameters(parameters).apply(frame)
+    return morphological_stage(name, frame, parameters)
+
+
+def preview_frame(frame, frame_key, parameters, cache, thresholding=True):
+    """
+    Preprocesses the frame for the player, reusing cached results of the
+    stages which parameters did not change.
+    Example of use:
+        cache = StageCache()
+        shown = preview_frame(frame, frame_index, parameters, cache)
+    :param frame: BGR frame.
+    :param frame_key: hashable identifier of the frame (e.g. its index),
+                      None disables the cache.
+    :param parameters: dictionary of processing parameters.
+    :param cache: StageCache object.
+    :param thresholding: apply threshold and morphological operations.
+    :return: preprocessed frame of the full frame size.
+    """
+    stages = PREVIEW_STAGES if thresholding else PREVIEW_STAGES[:2]
+    keys = _stage_keys(frame_key, parameters, stages)
+    # the last cached stage
+    start, result = 0, frame
+    if frame_key is not None:
+        for index in range(len(stages) - 1, -1, -1):
+            cached = cache.get(keys[index])
+            if cached is not None:
+                start, result = index + 1, cached
+                break
+
+    for index in range(start, len(stages)):
+        processed = _apply(stages[index][0], result, parameters)
+        # stages which are switched off return their input, it's already
+        # cached
+        if frame_key is not None and processed is not result:
+            cache.put(keys[index], processed)
+        result = processed
+    return region_from_parameters(parameters).expand(result, frame.shape[:2])
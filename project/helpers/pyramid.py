@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution detection. Preprocessing and detection run on the frame
+downscaled 2^level times, with kernel sizes scaled to the level, and the
+found points are refined to sub-pixel positions in small windows of the
+full resolution frame. Points are returned in the full resolution
+coordinates, as without the pyramid.
+Level is given with the 'pyramid_level' parameter, or chosen from the
+expected blob diameter ('blob_size') if it's 'auto' - blobs are kept at
+least PYRAMID_MIN_BLOB pixels wide.
+Parameters of cv2.SimpleBlobDetector ('blobs' detector) are not scaled.
+"""
+
+import math
+
+import cv2
+import numpy as np
+
+# minimal blob diameter [px] on the downscaled frame of the 'auto' level
+PYRAMID_MIN_BLOB = 8
+PYRAMID_MAX_LEVEL = 4
+
+# kernel sizes [px] scaled with the level and their minimal values
+SCALED_PARAMETERS = (
+    ('erode_size', 1),
+    ('open_size', 1),
+    ('close_size', 1),
+    ('dilate_size', 1),
+    # LoG sigma is half of the size, it has to be at least 1
+    ('LoG_size', 2),
+    ('peaks_size', 3),
+)
+
+
+def select_level(blob_size, min_blob=PYRAMID_MIN_BLOB,
+                 max_level=PYRAMID_MAX_LEVEL):
+    """
+    :param blob_size: expected blob diameter [px] in the full resolution.
+    :param min_blob: minimal blob diameter [px] on the downscaled frame.
+    :param max_level: maximal returned level.
+    :return: the highest level with blobs at least min_blob wide.
+    """
+    if not blob_size or blob_size < 2 * min_blob:
+        return 0
+    return min(int(math.log(blob_size / min_blob, 2)), max_level)
+
+
+def pyramid_level(parameters):
+    """
+    :param parameters: dictionary of processing parameters.
+    :return: level of the pyramid the detection runs on, 0 - full
+             resolution.
+    """
+    level = parameters.get('pyramid_level', 0)
+    if level == 'auto':
+        return select_level(parameters.get('blob_size'))
+    return int(level or 0)
+
+
+def scale_parameters(parameters, level):
+    """
+    :param parameters: dictionary of processing parameters.
+    :param level: level of the pyramid.
+    :return: copy of parameters with kernel sizes scaled to the level,
+             the same dictionary for level 0.
+    """
+    if not level:
+        return parameters
+    scale = 2 ** level
+    scaled = dict(parameters)
+    for key, minimum in SCALED_PARAMETERS:
+        if scaled.get(key):
+            scaled[key] = max(minimum, int(round(scaled[key] / scale)))
+    return scaled
+
+
+def downscale(frame, level):
+    """
+    :param frame: grayscale frame.
+    :param level: level of the pyramid.
+    :return: frame downscaled 2^level times (averages of the pixel blocks).
+    """
+    if not level:
+        return frame
+    scale = 0.5 ** level
+    return cv2.resize(frame, None, fx=scale, fy=scale,
+                      interpolation=cv2.INTER_AREA)
+
+
+def to_full_resolution(points, small_shape, shape):
+    """
+    Maps (x, y) points of the downscaled frame to the full resolution frame,
+    pixel centers to pixel centers.
+    :param points: list of (x, y) tuples or N x 2 array.
+    :param small_shape: shape of the downscaled frame.
+    :param shape: shape of the full resolution frame.
+    :return: N x 2 float array.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    scale = (shape[1] / small_shape[1], shape[0] / small_shape[0])
+    return (points + 0.5) * scale - 0.5
+
+
+def refine_points(frame, points, radius):
+    """
+    Moves points to the centroids of the bright pixels in their windows -
+    pixels brighter than the middle between the darkest and the brightest
+    pixel of the window, weighted by the brightness above the middle. All
+    windows are processed at once.
+    Example of use:
+        points = refine_points(gray, points, radius=4)
+    :param frame: full resolution grayscale frame.
+    :param points: N x 2 array of (x, y) points.
+    :param radius: half of the window width [px].
+    :return: N x 2 float array of refined points, points without contrast
+             in the window are not moved.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if not len(points) or radius < 1:
+        return points
+    height, width = frame.shape[:2]
+    offsets = np.arange(-radius, radius + 1)
+    xs = np.rint(points[:, 0]).astype(np.intp)[:, None] + offsets
+    ys = np.rint(points[:, 1]).astype(np.intp)[:, None] + offsets
+    inside_x = (xs >= 0) & (xs < width)
+    inside_y = (ys >= 0) & (ys < height)
+    np.clip(xs, 0, width - 1, out=xs)
+    np.clip(ys, 0, height - 1, out=ys)
+    # N x window x window pixels, rows are y
+    windows = frame[ys[:, :, None], xs[:, None, :]].astype(np.float32)
+    inside = inside_y[:, :, None] & inside_x[:, None, :]
+    low = np.where(inside, windows, np.inf).min(axis=(1, 2))
+    high = np.where(inside, windows, -np.inf).max(axis=(1, 2))
+    weights = windows - ((low + high) / 2)[:, None, None]
+    weights[~inside | (weights < 0)] = 0
+    total = weights.sum(axis=(1, 2))
+    contrast = total > 0
+    refined = points.copy()
+    refined[contrast, 0] = (weights.sum(axis=1) * xs).sum(axis=1)[
+        contrast] / total[contrast]
+    refined[contrast, 1] = (weights.sum(axis=2) * ys).sum(axis=1)[
+        contrast] / total[contrast]
+    return refined
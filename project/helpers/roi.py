@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+
+class RegionOfInterest(object):
+    """
+    Region of interest of the video frames. Region is a rectangle optionally
+    narrowed down to the union of polygons. Mask and bounding box are
+    computed once per frame resolution, so frames can be cropped to the
+    bounding box before the expensive operations are applied.
+    Example of use:
+        region = RegionOfInterest((0, 160, 0, 386), fill=120)
+        small_frame = region.crop(gray_frame)
+        points = region.to_frame(local_maxima(small_frame), gray_frame.shape)
+    """
+
+    def __init__(self, rectangle=None, polygons=(), fill=255):
+        """
+        :param rectangle: (top, bottom, left, right) pixel bounds of the
+                          region, bottom and right excluded. None means
+                          whole frame.
+        :param polygons: list of polygons, every polygon is a list of (x, y)
+                         vertices in frame coordinates.
+        :param fill: value of pixels outside of the region.
+        """
+        self.rectangle = rectangle
+        self.polygons = [np.array(polygon, dtype=np.int32).reshape(-1, 2)
+                         for polygon in polygons]
+        self.fill = fill
+        # shape -> (bounding box, cropped mask or None)
+        self._layouts = {}
+
+    def _layout(self, shape):
+        """
+        Computes bounding box and mask of the region for given resolution.
+        :param shape: (height, width) of the frame.
+        :return: (top, bottom, left, right), boolean mask of the bounding box
+                 area (None if all pixels of the box belong to the region)
+        """
+        layout = self._layouts.get(shape)
+        if layout is not None:
+            return layout
+
+        height, width = shape
+        top, bottom, left, right = 0, height, 0, width
+        if self.rectangle is not None:
+            top = int(min(max(self.rectangle[0], 0), height))
+            bottom = int(min(max(self.rectangle[1], top), height))
+            left = int(min(max(self.rectangle[2], 0), width))
+            right = int(min(max(self.rectangle[3], left), width))
+
+        mask = None
+        if self.polygons:
+            full_mask = np.zeros(shape, dtype=np.uint8)
+            cv2.fillPoly(full_mask, self.polygons, 1)
+            full_mask[:top] = 0
+            full_mask[bottom:] = 0
+            full_mask[:, :left] = 0
+            full_mask[:, right:] = 0
+            rows = np.flatnonzero(full_mask.any(axis=1))
+            columns = np.flatnonzero(full_mask.any(axis=0))
+            if len(rows):
+                top, bottom = rows[0], rows[-1] + 1
+                left, right = columns[0], columns[-1] + 1
+            else:
+                bottom, right = top, left
+            mask = full_mask[top:bottom, left:right].astype(bool)
+            if mask.all():
+                mask = None
+
+        layout = ((int(top), int(bottom), int(left), int(right)), mask)
+        self._layouts[shape] = layout
+        return layout
+
+    def bounding_box(self, shape):
+        """
+        :param shape: (height, width) of the frame.
+        :return: (top, bottom, left, right) bounds of the region.
+        """
+        return self._layout(tuple(shape[:2]))[0]
+
+    def mask(self, shape):
+        """
+        :param shape: (height, width) of the frame.
+        :return: boolean mask of the region in full frame size.
+        """
+        (top, bottom, left, right), mask = self._layout(tuple(shape[:2]))
+        full_mask = np.zeros(shape[:2], dtype=bool)
+        full_mask[top:bottom, left:right] = True if mask is None else mask
+        return full_mask
+
+    def crop(self, frame):
+        """
+        Crops frame to the bounding box of the region. Pixels of the box
+        which are outside of the region are set to the fill value.
+        :param frame: input frame, it is not modified.
+        :return: cropped frame.
+        """
+        (top, bottom, left, right), mask = self._layout(frame.shape[:2])
+        frame = frame[top:bottom, left:right]
+        if mask is not None:
+            frame = frame.copy()
+            frame[~mask] = self.fill
+        return frame
+
+    def apply(self, frame):
+        """
+        Sets pixels outside of the region to the fill value.
+        :param frame: input frame, modified in place.
+        :return: frame with region of interest.
+        """
+        (top, bottom, left, right), mask = self._layout(frame.shape[:2])
+        frame[:top] = self.fill
+        frame[bottom:] = self.fill
+        frame[:, :left] = self.fill
+        frame[:, right:] = self.fill
+        if mask is not None:
+            frame[top:bottom, left:right][~mask] = self.fill
+        return frame
+
+    def expand(self, cropped, shape):
+        """
+        Inverse of crop() - places cropped frame in the full size frame.
+        :param cropped: frame returned by crop() (or its processed version).
+        :param shape: (height, width) of the full frame.
+        :return: full size frame, outside of the region set to fill value.
+        """
+        top, bottom, left, right = self.bounding_box(shape)
+        frame = np.full(tuple(shape[:2]) + cropped.shape[2:], self.fill,
+                        dtype=cropped.dtype)
+        frame[top:bottom, left:right] = cropped
+        return frame
+
+    def to_frame(self, points, shape):
+        """
+        Maps (x, y) points found in the cropped frame to the full frame
+        coordinates.
+        :param points: list of (x, y) tuples or N x 2 array.
+        :param shape: (height, width) of the full frame.
+        :return: list of (x, y) tuples or N x 2 array.
+        """
+        top, bottom, left, right = self.bounding_box(shape)
+        if not top and not left:
+            return points
+        if isinstance(points, np.ndarray):
+            return points + (left, top)
+        return [(x + left, y + top) for x, y in points]
+
+
+@lru_cache(maxsize=8)
+def _cached_region(rectangle, polygons):
+    return RegionOfInterest(rectangle, polygons)
+
+
+def region_from_parameters(parameters):
+    """
+    Returns region of interest described by processing parameters. The
+    same object is returned for the same parameters, so masks are not
+    recomputed.
+    :param parameters: dictionary of processing parameters. 'roi' holds
+                       slider values (x_min, x_max, y_min, y_max) - rows
+                       from x_min to x_max (excluded) and columns from
+                       y_min to y_max (included) or None for the whole
+                       frame, optional 'roi_polygons' holds list of
+                       polygons.
+    :return: RegionOfInterest object.
+    """
+    rectangle = None
+    if parameters.get('roi') is not None:
+        x_min, x_max, y_min, y_max = parameters['roi']
+        rectangle = (int(x_min), int(x_max), int(y_min), int(y_max) + 1)
+    polygons = tuple(tuple(tuple(int(v) for v in vertex) for vertex in polygon)
+                     for polygon in parameters.get('roi_polygons', ()))
+    return _cached_region(rectangle, polygons)
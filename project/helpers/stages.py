@@ -0,0 +1,358 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Pipeline of stages running in threads, connected by bounded queues. A full
+queue blocks the stage which feeds it, so a slow stage slows down the stages
+before it instead of filling memory. OpenCV releases the GIL, so worker
+threads of the OpenCV-heavy stages run in parallel.
+Example of use:
+    pipeline = Pipeline(queue_size=16)
+    pipeline.source(iter_frames(video, 0, 100), 'decode')
+    pipeline.map(preprocess, workers=4, name='preprocess')
+    for result in pipeline:
+        ...
+    print(pipeline.report())
+"""
+
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+# end of the stream marker
+_END = object()
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+class StageStats(object):
+    """
+    Statistics of one stage - number of processed items, time spent on
+    processing (summed over worker threads) and depth of the input queue,
+    sampled every time stage takes an item.
+    """
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.started = None
+        self.stopped = None
+        self._lock = threading.Lock()
+
+    def record(self, busy, depth):
+        with self._lock:
+            self.items += 1
+            self.busy += busy
+            self.depth_sum += depth
+            self.depth_max = max(self.depth_max, depth)
+
+    def as_dict(self):
+        """
+        :return: dictionary of statistics - items, busy [s], wall [s],
+                 throughput - processed items per second of the stage wall
+                 time, capacity - items per second the stage could process
+                 if it never waited, queue_mean and queue_max depths.
+        """
+        wall = 0.
+        if self.started is not None:
+            wall = (self.stopped or time.perf_counter()) - self.started
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'busy': self.busy,
+            'wall': wall,
+            'throughput': self.items / wall if wall else 0.,
+            'capacity': self.workers * self.items / self.busy
+            if self.busy else 0.,
+            'queue_mean': self.depth_sum / self.items if self.items else 0.,
+            'queue_max': self.depth_max,
+        }
+
+
+class Pipeline(object):
+    """
+    Chain of stages. The first one is source() - iterable consumed by its own
+    thread, next are map() stages - functions applied by one or more worker
+    threads. Iterating over the pipeline gives results of the last stage in
+    the order of source items. Exception raised in any stage is raised again
+    in the iterating thread. Number of items in flight (taken from the source
+    and not yet given out) is limited by the sum of the queue sizes, so
+    results waiting behind a slow item for their turn block the source
+    instead of filling memory.
+    """
+
+    def __init__(self, queue_size=8):
+        """
+        :param queue_size: maximal number of items waiting between stages.
+        """
+        self.queue_size = queue_size
+        self.stats = OrderedDict()
+        self._queue = None
+        self._threads = []
+        self._stop = threading.Event()
+        # items in flight and their limit - sum of the queue sizes
+        self._in_flight = 0
+        self._window = 0
+        self._flow = threading.Condition()
+
+    def _put(self, target, item):
+        # wait for free place, give up when pipeline is stopped
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _admit(self):
+        # wait until an item leaves the pipeline if the window is full, give
+        # up when pipeline is stopped
+        with self._flow:
+            while not self._stop.is_set():
+                if self._in_flight < self._window:
+                    self._in_flight += 1
+                    return True
+                self._flow.wait(0.1)
+        return False
+
+    def _release(self):
+        with self._flow:
+            self._in_flight -= 1
+            self._flow.notify()
+
+    def _start(self, function, args, name):
+        thread = threading.Thread(target=function, args=args, name=name)
+        thread.daemon = True
+        self._threads.append(thread)
+        thread.start()
+
+    def source(self, iterable, name='source'):
+        """
+        Starts the thread consuming given iterable.
+        :param iterable: source of items, e.g. decoded frames.
+        :param name: name of the stage in statistics.
+        """
+        output = queue.Queue(self.queue_size)
+        stats = self.stats[name] = StageStats(name)
+        self._queue = output
+        self._window += self.queue_size
+        self._start(self._run_source, (iterable, output, stats), name)
+
+    def _run_source(self, iterable, output, stats):
+        stats.started = time.perf_counter()
+        iterator = iter(iterable)
+        try:
+            index = 0
+            while self._admit():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats.record(time.perf_counter() - start, output.qsize())
+                if not self._put(output, (index, item)):
+                    break
+                index += 1
+        except Exception as error:
+            self._put(output, (-1, _Failure(error)))
+        finally:
+            # e.g. generator releasing the video capture
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            stats.stopped = time.perf_counter()
+            self._put(output, (None, _END))
+
+    def map(self, function, workers=1, name=None):
+        """
+        Starts worker threads applying function to every item of the
+        previous stage. Items are processed out of order, their order is
+        restored when the pipeline is iterated.
+        :param function: function of one item.
+        :param workers: number of threads.
+        :param name: name of the stage in statistics, function name if None.
+        """
+        if self._queue is None:
+            raise ValueError('Pipeline has no source')
+        name = name or function.__name__
+        output = queue.Queue(self.queue_size)
+        stats = self.stats[name] = StageStats(name, workers)
+        state = {'running': workers, 'lock': threading.Lock()}
+        for worker in range(workers):
+            self._start(self._run_map,
+                        (function, self._queue, output, stats, state),
+                        '{}-{}'.format(name, worker))
+        self._queue = output
+        with self._flow:
+            self._window += self.queue_size
+            self._flow.notify()
+
+    def _run_map(self, function, source, output, stats, state):
+        with state['lock']:
+            if stats.started is None:
+                stats.started = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                index, item = source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END:
+                # put the marker back for the other workers of the stage
+                self._put(source, (None, _END))
+                break
+            if isinstance(item, _Failure):
+                self._put(output, (index, item))
+                continue
+            depth = source.qsize()
+            start = time.perf_counter()
+            try:
+                result = function(item)
+            except Exception as error:
+                result = _Failure(error)
+            stats.record(time.perf_counter() - start, depth)
+            if not self._put(output, (index, result)):
+                break
+        with state['lock']:
+            state['running'] -= 1
+            last = not state['running']
+        if last:
+            stats.stopped = time.perf_counter()
+            self._put(output, (None, _END))
+
+    def __iter__(self):
+        if self._queue is None:
+            raise ValueError('Pipeline has no source')
+        # results which came before the results of earlier items
+        pending = {}
+        expected = 0
+        try:
+            while True:
+                index, item = self._queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                pending[index] = item
+                while expected in pending:
+                    item = pending.pop(expected)
+                    self._release()
+                    expected += 1
+                    yield item
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stops all stages and waits for their threads, called automatically
+        when iteration ends.
+        """
+        self._stop.set()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def report(self):
+        """
+        :return: dictionary of statistics of all stages, see
+                 StageStats.as_dict().
+        """
+        return OrderedDict((name, stats.as_dict())
+                           for name, stats in self.stats.items())
+
+
+class Sink(object):
+    """
+    Thread consuming items put into its bounded queue, e.g. frames written
+    to the output video. put() blocks when the queue is full.
+    Example of use:
+        sink = Sink(out_vid.write, queue_size=16, name='encode')
+        sink.put(frame)
+        sink.close()
+    """
+
+    def __init__(self, function, queue_size=8, name='sink'):
+        """
+        :param function: function called for every item.
+        :param queue_size: maximal number of waiting items.
+        :param name: name of the stage in statistics.
+        """
+        self.function = function
+        self.stats = StageStats(name)
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        self.stats.started = time.perf_counter()
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                break
+            if self._error is not None:
+                continue
+            depth = self._queue.qsize()
+            start = time.perf_counter()
+            try:
+                self.function(item)
+            except Exception as error:
+                self._error = error
+            self.stats.record(time.perf_counter() - start, depth)
+        self.stats.stopped = time.perf_counter()
+
+    def put(self, item):
+        """
+        Queues the item, exception raised by the function for earlier item
+        is raised here.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(item)
+
+    def close(self):
+        """
+        Waits until all queued items are consumed.
+        """
+        self._queue.put(_END)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def handover(items, sink, stats=None):
+    """
+    Yields items to the consumer and puts every item into the sink when the
+    consumer asks for the next one - for consumers like kalman_tracking()
+    which finish processing of an item before taking the next one, so the
+    sink gets only completely processed items.
+    :param items: iterable of items.
+    :param sink: Sink object.
+    :param stats: optional StageStats of the consumer, time between giving
+                  an item and request for the next one is recorded.
+    :return: the same items.
+    """
+    previous = _END
+    if stats is not None:
+        stats.started = time.perf_counter()
+    for item in items:
+        if previous is not _END:
+            if stats is not None:
+                stats.record(time.perf_counter() - given, 0)
+            sink.put(previous)
+        previous = item
+        given = time.perf_counter()
+        yield item
+    if previous is not _END:
+        if stats is not None:
+            stats.record(time.perf_counter() - given, 0)
+        sink.put(previous)
+    if stats is not None:
+        stats.stopped = time.perf_counter()
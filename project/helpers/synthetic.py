@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Synthetic videos of moving blobs with known trajectories, for benchmarks
+and for checking the detection and tracking results.
+Example of use:
+    truth = generate_video('blobs.avi', width=1280, height=720, frames=100,
+                           blobs=1000)
+    save_ground_truth('blobs.csv', truth)
+"""
+
+import cv2
+import numpy as np
+
+
+def generate_video(path, width=640, height=480, frames=100, blobs=100,
+                   radius=5, speed=2., noise=5., occlusion=0., fps=20,
+                   seed=0):
+    """
+    Writes video of white blobs moving with constant velocities on a dark,
+    noisy background. Blobs bounce off the frame borders. Occluders are
+    static vertical stripes of the background color drawn over the blobs.
+    :param path: path of the output video (MJPG codec).
+    :param width: width of the frames [px].
+    :param height: height of the frames [px].
+    :param frames: number of frames.
+    :param blobs: number of blobs.
+    :param radius: radius of the blobs [px].
+    :param speed: speed of the blobs [px / frame], directions are random.
+    :param noise: standard deviation of the Gaussian noise added to frames.
+    :param occlusion: part of the frame width covered by occluders (0 - 1).
+    :param fps: frame rate of the video.
+    :param seed: seed of the random generator.
+    :return: ground truth - dictionary of arrays 'frame', 'ID', 'x', 'y'
+             and 'visible' (False for blobs hidden by occluders), one row
+             per blob and frame.
+    """
+    rng = np.random.RandomState(seed)
+    low = np.array([radius, radius], dtype=float)
+    high = np.array([width - 1 - radius, height - 1 - radius], dtype=float)
+    positions = rng.uniform(low, high, (blobs, 2))
+    angles = rng.uniform(0, 2 * np.pi, blobs)
+    velocities = speed * np.column_stack((np.cos(angles), np.sin(angles)))
+
+    # occluders - vertical stripes, 4 blobs diameters wide
+    occluded = np.zeros(width, dtype=bool)
+    stripe = 8 * radius
+    for _ in range(int(round(occlusion * width / stripe))):
+        left = rng.randint(0, max(width - stripe, 1))
+        occluded[left:left + stripe] = True
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps,
+                             (width, height))
+    if not writer.isOpened():
+        raise IOError('Unable to write: ' + path)
+    truth = {'frame': [], 'ID': [], 'x': [], 'y': [], 'visible': []}
+    ids = np.arange(blobs)
+    try:
+        for frame_number in range(frames):
+            frame = np.zeros((height, width, 3), dtype=np.uint8)
+            for x, y in positions:
+                cv2.circle(frame, (int(round(x)), int(round(y))), radius,
+                           (255, 255, 255), -1, cv2.LINE_AA)
+            if noise:
+                frame = np.clip(frame + rng.normal(0, noise, frame.shape),
+                                0, 255).astype(np.uint8)
+            frame[:, occluded] = 0
+            writer.write(frame)
+
+            columns = np.clip(np.round(positions[:, 0]).astype(int), 0,
+                              width - 1)
+            truth['frame'].append(np.full(blobs, frame_number))
+            truth['ID'].append(ids)
+            truth['x'].append(positions[:, 0].copy())
+            truth['y'].append(positions[:, 1].copy())
+            truth['visible'].append(~occluded[columns])
+
+            positions += velocities
+            # bounce off the borders
+            for axis in range(2):
+                outside = (positions[:, axis] < low[axis]) | \
+                    (positions[:, axis] > high[axis])
+                velocities[outside, axis] *= -1
+                positions[:, axis] = np.clip(positions[:, axis], low[axis],
+                                             high[axis])
+    finally:
+        writer.release()
+    return dict((key, np.concatenate(values) if values else np.zeros(0))
+                for key, values in truth.items())
+
+
+def save_ground_truth(path, truth):
+    """
+    Writes ground truth to the CSV file (frame,ID,x,y,visible).
+    :param path: path of the CSV file.
+    :param truth: ground truth returned by generate_video().
+    """
+    with open(path, 'w') as truth_file:
+        truth_file.write('frame,ID,x,y,visible\n')
+        truth_file.write(''.join(map(
+            '{},{},{!r},{!r},{:d}\n'.format, truth['frame'].tolist(),
+            truth['ID'].tolist(), truth['x'].tolist(), truth['y'].tolist(),
+            truth['visible'].tolist())))
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Binary thresholding of the preprocessed frames with a fixed value or with
+thresholds found by the Otsu method - for the whole frame, or for every
+tile of the frame with thresholds interpolated between tile centers, so
+the threshold follows uneven lighting. Thresholds can be smoothed over the
+frames, so they follow slow lighting drift without flickering.
+Otsu thresholds are computed from histograms in one vectorized pass
+(cumulative sums of the histograms), for all tiles at once.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+# 'fixed' - 'threshold' parameter, 'otsu' - Otsu threshold of the frame,
+# 'adaptive' - Otsu thresholds of threshold_tiles x threshold_tiles tiles
+THRESHOLD_MODES = ('fixed', 'otsu', 'adaptive')
+
+
+def otsu_thresholds(histograms):
+    """
+    Otsu thresholds - maximize between class variance of the pixels lower
+    or equal to the threshold and of the pixels greater than it.
+    Example of use:
+        histogram = cv2.calcHist([image], [0], None, [256], [0, 256])
+        value = otsu_thresholds(histogram.ravel())
+    :param histograms: histogram of 8 bit image (256 counts), or array of
+                       histograms (..., 256).
+    :return: threshold (array of thresholds for array of histograms), -1
+             for histograms without two classes (single level images).
+    """
+    histograms = np.asarray(histograms, dtype=np.float64)
+    levels = np.arange(histograms.shape[-1])
+    # pixels count and sum of levels of the lower class for every threshold
+    count = np.cumsum(histograms, axis=-1)
+    level_sum = np.cumsum(histograms * levels, axis=-1)
+    total = count[..., -1:]
+    # between class variance multiplied by total^3 (constant factor)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = (level_sum[..., -1:] * count - total * level_sum) ** 2 / \
+            (count * (total - count))
+    variance[~np.isfinite(variance)] = -1
+    thresholds = np.argmax(variance, axis=-1)
+    return np.where(np.max(variance, axis=-1) > 0, thresholds, -1)
+
+
+def tile_bounds(length, tiles):
+    """
+    :return: tiles + 1 boundaries of the tiles along axis of given length.
+    """
+    return np.arange(tiles + 1) * length // tiles
+
+
+def tile_histograms(frame, tiles):
+    """
+    :param frame: 8 bit grayscale frame.
+    :param tiles: number of tiles in rows and in columns.
+    :return: tiles x tiles x 256 array of histograms of the tiles.
+    """
+    rows = tile_bounds(frame.shape[0], tiles)
+    columns = tile_bounds(frame.shape[1], tiles)
+    histograms = np.empty((tiles, tiles, 256))
+    for row in range(tiles):
+        for column in range(tiles):
+            tile = frame[rows[row]:rows[row + 1],
+                         columns[column]:columns[column + 1]]
+            histograms[row, column] = cv2.calcHist(
+                [tile], [0], None, [256], [0, 256]).ravel()
+    return histograms
+
+
+class Thresholder(object):
+    """
+    Binary thresholding of the frames, keeps the thresholds of the previous
+    frame for the temporal smoothing - with the smoothing frames have to
+    come in their order (see pipeline.order_dependent()).
+    Example of use:
+        thresholder = Thresholder('adaptive', smoothing=0.9, tiles=4)
+        for frame in frames:
+            binary = thresholder.apply(frame)
+    """
+
+    def __init__(self, mode='fixed', value=114, smoothing=0., tiles=4):
+        """
+        :param mode: one of THRESHOLD_MODES.
+        :param value: threshold of the 'fixed' mode.
+        :param smoothing: weight of the previous thresholds in the
+                          exponential moving average (0 - no smoothing,
+                          close to 1 - slow changes).
+        :param tiles: number of tiles in rows and in columns of the
+                      'adaptive' mode.
+        """
+        if mode not in THRESHOLD_MODES:
+            raise ValueError('Unknown threshold mode: {}'.format(mode))
+        self.mode = mode
+        self.value = value
+        self.smoothing = smoothing
+        self.tiles = tiles
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def thresholds(self, frame):
+        """
+        :param frame: 8 bit grayscale frame.
+        :return: threshold of the frame or tiles x tiles array of the tiles
+                 thresholds ('adaptive' mode), smoothed over the frames.
+        """
+        if self.mode == 'fixed':
+            return self.value
+        if self.mode == 'otsu':
+            histogram = cv2.calcHist([frame], [0], None, [256], [0, 256])
+            thresholds = float(otsu_thresholds(histogram.ravel()))
+            if thresholds < 0:
+                # single level frame - keep the previous threshold
+                thresholds = self.value if self._previous is None \
+                    else self._previous
+        else:
+            histograms = tile_histograms(frame, self.tiles)
+            thresholds = otsu_thresholds(histograms).astype(np.float64)
+            # tiles without contrast get the threshold of the whole frame
+            flat = thresholds < 0
+            if flat.any():
+                frame_threshold = otsu_thresholds(histograms.sum(axis=(0, 1)))
+                thresholds[flat] = frame_threshold if frame_threshold >= 0 \
+                    else self.value
+        if not self.smoothing:
+            return thresholds
+        with self._lock:
+            previous = self._previous
+            if previous is not None and \
+                    np.shape(previous) == np.shape(thresholds):
+                thresholds = self.smoothing * previous + \
+                    (1 - self.smoothing) * thresholds
+            self._previous = thresholds
+        return thresholds
+
+    def apply(self, frame):
+        """
+        :param frame: 8 bit grayscale frame.
+        :return: binary frame - 255 where frame is greater than the
+                 threshold, 0 elsewhere.
+        """
+        thresholds = self.thresholds(frame)
+        if np.ndim(thresholds) == 0:
+            ret, frame = cv2.threshold(frame, thresholds, 255,
+                                       cv2.THRESH_BINARY)
+            return frame
+        # thresholds of the tile centers interpolated to every pixel, frame
+        # is integer, so it's greater than t if it's greater than floor(t)
+        height, width = frame.shape
+        threshold_map = cv2.resize(thresholds.astype(np.float32),
+                                   (width, height),
+                                   interpolation=cv2.INTER_LINEAR)
+        return cv2.compare(frame, threshold_map.astype(np.uint8),
+                           cv2.CMP_GT)
+
+
+def thresholder_from_parameters(parameters):
+    """
+    :param parameters: dictionary of processing parameters.
+    :return: Thresholder object.
+    """
+    return Thresholder(parameters.get('threshold_mode', 'fixed'),
+                       parameters['threshold'],
+                       parameters.get('threshold_smoothing', 0.),
+                       parameters.get('threshold_tiles', 4))
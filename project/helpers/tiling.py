@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tiled processing of large frames. The binary frame (after threshold) is
+split into tiles, the morphological operations, LoG and the detection run
+on every tile in a pool of threads (OpenCV releases the GIL), and the
+points are merged. Every tile is extended by an overlap band wider than
+the reach of the kernels and the blobs, and keeps only points found in its
+own core, so points in the overlap bands are not duplicated and are the
+same as found in the whole frame.
+Thresholding, background subtraction and CLAHE depend on the whole frame,
+so they run on the whole frame before the tiling.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from helpers.laplacian import select_method
+
+# reach [px] added for the detected blobs if blob_size is not given -
+# diameter of the largest blob of functions.blob_detect() (default maxArea
+# of cv2.SimpleBlobDetector is 5000 px)
+TILE_BLOB_MARGIN = 80
+
+
+def tile_overlap(parameters):
+    """
+    Width of the overlap band - sum of the reaches of all selected
+    morphological operations, LoG and detection.
+    :param parameters: dictionary of processing parameters (scaled to the
+                       pyramid level).
+    :return: overlap [px], 'tile_overlap' parameter if given.
+    """
+    if parameters.get('tile_overlap') is not None:
+        return parameters['tile_overlap']
+    reach = 0
+    # kernels are anchored in the center, opening and closing are two
+    # passes
+    for name, passes in (('erode', 1), ('dilate', 1), ('open', 2),
+                         ('close', 2)):
+        if parameters[name]:
+            # default 3 x 3 kernel is used for kernel size 0
+            reach += passes * (max(parameters[name + '_size'], 3) // 2)
+    if parameters['LoG']:
+        reach += parameters['LoG_size']
+    if parameters.get('detector', 'blobs') == 'peaks':
+        reach += parameters.get('peaks_size', 27) // 2
+    return reach + (parameters.get('blob_size') or TILE_BLOB_MARGIN)
+
+
+def tile_grid(shape, tile_size, overlap):
+    """
+    :param shape: shape of the frame.
+    :param tile_size: width and height of the tile cores [px].
+    :param overlap: width of the overlap band [px].
+    :return: list of (core, padded) tiles, both (top, bottom, left, right).
+    """
+    height, width = shape[:2]
+    tiles = []
+    for top in range(0, height, tile_size):
+        bottom = min(top + tile_size, height)
+        for left in range(0, width, tile_size):
+            right = min(left + tile_size, width)
+            tiles.append(((top, bottom, left, right),
+                          (max(top - overlap, 0),
+                           min(bottom + overlap, height),
+                           max(left - overlap, 0),
+                           min(right + overlap, width))))
+    return tiles
+
+
+class TileProcessor(object):
+    """
+    Runs the morphological operations and the detection on the tiles of
+    the binary frames in a pool of threads.
+    Example of use:
+        tiler = TileProcessor(1024, workers=8, detector_factory=blob_detect)
+        points = tiler.detect(binary, parameters, morphological, find_points)
+    """
+
+    def __init__(self, tile_size, workers=None, detector_factory=None):
+        """
+        :param tile_size: width and height of the tile cores [px].
+        :param workers: number of threads, number of CPU cores if None.
+        :param detector_factory: function returning the blob detector,
+                                 every thread gets its own detector.
+        """
+        self.tile_size = tile_size
+        self.detector_factory = detector_factory
+        self._executor = ThreadPoolExecutor(workers)
+        self._local = threading.local()
+
+    def _blob_detector(self):
+        if self.detector_factory is None:
+            return None
+        if not hasattr(self._local, 'blob_detector'):
+            self._local.blob_detector = self.detector_factory()
+        return self._local.blob_detector
+
+    def _detect_tile(self, frame, tile, parameters, morphological,
+                     find_points):
+        (top, bottom, left, right), (pad_top, pad_bottom, pad_left,
+                                     pad_right) = tile
+        processed = morphological(frame[pad_top:pad_bottom,
+                                        pad_left:pad_right], parameters)
+        points = np.asarray(find_points(processed, parameters,
+                                        self._blob_detector()),
+                            dtype=np.float64).reshape(-1, 2)
+        points += (pad_left, pad_top)
+        # only points of the tile core, the rest belongs to other tiles
+        core = (points[:, 0] >= left) & (points[:, 0] < right) & \
+            (points[:, 1] >= top) & (points[:, 1] < bottom)
+        return points[core]
+
+    def detect(self, frame, parameters, morphological, find_points):
+        """
+        :param frame: binary frame.
+        :param parameters: dictionary of processing parameters.
+        :param morphological: function(frame, parameters) - morphological
+                              operations of the tile.
+        :param find_points: function(frame, parameters, blob_detector) -
+                            detection on the processed tile.
+        :return: N x 2 array of (x, y) points in the frame, ordered by rows.
+        """
+        if parameters['LoG'] and \
+                parameters.get('LoG_method', 'auto') == 'auto':
+            # the same method as for the whole frame, results of the
+            # methods differ in float rounding
+            parameters = dict(parameters)
+            parameters['LoG_method'] = select_method(
+                parameters['LoG_size'], int(parameters['LoG_size'] * 0.5),
+                frame.shape)
+        tiles = tile_grid(frame.shape, self.tile_size,
+                          tile_overlap(parameters))
+        results = list(self._executor.map(
+            lambda tile: self._detect_tile(frame, tile, parameters,
+                                           morphological, find_points),
+            tiles))
+        points = np.concatenate(results) if results else np.zeros((0, 2))
+        return points[np.lexsort((points[:, 0], points[:, 1]))]
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def tiler_from_parameters(parameters, detector_factory=None):
+    """
+    :param parameters: dictionary of processing parameters.
+    :param detector_factory: function returning the blob detector.
+    :return: TileProcessor object, None if tiling is switched off.
+    """
+    if not parameters.get('tile_size'):
+        return None
+    return TileProcessor(parameters['tile_size'],
+                         parameters.get('tile_workers') or None,
+                         detector_factory)
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+
+import numpy as np
+
+from helpers.association import gated_assignment
+from helpers.instrumentation import METRICS
+from helpers.kalman import KalmanBank
+from helpers.trajectories import TrajectoryStore
+from helpers.tracks import TrackPool
+
+log = logging.getLogger(__name__)
+
+# initial number of slots of the Kalman filters bank, it grows when needed
+INITIAL_CAPACITY = 256
+
+# default parameters of the Kalman filter and of the tracks management
+DEFAULT_PARAMETERS = {
+    # 'constant_velocity' or 'constant_acceleration'
+    'motion_model': 'constant_acceleration',
+    'dt': 1.,
+    'measurement_variance': 1,
+    'state_covariance': [100, 100, 10, 10, 1, 1],
+    'model_covariance': [100, 100, 10, 10, 1, 1],
+    # maximal distance [px] between prior and assigned measurement
+    'max_distance': 20,
+    # frames without measurement after which track is removed
+    'max_strikes': 4,
+    # maximal number of live tracks
+    'max_num_objects': 75000,
+}
+
+
+class BlobTracker(object):
+    """
+    Online multiple blobs tracker - Kalman filters of the live tracks and
+    Munkres assignment between their priors and the measurements, updated
+    with measurements of one frame at a time. Work per frame depends only on
+    the number of live tracks and measurements. History of the estimates is
+    kept only if the store is given.
+    Example of use:
+        tracker = BlobTracker(parameters)
+        for points in detections:
+            ids, positions = tracker.update(points)
+    """
+
+    def __init__(self, parameters=None, store=None):
+        """
+        :param parameters: dictionary of filter parameters,
+                           DEFAULT_PARAMETERS are used if not given.
+        :param store: TrajectoryStore, estimates of every frame are appended
+                      to it, None - no history is kept.
+        """
+        if parameters is None:
+            parameters = DEFAULT_PARAMETERS
+        self.parameters = parameters
+        self.store = store
+        # Kalman filters of all objects, bank grows with number of live
+        # tracks up to max_num_objects, slots of removed tracks are reused
+        # state covariance matrix - no initial covariances, variances only
+        # [10^2 px, 10^2 px, ..], model covariance matrix Q must be the same
+        # shape as P, measurements variance R between x-x and y-y, no
+        # initial corelation between x and y positions
+        self.bank = KalmanBank(
+            INITIAL_CAPACITY,
+            parameters.get('motion_model', 'constant_acceleration'),
+            parameters['dt'], parameters['state_covariance'],
+            parameters['model_covariance'],
+            parameters['measurement_variance'])
+        self.pool = TrackPool(self.bank, parameters.get('max_num_objects'))
+        # number of the next frame
+        self.frame = 0
+        # ids of the tracks removed by the last update
+        self.removed = np.zeros(0, dtype=np.int64)
+
+    @property
+    def est_number(self):
+        """
+        Number of estimated objects - tracks created so far.
+        """
+        return self.pool.next_id
+
+    def active_tracks(self):
+        """
+        :return: ids - ids of the live tracks, positions - N x 2 array of
+                 their current (x, y) estimates.
+        """
+        active = self.pool.active
+        return self.pool.ids[active], self.bank.x[active, 0:2]
+
+    def update(self, frame_measurements, steps=1):
+        """
+        Runs prediction, assignment and update of one frame, creates tracks
+        for the measurements without assignment and removes tracks without
+        measurements for max_strikes frames.
+        :param frame_measurements: (x, y) points of the frame, list of
+                                   tuples or N x 2 array.
+        :param steps: number of frames since the previous update - states
+                      are predicted over the frames dropped in between,
+                      frame number advances by steps and tracks without
+                      measurement get a strike for every elapsed frame.
+                      Tracks with a measurement get no strikes for the
+                      dropped frames.
+        :return: ids - ids of the tracks estimated in this frame (with
+                 assigned measurement), positions - N x 2 array of their
+                 posterior (x, y) positions.
+        """
+        frame_start = time.perf_counter()
+        pool = self.pool
+        bank = self.bank
+        first = self.frame == 0
+        # number of this frame, counted from the first update
+        frame = self.frame + steps - 1
+        # don't take zeros, assuming it's image
+        measurements = np.asarray(frame_measurements,
+                                  dtype=float).reshape(-1, 2)
+        measurements = measurements[(measurements[:, 0] > 0) &
+                                    (measurements[:, 1] > 0)]
+        if first:
+            # state initialization - initial state is equal to measurements
+            spawned = pool.spawn(measurements)
+            METRICS.increment('tracking.spawned', len(spawned))
+        debug = log.isEnabledFor(logging.DEBUG)
+        ##################################################################
+        # prepare for update phase -> get (prior - measurement) assignment
+        posterior_list = pool.active
+        METRICS.observe('tracking.measurements', len(measurements))
+        METRICS.observe('tracking.tracks', len(posterior_list))
+        METRICS.observe('tracking.assignment_size',
+                        len(posterior_list) * len(measurements))
+        # count prior of all existing objects at once
+        with METRICS.timer('tracking.predict'):
+            for step in range(steps):
+                bank.predict(posterior_list)
+        # assignment between priors and measurements, only pairs closer
+        # than the gate are considered
+        with METRICS.timer('tracking.assignment'):
+            row_index, column_index, unit_cost = gated_assignment(
+                bank.x[posterior_list, 0:2], measurements,
+                self.parameters['max_distance'])
+        # slots of objects with assigned measurements
+        assigned = posterior_list[row_index]
+
+        ##################################################################
+        # update phase - posterior of all objects that got measurements
+        with METRICS.timer('tracking.update'):
+            bank.update(assigned, measurements[column_index])
+        ids = pool.ids[assigned]
+        positions = bank.x[assigned, 0:2]
+        # append new positions
+        if self.store is not None:
+            self.store.append(frame, ids, positions[:, 0], positions[:, 1],
+                              bank.x[assigned], bank.P[assigned])
+
+        if debug:
+            log.debug('frame %d posterior\n%s', frame,
+                      bank.x[pool.active, 0:2])
+        ##################################################################
+        # find new objects - measurements without assignment, and create
+        # new states for them
+        # TODO: make it possible to choose where to add new estimates
+        new_detection = np.ones(len(measurements), dtype=bool)
+        new_detection[column_index] = False
+        spawned = pool.spawn(measurements[new_detection])
+        METRICS.increment('tracking.spawned', len(spawned))
+        ##################################################################
+        # find states without measurements - objects to reject
+        reject = np.ones(len(posterior_list), dtype=bool)
+        reject[row_index] = False
+        pool.strike(posterior_list[reject], steps)
+        if debug:
+            for track in posterior_list[reject]:
+                log.debug('track %d strikes %d', pool.ids[track],
+                          pool.strikes[track])
+        # remove estimate if it's strike max_strike_count times
+        # (has no assigned detection for max_strike_count frames)
+        self.removed = pool.remove_striked(self.parameters['max_strikes'])
+        METRICS.increment('tracking.removed', len(self.removed))
+        if debug:
+            for track in self.removed:
+                log.debug('track %d removed', track)
+        self.frame = frame + 1
+        METRICS.increment('tracking.frames')
+        METRICS.record_time('tracking.frame',
+                            time.perf_counter() - frame_start)
+        return ids, positions
+
+
+def kalman_tracking(max_points, stop_frame, parameters=None, progress=None,
+                    store=None):
+    """
+    Kalman Filter function. Takes measurements from video analyse function
+    and estimates positions of detected objects, see BlobTracker.
+    Measurements are consumed frame by frame, so they can be produced by
+    the streaming pipeline while filter is running.
+    :param max_points: measurements - iterable of (x, y) lists per frame.
+    :param stop_frame: number of frames to analise
+    :param parameters: dictionary of filter parameters, DEFAULT_PARAMETERS
+                       are used if not given.
+    :param progress: optional callable, receives progress in percents.
+    :param store: TrajectoryStore for the estimates, new store (positions
+                  only) is created if not given.
+    :return: store - TrajectoryStore with posterior positions of objects in
+             every frame, est_number - number of estimated objects
+    """
+    # x and y posterior positions (estimates) for drawnings
+    if store is None:
+        store = TrajectoryStore()
+    tracker = BlobTracker(parameters, store)
+
+    log.info('Processing frames and generating position estimates...')
+    # kalman filter loop
+    for frame_measurements in max_points:
+        if progress is not None:
+            progress(100 * (tracker.frame / stop_frame))
+        tracker.update(frame_measurements)
+    return store, tracker.est_number
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class TrackPool(object):
+    """
+    Pool of live tracks on top of the KalmanBank. Every track occupies one
+    slot (row) of the bank, slots of removed tracks are put on the free list
+    and reused by new tracks, so bank grows only when number of live tracks
+    grows. Tracks are identified by stable ids (numbers in order of
+    creation), independent of the slots. Slots of live tracks are kept in
+    the dense `active` array, ordered by id, so per-frame cost depends on
+    the number of live tracks only.
+    Example of use:
+        pool = TrackPool(KalmanBank(16))
+        slots = pool.spawn([[10, 20], [30, 40]])
+        pool.bank.predict(pool.active)
+        ids = pool.ids[pool.active]
+        pool.strike(pool.active[:1])
+        removed = pool.remove_striked(4)
+    """
+
+    def __init__(self, bank, max_tracks=None):
+        """
+        :param bank: KalmanBank for states of the tracks, its capacity is
+                     the initial number of slots.
+        :param max_tracks: maximal number of live tracks, new tracks are
+                           not created above it. No limit if None.
+        """
+        self.bank = bank
+        self.max_tracks = max_tracks
+        self.ids = np.full(bank.capacity, -1, dtype=np.int64)
+        self.strikes = np.zeros(bank.capacity, dtype=np.int64)
+        self.active = np.zeros(0, dtype=np.intp)
+        # free slots, taken from the end
+        self._free = list(range(bank.capacity - 1, -1, -1))
+        # id of the next created track = number of created tracks
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.active)
+
+    def _grow(self, capacity):
+        old = self.bank.capacity
+        self.bank.resize(capacity)
+        ids = np.full(capacity, -1, dtype=np.int64)
+        ids[:old] = self.ids
+        strikes = np.zeros(capacity, dtype=np.int64)
+        strikes[:old] = self.strikes
+        self.ids, self.strikes = ids, strikes
+        self._free[:0] = range(capacity - 1, old - 1, -1)
+
+    def spawn(self, positions):
+        """
+        Creates new tracks starting at given positions. Bank capacity is
+        doubled when there is no free slot.
+        :param positions: (x, y) positions of new tracks.
+        :return: slots of created tracks.
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        count = len(positions)
+        if self.max_tracks is not None:
+            count = max(0, min(count, self.max_tracks - len(self.active)))
+        if not count:
+            return np.zeros(0, dtype=np.intp)
+        if count > len(self._free):
+            capacity = max(self.bank.capacity, 1)
+            while capacity - len(self.active) < count:
+                capacity *= 2
+            self._grow(capacity)
+        slots = np.array(self._free[-count:][::-1], dtype=np.intp)
+        del self._free[-count:]
+        self.bank.initialize(slots, positions[:count])
+        self.ids[slots] = np.arange(self.next_id, self.next_id + count)
+        self.strikes[slots] = 0
+        self.next_id += count
+        self.active = np.concatenate((self.active, slots))
+        return slots
+
+    def strike(self, slots, frames=1):
+        """
+        Counts frames without measurement for given tracks.
+        :param slots: slots of tracks without assigned measurement.
+        :param frames: number of frames without measurement.
+        """
+        self.strikes[slots] += frames
+
+    def remove_striked(self, max_strikes):
+        """
+        Removes tracks with at least max_strikes strikes and frees their
+        slots.
+        :param max_strikes: number of strikes of removed tracks.
+        :return: ids of removed tracks.
+        """
+        removed = self.strikes[self.active] >= max_strikes
+        if not removed.any():
+            return np.zeros(0, dtype=np.int64)
+        slots = self.active[removed]
+        ids = self.ids[slots]
+        self.active = self.active[~removed]
+        self.ids[slots] = -1
+        self.bank.x[slots] = np.nan
+        self._free.extend(slots[::-1].tolist())
+        return ids
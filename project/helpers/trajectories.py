@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class TrajectoryStore(object):
+    """
+    Array backed store of the estimated trajectories. Every row holds track
+    id, frame number and x, y position (optionally also full state vector
+    and covariance matrix). Rows are appended frame by frame, so rows of one
+    frame are contiguous and frame lookup is O(1); track lookup uses index
+    sorted by track id, built when needed.
+    Example of use:
+        store = TrajectoryStore()
+        store.append(0, [0, 1], [10., 30.], [20., 40.])
+        rows = store.by_frame(0)
+        track, x, y = store.track[rows], store.x[rows], store.y[rows]
+    """
+
+    def __init__(self, keep_states=False, keep_covariances=False,
+                 capacity=1024):
+        """
+        :param keep_states: store full state vectors.
+        :param keep_covariances: store state covariance matrices.
+        :param capacity: initial number of rows, arrays grow when needed.
+        """
+        self.keep_states = keep_states
+        self.keep_covariances = keep_covariances
+        self._size = 0
+        self._columns = {
+            'frame': np.zeros(capacity, dtype=np.int64),
+            'track': np.zeros(capacity, dtype=np.int64),
+            'x': np.zeros(capacity),
+            'y': np.zeros(capacity),
+        }
+        # frame -> (first row, last row + 1)
+        self._frames = {}
+        self._track_order = None
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, size):
+        capacity = len(self._columns['frame'])
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.zeros((capacity,) + column.shape[1:], column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def append(self, frame, tracks, x, y, states=None, covariances=None):
+        """
+        Appends estimates of one frame. Frames have to be appended in
+        increasing order.
+        :param frame: frame number.
+        :param tracks: track ids.
+        :param x: x positions of the tracks.
+        :param y: y positions of the tracks.
+        :param states: state vectors of the tracks (keep_states only).
+        :param covariances: covariance matrices (keep_covariances only).
+        """
+        tracks = np.asarray(tracks).reshape(-1)
+        count = len(tracks)
+        if not count:
+            return
+        start, stop = self._size, self._size + count
+        first, last = self._frames.get(frame, (start, start))
+        if last != start:
+            raise ValueError('Frames have to be appended in order')
+        if self.keep_states and 'state' not in self._columns:
+            self._columns['state'] = np.zeros(
+                (len(self._columns['frame']), np.shape(states)[1]))
+        if self.keep_covariances and 'covariance' not in self._columns:
+            self._columns['covariance'] = np.zeros(
+                (len(self._columns['frame']),) + np.shape(covariances)[1:])
+        self._reserve(stop)
+
+        columns = self._columns
+        columns['frame'][start:stop] = frame
+        columns['track'][start:stop] = tracks
+        columns['x'][start:stop] = x
+        columns['y'][start:stop] = y
+        if self.keep_states:
+            columns['state'][start:stop] = states
+        if self.keep_covariances:
+            columns['covariance'][start:stop] = covariances
+        self._frames[frame] = (first, stop)
+        self._size = stop
+        self._track_order = None
+
+    @property
+    def frame(self):
+        return self._columns['frame'][:self._size]
+
+    @property
+    def track(self):
+        return self._columns['track'][:self._size]
+
+    @property
+    def x(self):
+        return self._columns['x'][:self._size]
+
+    @property
+    def y(self):
+        return self._columns['y'][:self._size]
+
+    @property
+    def state(self):
+        return self._columns['state'][:self._size]
+
+    @property
+    def covariance(self):
+        return self._columns['covariance'][:self._size]
+
+    def frames(self):
+        """
+        :return: sorted numbers of frames with estimates.
+        """
+        return sorted(self._frames)
+
+    def tracks(self):
+        """
+        :return: sorted ids of tracks with estimates.
+        """
+        return np.unique(self.track)
+
+    def by_frame(self, frame):
+        """
+        :param frame: frame number.
+        :return: slice of rows with estimates of given frame.
+        """
+        first, last = self._frames.get(frame, (0, 0))
+        return slice(first, last)
+
+    def by_track(self, track):
+        """
+        :param track: track id.
+        :return: indexes of rows of given track, ordered by frame.
+        """
+        if self._track_order is None:
+            self._track_order = np.argsort(self.track, kind='stable')
+            self._sorted_tracks = self.track[self._track_order]
+        first, last = np.searchsorted(self._sorted_tracks,
+                                      [track, track + 1])
+        return self._track_order[first:last]
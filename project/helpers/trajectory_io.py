@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Writers and reader of the estimated trajectories. Rows are buffered and
+written in chunks, independently of the video rendering.
+
+Binary format is a directory with one raw little-endian file per column
+(frame, ID, x, y and optionally vx, vy and covariance) and header.json
+describing dtypes and shapes of the columns, so columns can be memory
+mapped by read_trajectories() without parsing.
+"""
+
+import json
+import os
+
+import numpy as np
+
+# version of the binary format, stored in the header
+FORMAT_VERSION = 1
+HEADER_FILE = 'header.json'
+
+
+class CsvTrajectoryWriter(object):
+    """
+    CSV output (frame,ID,x,y) compatible with the previous versions - the
+    same text is produced, but formatted for chunks of rows at once.
+    Example of use:
+        writer = CsvTrajectoryWriter('results.csv')
+        writer.write(store, store.by_frame(0))
+        writer.close()
+    """
+
+    def __init__(self, path, chunk_size=65536):
+        """
+        :param path: path of the CSV file.
+        :param chunk_size: number of buffered rows.
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self._file = open(path, 'w')
+        self._file.write('frame,ID,x,y\n')
+        self._chunks = []
+        self._buffered = 0
+
+    def write(self, store, rows):
+        """
+        :param store: TrajectoryStore.
+        :param rows: slice or indexes of written rows of the store.
+        """
+        frame = store.frame[rows]
+        if not len(frame):
+            return
+        self._chunks.append((frame, store.track[rows], store.x[rows],
+                             store.y[rows]))
+        self._buffered += len(frame)
+        if self._buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._chunks:
+            return
+        columns = [np.concatenate(column).tolist()
+                   for column in zip(*self._chunks)]
+        self._file.write(''.join(map('{},{},{!r},{!r}\n'.format, *columns)))
+        self._chunks = []
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class BinaryTrajectoryWriter(object):
+    """
+    Binary columnar output, see module description.
+    Example of use:
+        writer = BinaryTrajectoryWriter('results.trj', velocities=True)
+        writer.write(store, store.by_frame(0))
+        writer.close()
+        columns = read_trajectories('results.trj')
+    """
+
+    def __init__(self, path, velocities=False, covariances=False,
+                 chunk_size=65536):
+        """
+        :param path: path of the output directory, created if needed.
+        :param velocities: write vx and vy columns, store has to keep states.
+        :param covariances: write covariance matrices column, store has to
+                            keep covariances.
+        :param chunk_size: number of buffered rows.
+        """
+        self.path = path
+        self.velocities = velocities
+        self.covariances = covariances
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self._dtypes = {'frame': np.dtype('<i8'), 'ID': np.dtype('<i8'),
+                        'x': np.dtype('<f8'), 'y': np.dtype('<f8')}
+        if velocities:
+            self._dtypes['vx'] = self._dtypes['vy'] = np.dtype('<f8')
+        if covariances:
+            self._dtypes['covariance'] = np.dtype('<f8')
+        self._shapes = dict((name, ()) for name in self._dtypes)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._files = dict((name, open(os.path.join(path, name + '.bin'),
+                                       'wb'))
+                           for name in self._dtypes)
+        self._chunks = dict((name, []) for name in self._dtypes)
+        self._buffered = 0
+        self._write_header(complete=False)
+
+    def write(self, store, rows):
+        """
+        :param store: TrajectoryStore.
+        :param rows: slice or indexes of written rows of the store.
+        """
+        columns = {'frame': store.frame[rows], 'ID': store.track[rows],
+                   'x': store.x[rows], 'y': store.y[rows]}
+        if not len(columns['frame']):
+            return
+        if self.velocities:
+            columns['vx'] = store.state[rows][:, 2]
+            columns['vy'] = store.state[rows][:, 3]
+        if self.covariances:
+            columns['covariance'] = store.covariance[rows]
+            self._shapes['covariance'] = columns['covariance'].shape[1:]
+        for name, column in columns.items():
+            self._chunks[name].append(column)
+        self._buffered += len(columns['frame'])
+        if self._buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            return
+        for name, chunks in self._chunks.items():
+            column = np.concatenate(chunks).astype(self._dtypes[name],
+                                                   copy=False)
+            self._files[name].write(np.ascontiguousarray(column).tobytes())
+            self._chunks[name] = []
+        self.rows += self._buffered
+        self._buffered = 0
+
+    def _write_header(self, complete):
+        header = {
+            'version': FORMAT_VERSION,
+            'rows': self.rows,
+            'complete': complete,
+            'columns': dict((name, {'dtype': dtype.str,
+                                    'shape': list(self._shapes[name])})
+                            for name, dtype in self._dtypes.items()),
+        }
+        with open(os.path.join(self.path, HEADER_FILE), 'w') as header_file:
+            json.dump(header, header_file, indent=4, sort_keys=True)
+
+    def close(self):
+        self.flush()
+        for column_file in self._files.values():
+            column_file.close()
+        self._write_header(complete=True)
+
+
+def read_trajectories(path, mmap_mode='r'):
+    """
+    Reads trajectories written by BinaryTrajectoryWriter.
+    Example of use:
+        columns = read_trajectories('results.trj')
+        first = columns['frame'] == 0
+        x, y = columns['x'][first], columns['y'][first]
+    :param path: path of the directory.
+    :param mmap_mode: mode of np.memmap ('r', 'r+', 'c'), columns are read
+                      to memory if None.
+    :return: dictionary of column arrays - 'frame', 'ID', 'x', 'y' and
+             optional 'vx', 'vy', 'covariance'.
+    """
+    with open(os.path.join(path, HEADER_FILE)) as header_file:
+        header = json.load(header_file)
+    if header['version'] > FORMAT_VERSION:
+        raise ValueError('Unsupported trajectories format version: '
+                         '{}'.format(header['version']))
+    if not header['complete']:
+        raise ValueError('Trajectories file was not closed: ' + path)
+    columns = {}
+    for name, column in header['columns'].items():
+        shape = (header['rows'],) + tuple(column['shape'])
+        column_path = os.path.join(path, name + '.bin')
+        if mmap_mode is None or not header['rows']:
+            columns[name] = np.fromfile(column_path, column['dtype']
+                                        ).reshape(shape)
+        else:
+            columns[name] = np.memmap(column_path, column['dtype'],
+                                      mmap_mode, shape=shape)
+    return columns
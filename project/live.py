@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Live blob tracking of a camera, network stream or pipe (see helpers.live)
+- runs without display. Estimates of every processed frame are written
+(frame,ID,x,y) as soon as they are known, latency percentiles are printed
+at the end. Video files are replayed at their frame rate (or --fps), as a
+stand-in for a camera.
+Example of use (from the project directory):
+    python -m live 0 --parameters results.json --max-latency 50
+    python -m live CIMG4027.MOV --fps 30 --output tracks.csv
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import cv2
+
+from headless import add_parameter_arguments, parameters_from_arguments
+from helpers.functions import blob_detect
+from helpers.instrumentation import LOG_LEVELS, METRICS, configure_logging
+from helpers.live import ReplayCapture, track_live
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Live multiple blob tracker.')
+    parser.add_argument('source',
+                        help='Camera index, stream URL, GStreamer pipeline '
+                             'or video file (replayed in real time).')
+    parser.add_argument('--fps', type=float, default=None,
+                        help='Frame rate of the replayed video file, frame '
+                             'rate of the file by default.')
+    parser.add_argument('--max-latency', type=float, default=100.,
+                        metavar='MS',
+                        help='Latency target - frames which would be done '
+                             'later are dropped.')
+    parser.add_argument('--max-frames', type=int, default=None,
+                        help='Stop after the number of processed frames.')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='Stop after the number of seconds.')
+    parser.add_argument('--output', default='-',
+                        help='Estimates output file (frame,ID,x,y), '
+                             '- for standard output.')
+    parser.add_argument('--report', default=None,
+                        help='JSON file for the frame counts and latency '
+                             'percentiles.')
+    parser.add_argument('--log-level', default='WARNING',
+                        choices=LOG_LEVELS,
+                        help='Lowest printed log level.')
+    parser.add_argument('--metrics', default=None,
+                        help='JSON file for timers of the stages.')
+    add_parameter_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def open_source(source, fps=None):
+    """
+    :param source: camera index, path to the video file, URL or pipeline.
+    :param fps: frame rate of the replayed video file.
+    :return: cv2.VideoCapture like object.
+    """
+    if source.isdigit():
+        return cv2.VideoCapture(int(source))
+    if os.path.isfile(source):
+        return ReplayCapture(source, fps)
+    return cv2.VideoCapture(source)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure_logging(args.log_level)
+    parameters = parameters_from_arguments(args)
+    capture = open_source(args.source, args.fps)
+    if not capture.isOpened():
+        sys.exit('Unable to open: ' + args.source)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    output.write('frame,ID,x,y\n')
+
+    def write(number, ids, positions):
+        output.write(''.join(map('{},{},{!r},{!r}\n'.format, [number] * len(
+            ids), ids.tolist(), positions[:, 0].tolist(),
+            positions[:, 1].tolist())))
+        output.flush()
+
+    try:
+        report = track_live(capture, parameters, write,
+                            args.max_latency / 1000., args.max_frames,
+                            args.duration, blob_detect)
+    except KeyboardInterrupt:
+        report = None
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if report is not None:
+        print(json.dumps(report, indent=4), file=sys.stderr)
+        if args.report:
+            with open(args.report, 'w') as report_file:
+                json.dump(report, report_file, indent=4)
+    if args.metrics:
+        METRICS.dump(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
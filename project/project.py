@@ -1,20 +1,29 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import json
+import os
+
 import cv2
 import numpy as np
 import matplotlib
 matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 import pyforms
-from numpy import dot
 from pyforms import BaseWidget
 from pyforms.controls import ControlButton, ControlText, ControlSlider, \
     ControlFile, ControlPlayer, ControlCheckBox, ControlCombo, ControlProgress
-from scipy.spatial.distance import squareform, pdist
 
-from helpers.functions import get_log_kernel, inv, linear_sum_assignment, \
-    local_maxima, select_frames, local_maxima_blobs, blob_detect
+from helpers.detection_cache import DetectionCache, cached_items, \
+    detection_key
+from helpers.frame_cache import CachedCapture, FrameCache
+from helpers.functions import iter_frames, blob_detect
+from helpers.output import ResultsWriter, track_and_render
+from helpers.parallel import default_workers, parallel_detect
+from helpers.pipeline import DEFAULT_PARAMETERS as PROCESSING_PARAMETERS, \
+    detect_blobs
+from helpers.preview import StageCache, preview_frame
+from helpers.tracking import DEFAULT_PARAMETERS as TRACKING_PARAMETERS
 from helpers.video_window import VideoWindow
 
 
@@ -32,6 +41,19 @@ class MultipleBlobDetection(BaseWidget):
         self._threshold.value = 114
         self._threshold.min = 1
         self._threshold.max = 255
+        self._threshold_mode = ControlCombo('Threshold Mode')
+        self._threshold_mode.add_item('Fixed', 'fixed')
+        self._threshold_mode.add_item('Otsu', 'otsu')
+        self._threshold_mode.add_item('Adaptive Otsu (tiles)', 'adaptive')
+        # weight of the previous frames thresholds in percents
+        self._threshold_smoothing = ControlSlider('Threshold Smoothing [%]')
+        self._threshold_smoothing.value = 0
+        self._threshold_smoothing.min = 0
+        self._threshold_smoothing.max = 99
+        self._threshold_tiles = ControlSlider('Threshold Tiles')
+        self._threshold_tiles.value = 4
+        self._threshold_tiles.min = 1
+        self._threshold_tiles.max = 16
         self._roi_x_min = ControlSlider('ROI x top')
         self._roi_x_max = ControlSlider('ROI x bottom')
         self._roi_y_min = ControlSlider('ROI y left')
@@ -39,6 +61,12 @@ class MultipleBlobDetection(BaseWidget):
         # self._blobsize = ControlSlider('Minimum blob size', 100, 100, 2000)
         self._player = ControlPlayer('Player')
         self._runbutton = ControlButton('Run')
+        self._savebutton = ControlButton('Save parameters')
+        # decoded frames of the run are kept on disk for the next runs and
+        # the player
+        self._frame_cache = ControlCheckBox('Cache Decoded Frames')
+        # measurements are reused by runs with changed tracking parameters
+        self._detection_cache = ControlCheckBox('Cache Detections')
         self._start_frame = ControlText('Start Frame')
         self._stop_frame = ControlText('Stop Frame')
 
@@ -48,6 +76,16 @@ class MultipleBlobDetection(BaseWidget):
         self._color_list.add_item('Blue Image Channel', 0)
 
         self._clahe = ControlCheckBox('CLAHE      ')
+        # background model learns from the sequence of frames, so it's used
+        # by the Run only, the player shows frames without it
+        self._background = ControlCombo('Background Subtraction')
+        self._background.add_item('None', 'none')
+        self._background.add_item('MOG2', 'MOG2')
+        self._background.add_item('KNN', 'KNN')
+        self._background_scale = ControlSlider('Background Model Scale [%]')
+        self._background_scale.value = 100
+        self._background_scale.min = 10
+        self._background_scale.max = 100
         self._dilate = ControlCheckBox('Morphological Dilation')
         self._dilate_type = ControlCombo('Dilation Kernel Type')
         self._dilate_type.add_item('RECTANGLE', cv2.MORPH_RECT)
@@ -98,12 +136,22 @@ class MultipleBlobDetection(BaseWidget):
         self._LoG_size.min = 1
         self._LoG_size.max = 60
 
+        self._detector = ControlCombo('Detector')
+        self._detector.add_item('Blobs', 'blobs')
+        self._detector.add_item('Local maxima', 'peaks')
+        self._peaks_size = ControlSlider('Local Maxima Size')
+        self._peaks_size.value = 27
+        self._peaks_size.min = 3
+        self._peaks_size.max = 101
+
         self._progress_bar = ControlProgress('Progress Bar')
 
         # Define the function that will be called when a file is selected
         self._videofile.changed_event = self.__video_file_selection_event
         # Define the event that will be called when the run button is processed
         self._runbutton.value = self.__run_event
+        # Define the event that saves parameters for headless runs
+        self._savebutton.value = self.__save_parameters_event
         # Define the event called before showing the image in the player
         self._player.process_frame_event = self.__process_frame
         
@@ -115,14 +163,19 @@ class MultipleBlobDetection(BaseWidget):
             ('_start_frame', '_stop_frame'),
             ('_color_list', '_clahe', '_roi_x_min', '_roi_y_min'),
             ('_threshold_box', '_threshold', '_roi_x_max', '_roi_y_max'),
+            ('_threshold_mode', '_threshold_smoothing', '_threshold_tiles'),
+            ('_background', '_background_scale'),
             ('_dilate', '_erode', '_open', '_close'),
             ('_dilate_type', '_erode_type', '_open_type', '_close_type'),
             ('_dilate_size', '_erode_size', '_open_size', '_close_size'),
-            ('_LoG', '_LoG_size'),
-            ('_runbutton', '_progress_bar'),
+            ('_LoG', '_LoG_size', '_detector', '_peaks_size'),
+            ('_runbutton', '_savebutton', '_frame_cache', '_detection_cache',
+             '_progress_bar'),
             '_player'
         ]
         self.is_roi_set = False
+        self._roi_shape = None
+        self._preview_cache = StageCache()
         
         self.max_num_objects = 75000
         self.blob_detector = blob_detect()
@@ -142,99 +195,66 @@ class MultipleBlobDetection(BaseWidget):
         When the video file is selected instanciate the video in the player
         """
         self._player.value = self._videofile.value
+        self._preview_cache.clear()
 
-    def __color_channel(self, frame):
+    def _parameters(self):
         """
-        Returns only one color channel of input frame.
-        Output is in grayscale.
+        Collects processing and tracking parameters from the form fields.
+        :return: dictionary of parameters.
         """
-        frame = frame[:, :, self._color_list.value]
-        return frame
-
-    def __create_kernels(self):
+        parameters = dict(PROCESSING_PARAMETERS)
+        parameters.update(TRACKING_PARAMETERS)
+        parameters['max_num_objects'] = self.max_num_objects
+        parameters.update({
+            'color_channel': self._color_list.value,
+            'clahe': self._clahe.value,
+            'background': self._background.value,
+            'background_scale': self._background_scale.value / 100.,
+            'roi': (self._roi_x_min.value, self._roi_x_max.value,
+                    self._roi_y_min.value, self._roi_y_max.value),
+            'threshold': self._threshold.value,
+            'threshold_mode': self._threshold_mode.value,
+            'threshold_smoothing': self._threshold_smoothing.value / 100.,
+            'threshold_tiles': self._threshold_tiles.value,
+            'erode': self._erode.value,
+            'erode_type': self._erode_type.value,
+            'erode_size': self._erode_size.value,
+            'open': self._open.value,
+            'open_type': self._open_type.value,
+            'open_size': self._open_size.value,
+            'close': self._close.value,
+            'close_type': self._close_type.value,
+            'close_size': self._close_size.value,
+            'dilate': self._dilate.value,
+            'dilate_type': self._dilate_type.value,
+            'dilate_size': self._dilate_size.value,
+            'LoG': self._LoG.value,
+            'LoG_size': self._LoG_size.value,
+            'detector': self._detector.value,
+            'peaks_size': self._peaks_size.value,
+        })
+        return parameters
+
+    def __save_parameters_event(self):
         """
-        Creates kernels for morphological operations.
-        Check cv2.getStructuringElement() doc for more info:
-        http://docs.opencv.org/3.0-beta/doc/py_tutorials/py_imgproc/
-        py_morphological_ops/py_morphological_ops.html
-
-        Assumed that all kernels (except LoG kernel) are square.
-        Example of use:
-        open_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (19, 19))
-        erosion_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        dilate_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        :return: _opening_kernel, _close_kernel, _erosion_kernel, \
-            _dilate_kernel, _LoG_kernel
+        Saves current parameters next to the results output file, so the
+        same analysis can be run without GUI: python -m headless.
         """
-        if self._open_type.value and self._open_size.value:
-            _opening_kernel = cv2.getStructuringElement(self._open_type.value,
-                                                        (self._open_size.value,
-                                                         self._open_size.value))
-        else:
-            _opening_kernel = None
-
-        if self._close_type.value and self._close_size.value:
-            _close_kernel = cv2.getStructuringElement(self._close_type.value,
-                                                      (self._close_size.value,
-                                                       self._close_size.value))
-        else:
-            _close_kernel = None
-
-        if self._erode_type.value and self._erode_size.value:
-            _erosion_kernel = cv2.getStructuringElement(self._erode_type.value,
-                                                        (self._erode_size.value,
-                                                         self._erode_size.value))
-        else:
-            _erosion_kernel = None
-
-        if self._dilate_type.value and self._dilate_size.value:
-            _dilate_kernel = cv2.getStructuringElement(self._dilate_type.value,
-                                                       (self._dilate_size.value,
-                                                        self._dilate_size.value))
-        else:
-            _dilate_kernel = None
-
-        if self._LoG.value and self._LoG_size.value:
-            _LoG_kernel = get_log_kernel(self._LoG_size.value,
-                                         int(self._LoG_size.value * 0.5))
-        else:
-            _LoG_kernel = None
+        path = os.path.splitext(self._outputfile.value or 'results')[0] + \
+            '.json'
+        with open(path, 'w') as parameters_file:
+            json.dump(self._parameters(), parameters_file, indent=4)
+        self._progress_bar.label = 'Parameters saved: ' + path
 
-        return _opening_kernel, _close_kernel, _erosion_kernel, \
-            _dilate_kernel, _LoG_kernel
-
-    def __morphological(self, frame):
-        """
-        Apply morphological operations selected by the user.
-        :param frame: input frame of selected video.
-        :return: preprocessed frame.
-        """
-        opening_kernel, close_kernel, erosion_kernel, \
-        dilate_kernel, log_kernel = self.__create_kernels()
-        # prepare image - morphological operations
-        if self._erode.value:
-            frame = cv2.erode(frame, erosion_kernel, iterations=1)
-        if self._open.value:
-            frame = cv2.morphologyEx(frame, cv2.MORPH_OPEN, opening_kernel)
-        if self._close.value:
-            frame = cv2.morphologyEx(frame, cv2.MORPH_CLOSE, close_kernel)
-        if self._dilate.value:
-            frame = cv2.dilate(frame, dilate_kernel, iterations=1)
-            # create LoG kernel for finding local maximas
-        if self._LoG.value:
-            frame = cv2.filter2D(frame, cv2.CV_32F, log_kernel)
-            frame *= 255
-            # remove near 0 floats
-            frame[frame < 1e-5] = 0
-            frame = frame.astype('uint8')
-        return frame
-
-    def __roi(self, frame):
+    def __roi_sliders(self, shape):
         """
-        Define image region of interest.
+        Adjust ROI sliders to the video resolution. Sliders are touched only
+        when resolution changes, so user settings are kept while scrubbing.
         """
-        # ROI
-        height, width = frame.shape
+        if self._roi_shape == shape:
+            return
+        self._roi_shape = shape
+        height, width = shape
         self._roi_x_max.min = int(height / 2)
         self._roi_x_max.max = height
         self._roi_y_max.min = int(width / 2)
@@ -250,279 +270,46 @@ class MultipleBlobDetection(BaseWidget):
             self._roi_y_max.value = width
             self.is_roi_set = True
 
-        # x axis
-        frame[:int(self._roi_x_min.value)][::] = 255
-        frame[int(self._roi_x_max.value)::][::] = 255
-        # y axis
-        for m in range(height):  # height
-            for n in range(width):  # width
-                if n > self._roi_y_max.value or n < self._roi_y_min.value:
-                    frame[m][n] = 255
+    def _kalman(self, items, stop_frame, parameters=None, measurements=None):
+        """
+        Runs Kalman filter on the measurements and writes results of every
+        frame as soon as it's done, see helpers.output.track_and_render().
+        Progress is shown on the progress bar.
+        :param items: (frame, points) pairs of the decoded frames.
+        :param stop_frame: number of frames to analise.
+        :param parameters: dictionary of filter parameters.
+        :param measurements: optional list for measurements of every frame.
+        :return: store - TrajectoryStore with estimates, est_number - number
+                 of estimated objects.
+        """
+        self._progress_bar.label = 'Processing frames, generating position ' \
+                                   'estimates and writing results..'
+        self._progress_bar.value = 0
 
-        # frame[0::][:int(self._roi_y_min.value)] = 255
-        # frame[0::][int(self._roi_y_max.value):] = 255
-        return frame
+        def progress(value):
+            self._progress_bar.value = value
 
-    def _kalman(self, max_points, stop_frame, vid_fragment):
+        writer = ResultsWriter(self._outputfile.value)
+        return track_and_render(items, stop_frame, parameters, writer,
+                                progress, measurements)
+
+    def _plot_points(self, frame_shape, max_points, store):
         """
-        Kalman Filter function. Takes measurements from video analyse function
-        and estimates positions of detected objects. Munkres algorithm is used
-        for assignments between estimates (states) and measurements.
-        :param max_points: measurements.
-        :param stop_frame: number of frames to analise
-        :param vid_fragment: video fragment for estimates displaying
-        :return: x_est, y_est - estimates of x and y positions in the following
-                 format: x_est[index_of_object][frame] gives x position of object
-                 with index = [index_of_object] in the frame = [frame]. The same
-                 goes with y positions.
+        Plots raw measurements and estimated trajectories.
+        :param frame_shape: (height, width) of the video frames.
+        :param max_points: measurements - list of (x, y) lists per frame.
+        :param store: TrajectoryStore with estimates.
         """
-        # font for displaying info on the image
-        index_error = 0
-        value_error = 0
-        # step of filter
-        dt = 1.
-        R_var = 1  # measurements variance between x-x and y-y
-        # Q_var = 0.1  # model variance
-        # state covariance matrix - no initial covariances, variances only
-        # [10^2 px, 10^2 px, ..] -
-        P = np.diag([100, 100, 10, 10, 1, 1])
-        # state transition matrix for 6 state variables
-        # (position - velocity - acceleration,
-        # x, y)
-        F = np.array([[1, 0, dt, 0, 0.5 * pow(dt, 2), 0],
-                      [0, 1, 0, dt, 0, 0.5 * pow(dt, 2)],
-                      [0, 0, 1, 0, dt, 0],
-                      [0, 0, 0, 1, 0, dt],
-                      [0, 0, 0, 0, 1, 0],
-                      [0, 0, 0, 0, 0, 1]])
-        # x and y coordinates only - measurements matrix
-        H = np.array([[1., 0., 0., 0., 0., 0.],
-                      [0., 1., 0., 0., 0., 0.]])
-        # no initial corelation between x and y positions - variances only
-        R = np.array(
-            [[R_var, 0.], [0., R_var]])  # measurement covariance matrix
-        # Q must be the same shape as P
-        Q = np.diag([100, 100, 10, 10, 1, 1])  # model covariance matrix
-
-        # create state vectors, max number of states - as much as frames
-        x = np.zeros((self.max_num_objects, 6))
-        # state initialization - initial state is equal to measurements
-        m = 0
-        try:
-            for i in range(len(max_points[0])):
-                if max_points[0][i][0] > 0 and max_points[0][i][1] > 0:
-                    x[m] = [max_points[0][i][0], max_points[0][i][1],
-                            0, 0, 0, 0]
-                    m += 1
-        except IndexError:
-            index_error = 1
-
-        est_number = 0
-        # number of estimates at the start
-        try:
-            for point in max_points[::][0]:
-                if point[0] > 0 and point[1] > 0:
-                    est_number += 1
-        except IndexError:
-            index_error = 1
-
-        # history of new objects appearance
-        new_obj_hist = [[]]
-        # difference between position of n-th object in m-1 frame and position
-        # of the same object in m frame
-        diff_2 = [[]]
-        # for how many frames given object was detected
-        frames_detected = []
-        # x and y posterior positions (estimates) for drawnings
-        x_est = [[] for i in range(stop_frame)]
-        y_est = [[] for i in range(stop_frame)]
-
-        # variable for counting frames where object has no measurement
-        striked_tracks = np.zeros(stop_frame)
-        removed_states = []
-        new_detection = []
-        ff_nr = 0  # frame number
-
-        self._progress_bar.label = '3/4: Generating position estimates..'
-        self._progress_bar.value = 0
-        print('3/4: Generating position estimates...')
-
-        # kalman filter loop
-        for frame in range(stop_frame):
-            self._progress_bar.value = 100 * (ff_nr / stop_frame)
-            # measurements in one frame
-            try:
-                frame_measurements = max_points[::][frame]
-            except IndexError:
-                index_error = 1
-
-            measurements = []
-            # make list of lists, not tuples; don't take zeros,
-            # assuming it's image
-            if not index_error:
-                for meas in frame_measurements:
-                    if meas[0] > 0 and meas[1] > 0:
-                        measurements.append([meas[0], meas[1]])
-            # count prior
-            for i in range(est_number):
-                x[i][::] = dot(F, x[i][::])
-            P = dot(F, P).dot(F.T) + Q
-            S = dot(H, P).dot(H.T) + R
-            K = dot(P, H.T).dot(inv(S))
-            ##################################################################
-            # prepare for update phase -> get (prior - measurement) assignment
-            posterior_list = []
-            for i in range(est_number):
-                if not np.isnan(x[i][0]) and not np.isnan(x[i][1]):
-                    posterior_list.append(i)
-                    # print(i)
-            # print(posterior_list)
-            #
-            # print('state\n', x[0:est_number, 0:2])
-            # print('\n')
-            #    temp_matrix = np.array(x[0:est_number, 0:2])
-            try:
-                temp_matrix = np.array(x[posterior_list, 0:2])
-                temp_matrix = np.append(temp_matrix, measurements, axis=0)
-            except ValueError:
-                value_error = 1
-
-            # print(temp_matrix)
-            distance = pdist(temp_matrix, 'euclidean')  # returns vector
-
-            # make square matrix out of vector
-            distance = squareform(distance)
-            temp_distance = distance
-            # remove elements that are repeated - (0-1), (1-0) etc.
-            #    distance = distance[est_number::, 0:est_number]
-            distance = distance[0:len(posterior_list), len(posterior_list)::]
-
-            # munkres
-            row_index, column_index = linear_sum_assignment(distance)
-            final_cost = distance[row_index, column_index].sum()
-            unit_cost = []
-            index = []
-            for i in range(len(row_index)):
-                # index(object, measurement)
-                index.append([row_index[i], column_index[i]])
-                unit_cost.append(distance[row_index[i], column_index[i]])
-
-            ##################################################################
-            # index correction - take past states into account
-            removed_states.sort()
-            for removed_index in removed_states:
-                for i in range(len(index)):
-                    if index[i][0] >= removed_index:
-                        index[i][0] += 1
-            ##################################################################
-            # find object to reject
-            state_list = [index[i][0] for i in range(len(index))]
-            reject = np.ones(len(posterior_list))
-            i = 0
-            for post_index in posterior_list:
-                if post_index not in state_list:
-                    reject[i] = 0
-                i += 1
-            # check if distance (residual) isn't to high for assignment
-            for i in range(len(unit_cost)):
-                if unit_cost[i] > 20:
-                    # print('cost to high, removing', i)
-                    reject[i] = 0
-
-            ##################################################################
-            # update phase
-            for i in range(len(index)):
-                # find object that should get measurement next
-                # count residual y: measurement - state
-                if index[i][1] >= 0:
-                    y = np.array([measurements[index[i][1]] -
-                                  dot(H, x[index[i][0], ::])])
-                    # posterior
-                    x[index[i][0], ::] = x[index[i][0], ::] + dot(K, y.T).T
-                    # append new positions
-                #        if x[i][0] and x[i][1]:
-
-                x_est[index[i][0]].append({'frame': frame,
-                                           'x_position': [x[index[i][0], 0]][0],
-                                           'index': index[i][0]})
-                y_est[index[i][0]].append({'frame': frame,
-                                           'y_position': [x[index[i][0], 1]][0],
-                                           'index': index[i][0]})
-
-            # posterior state covariance matrix
-            P = dot(np.identity(6) - dot(K, H), P)
-            print('posterior\n', x[0:est_number, 0:2])
-            ##################################################################
-            # find new objects and create new states for them
-            new_index = []
-            measurement_indexes = []
-            for i in range(len(index)):
-                if index[i][1] >= 0.:
-                    # measurements that have assignment
-                    measurement_indexes.append(index[i][1])
-
-            for i in range(len(measurements)):
-                if i not in measurement_indexes:
-                    # find measurements that don't have assignments
-                    new_index.append(i)
-            new_detection.append([measurements[new_index[i]]
-                                  for i in range(len(new_index))])
-            x_max = x.shape[0]
-            # for every detections in the last frame
-            for i in range(len(new_detection[frame])):
-                # add new estimate only if it's near nozzles
-                # TODO: make it possible to choose where to add new estimates
-                #if new_detection[frame][i] and \
-                #                new_detection[frame][i][0] > 380:
-                
-                try:
-                    x[est_number, ::] = [new_detection[frame][i][0],
-                                         new_detection[frame][i][1], 0, 0, 0, 0]
-                    est_number += 1
-                    if est_number == x_max:
-                        break
-                except IndexError:
-                    import pdb; pdb.set_trace()
-                    print('h')
-                    # print('state added', est_number)
-                    # print('new posterior\n', x[0:est_number, 0:2])
-            ##################################################################
-            # find states without measurements and remove them
-            no_track_list = []
-            for i in range(len(reject)):
-                if not reject[i]:
-                    no_track_list.append(posterior_list[i])
-                    #    print('no_trk_list', no_track_list)
-            for track in no_track_list:
-                if track >= 0:
-                    striked_tracks[track] += 1
-                    print('track/strikes', track, striked_tracks[track])
-            for i in range(len(striked_tracks)):
-                # remove estimate if it's strike max_strike_count times
-                # (has no assigned detection for max_strike_count consecutive frames)
-                max_strike_count = 4
-                if striked_tracks[i] >= max_strike_count:
-                    x[i, ::] = [None, None, None, None, None, None]
-                    if i not in removed_states:
-                        removed_states.append(i)
-                    print('state_removed', i)
-            ff_nr += 1
-                # print(removed_states)
-                # print(index)
-            print('FRAME NUBMER: ', ff_nr)
-        return x_est, y_est, est_number
-
-    def _plot_points(self, vid_frag, max_points, x_est, y_est, est_number):
         self._progress_bar.label = '4/4: Plotting - measurements..'
         self._progress_bar.value = 0
         # plot raw measurements
-        for frame_positions in max_points:
-            for pos in frame_positions:
-                # raw measurements as red dots
-                plt.plot(pos[0], pos[1], 'r.')
+        points = np.array([pos for frame_positions in max_points
+                           for pos in frame_positions]).reshape(-1, 2)
+        # raw measurements as red dots
+        plt.plot(points[:, 0], points[:, 1], 'r.')
         # try:
         # axis size the same as frame size
-        plt.axis([0, vid_frag[0].shape[1], vid_frag[0].shape[0], 0])
+        plt.axis([0, frame_shape[1], frame_shape[0], 0])
         # except IndexError:
         #     index_error = 1
         plt.xlabel('width [px]')
@@ -530,32 +317,21 @@ class MultipleBlobDetection(BaseWidget):
         plt.title('Objects raw measurements')
         ######################################################################
         # image border - 10 px
-        x_max = vid_frag[0].shape[1] - 10
-        y_max = vid_frag[0].shape[0] - 10
+        x_max = frame_shape[1] - 10
+        y_max = frame_shape[0] - 10
 
         self._progress_bar.label = '4/4: Plotting - estimates..'
         self._progress_bar.value = 0
-        i = 0
         # plot estimated trajectories
-        for ind in range(est_number):
-            self._progress_bar.value = 100 * (i / est_number)
-            i += 1
-            # if estimate exists
-            if len(x_est[ind]):
-                for pos in range(len(x_est[ind])):
-                    # don't draw near 0 points and near max points
-                    if not np.isnan(x_est[ind][pos]['x_position']) and \
-                                    x_est[ind][pos]['x_position'] > 10 and \
-                                    y_est[ind][pos]['y_position'] > 10 and \
-                                    x_est[ind][pos]['x_position'] < x_max - 10 and \
-                                    y_est[ind][pos]['y_position'] < y_max - 10:
-                        # plot estimates as green dots
-                        plt.plot(x_est[ind][pos]['x_position'], y_est[ind][pos]['y_position'], 'g.')
-                        # plt.plot(x_est[ind][::], y_est[ind][::], 'g-')
-        # print(frame)
+        # don't draw near 0 points and near max points
+        visible = ~np.isnan(store.x) & (store.x > 10) & (store.y > 10) & \
+            (store.x < x_max - 10) & (store.y < y_max - 10)
+        # plot estimates as green dots
+        plt.plot(store.x[visible], store.y[visible], 'g.')
+        self._progress_bar.value = 100
         #  [xmin xmax ymin ymax]
         # try:
-        plt.axis([0, vid_frag[0].shape[1], vid_frag[0].shape[0], 0])
+        plt.axis([0, frame_shape[1], frame_shape[0], 0])
         # except IndexError:
         #     index_error = 1
         plt.xlabel('width [px]')
@@ -568,27 +344,18 @@ class MultipleBlobDetection(BaseWidget):
         """
         Do some processing to the frame and return the result frame
         """
-        # frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        frame = self.__color_channel(frame)
-
-        if self._clahe.value:
-            clahe = cv2.createCLAHE(clipLimit=8.0, tileGridSize=(8, 8))
-            frame = clahe.apply(frame)
-
-        frame = self.__roi(frame)
-
-        if self._threshold_box.value:
-            ret, frame = cv2.threshold(frame, self._threshold.value, 255,
-                                       cv2.THRESH_BINARY)
-            frame = self.__morphological(frame)
-        return frame
+        shape = frame.shape[:2]
+        self.__roi_sliders(shape)
+        # results of the stages are cached per frame, only stages after the
+        # changed parameter are computed again
+        return preview_frame(frame, getattr(self._player, 'video_index', None),
+                             self._parameters(), self._preview_cache,
+                             self._threshold_box.value)
 
     def __run_event(self):
         """
         After setting the best parameters run the full algorithm
         """
-        height = 0
-        width = 0
         self._parameters_check()
         if not len(self._error_massages):
             start_frame = int(self._start_frame.value)
@@ -596,115 +363,48 @@ class MultipleBlobDetection(BaseWidget):
             # pass cv2.VideoCapture object, not string
             # my_video = self._player.value
             video = self._player.value
-            # self._load_bar.__init__('Processing..')
-            vid_fragment = select_frames(video, start_frame, stop_frame)
-            try:
-                height = vid_fragment[0].shape[0]
-                width = vid_fragment[0].shape[1]
-            except IndexError:
-                self._error_massages['video'] = 'No video specified'
-
-            i = 0
-            bin_frames = []
-            # preprocess image loop
-            self._progress_bar.label = '1/4: Creating BW frames..'
-            print('1/4: Creating BW frames...')
-            self._progress_bar.value = 0
-            for frame in vid_fragment:
-                gray_frame = self.__color_channel(frame)
-                # create a CLAHE object (Arguments are optional)
-                if self._clahe.value:
-                    clahe = cv2.createCLAHE(clipLimit=8.0, tileGridSize=(8, 8))
-                    gray_frame = clahe.apply(gray_frame)
-
-                # ROI
-                gray_frame = self.__roi(gray_frame)
-                ret, th1 = cv2.threshold(gray_frame, self._threshold.value, 255,
-                                         cv2.THRESH_BINARY)
-                # frame_thresh1 = otsu_binary(cl1)
-                bin_frames.append(th1)
-                self._progress_bar.value = 100 * (i / len(vid_fragment))
-                i += 1
-
-            i = 0
+            if self._frame_cache.value:
+                video = FrameCache().capture(self._videofile.value,
+                                             start_frame, stop_frame)
+                # player reads the cached frames of the run from now on
+                self._player.value = CachedCapture(video.frames, start_frame,
+                                                   video.fps)
+            height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.__roi_sliders((height, width))
+            parameters = self._parameters()
+
+            # streaming pipeline - every frame is decoded once, preprocessed
+            # and searched for local maximas just before Kalman filter needs
+            # it, then annotated and written, preprocessing runs in a pool of
+            # processes on multicore machines
+            frames = iter_frames(video, start_frame, stop_frame)
             maxima_points = []
-            # gather measurements loop
-            
-            self._progress_bar.label = '2/4: Finding local maximas..'
-            self._progress_bar.value = 0
-            print('2/4: Finding local maxima...')
-            for frame in bin_frames:
-                frame = self.__morphological(frame)
-                # get local maximas of filtered image per frame
-                maxima_points.append(local_maxima_blobs(frame, self.blob_detector))
-                self._progress_bar.value = 100 * (i / len(bin_frames))
-                i += 1
+            detections = cached = None
+            if self._detection_cache.value:
+                detections = DetectionCache()
+                key = detection_key(self._videofile.value, start_frame,
+                                    stop_frame, parameters)
+                cached = detections.load(key)
+            if cached is not None:
+                # only tracking parameters changed - no detection
+                items = cached_items(cached, frames)
+            elif default_workers() > 1:
+                if self._frame_cache.value:
+                    # workers read the cache file, frames are not copied
+                    frames = video.frames
+                items = parallel_detect(frames, parameters, with_frames=True)
+            else:
+                items = detect_blobs(frames, parameters, self.blob_detector,
+                                     with_frames=True)
 
             # try:
-            x_est, y_est, est_number = self._kalman(maxima_points,
-                                                    stop_frame,
-                                                    vid_fragment)
+            store, est_number = self._kalman(items, stop_frame, parameters,
+                                             maxima_points)
+            if detections is not None and cached is None:
+                detections.store(key, maxima_points)
             print('\nFinal estimates number:', est_number)
-            fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-            out_vid = cv2.VideoWriter('blob.avi', fourcc, 20, (1280, 720))
-            
-            #cv2.namedWindow(winname='frame', flags=cv2.WINDOW_KEEPRATIO)
-            cap = cv2.VideoCapture(self._videofile.value)
-            outfile = open(self._outputfile.value, 'w')
-            outfile.write('frame,ID,x,y\n')
-
-            frame_number = 0
-            while cap.isOpened():
-                ret, frame = cap.read()
-                # mark detections on the frame - blue dots
-                for pos_index in range(len(maxima_points[frame_number])):
-                    tmp_x = int(maxima_points[frame_number][pos_index][0])
-                    tmp_y = int(maxima_points[frame_number][pos_index][1])
-                    cv2.circle(frame, (tmp_x, tmp_y), 2, (255, 0, 0), -1)
-
-                # for estimates
-                for est in range(len(x_est)):
-                    if x_est[est] and y_est[est]:
-                        try:
-                            tmp_x = int(list(filter(lambda x: x['frame'] == frame_number, x_est[est]))[0]['x_position'])
-                            tmp_y = int(list(filter(lambda y: y['frame'] == frame_number, y_est[est]))[0]['y_position'])
-                            float_x = list(filter(lambda x: x['frame'] == frame_number, x_est[est]))[0]['x_position']
-                            float_y = list(filter(lambda y: y['frame'] == frame_number, y_est[est]))[0]['y_position']
-                            # mark estimates on the frame - red dots
-                            cv2.circle(frame, (tmp_x, tmp_y), 2, (0, 0, 255), -1)
-                            cv2.putText(frame, str(est),
-                                        (tmp_x + 5, tmp_y - 5),
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                                        (0, 0, 255), 1, cv2.LINE_AA)
-                            outfile.write('{},{},{},{}\n'.format(frame_number, est, float_x, float_y))
-                        except IndexError:
-                            pass
-                # draw frame counter
-                if height:
-                    cv2.putText(frame, 'f_nr: ' + str(frame_number),
-                                (50, height - 10),
-                                cv2.FONT_HERSHEY_COMPLEX, 0.3, (255, 255, 255),
-                                1, cv2.LINE_AA)
-
-                #cv2.imshow(winname='frame', mat=frame)
-                out_vid.write(frame)
-                frame_number += 1
-                #if cv2.waitKey(100) & 0xFF == ord('q') or \
-                #        frame_number >= int(self._stop_frame.value):
-                #    break
-                if cv2.waitKey(100) & 0xFF == ord('q') or \
-                        frame_number == len(maxima_points):
-                    break
-
-            cap.release()
-            out_vid.release()
-            cv2.destroyAllWindows()
-            #self._plot_points(vid_fragment, maxima_points, x_est,
-            #                  y_est, est_number)
-            # except IndexError:
-            #     self._progress_bar.label += ' ' + 'ERROR while generating estimates. ' \
-            #                                       'Try adjusting parameters.'
-            outfile.close()
+            #self._plot_points((height, width), maxima_points, store)
         else:
             self._progress_bar.label = 'WRONG PARAMETERS:'
             for key in self._error_massages: